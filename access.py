@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+
+######################################################################
+# @author      : Ruan E. Formigoni (ruanformigoni@gmail.com)
+# @file        : access
+# @description : Record the file access order of runners at launch
+######################################################################
+
+import argparse
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+import headless
+import layer
+import verify
+
+SCRIPT_DIR = Path(__file__).parent
+
+TRACE_TIMEOUT = 120
+
+# System calls recorded, mirrors GAMEIMAGE_ACCESS_LOG in the boot scripts
+STRACE_ARGS = ["-f", "-qq", "-e", "trace=execve,open,openat,openat2", "-e", "status=successful"]
+
+# Path argument of a recorded call, lines are prefixed with the pid
+# e.g., 1234 openat(AT_FDCWD, "/opt/gameimage/runners/...", O_RDONLY|O_CLOEXEC) = 3
+ACCESS = re.compile(r'^(?:\d+\s+)?(?:execve|open|openat|openat2)\((?:[^",]*, )?"((?:[^"\\]|\\.)*)"')
+
+
+def list_runners(image_path, layer_path):
+  """
+  List the runner version directories of a layer as seen in the container.
+
+  Args:
+    image_path: Path to the flatimage
+    layer_path: Path to the layer file
+
+  Returns:
+    List of absolute paths in the container
+  """
+  result = subprocess.run(
+    [str(image_path), "fim-exec", "sh", "-c", "ls -d /opt/gameimage/runners/*/*/*/*/*/*"],
+    capture_output=True,
+    text=True,
+    env=headless.container_env(image_path, layer_path),
+  )
+  return result.stdout.split()
+
+
+def trace_runner(image_path, layer_path, version_dir, args, log_path, env_vars=()):
+  """
+  Launch a runner headless with its boot script and record the files it opens.
+
+  The boot script traces the runner with strace from the container, if the container has
+  no strace the launch is traced with the strace of the host.
+
+  Args:
+    image_path: Path to the flatimage
+    layer_path: Path to the layer file
+    version_dir: Runner version directory in the container
+    args: Arguments for the boot script
+    log_path: strace output file, must be visible in the container
+    env_vars: Additional VAR=value environment of the boot script, e.g., WINEPREFIX
+
+  Returns:
+    True if a log was recorded, False otherwise
+  """
+  env = headless.container_env(image_path, layer_path)
+
+  # Probed first, a launch without strace would run up to the timeout for nothing
+  probe = subprocess.run([str(image_path), "fim-exec", "sh", "-c", "command -v strace"], capture_output=True, env=env)
+  if probe.returncode == 0:
+    prefix = []
+  elif shutil.which("strace"):
+    prefix = ["strace", *STRACE_ARGS, "-o", str(log_path)]
+  else:
+    print(f"Error: no strace found to trace {version_dir}", file=sys.stderr)
+    return False
+
+  command = [
+    str(image_path), "fim-exec", "env", *headless.ENV, *env_vars,
+    f"GAMEIMAGE_ACCESS_LOG={log_path}", f"{version_dir}/boot", *args,
+  ]
+  try:
+    subprocess.run([*prefix, *command], capture_output=True, timeout=TRACE_TIMEOUT, env=env)
+  except subprocess.TimeoutExpired:
+    print(f"Timed out after {TRACE_TIMEOUT}s: {version_dir}", file=sys.stderr)
+
+  return log_path.exists() and log_path.stat().st_size > 0
+
+
+def parse_access_log(log_path, version_dir):
+  """
+  Extract the files opened inside a runner version directory in order.
+
+  Args:
+    log_path: strace output file
+    version_dir: Runner version directory in the container
+
+  Returns:
+    List of unique paths relative to version_dir, in first access order
+  """
+  prefix = version_dir.rstrip("/") + "/"
+  paths = []
+  for line in log_path.read_text(errors="replace").splitlines():
+    if (match := ACCESS.match(line)) and match.group(1).startswith(prefix):
+      paths.append(os.path.normpath(match.group(1)[len(prefix):]))
+  return list(dict.fromkeys(paths))
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Record the file access order of runners at launch")
+  parser.add_argument("image", type=Path, help="Path to the flatimage")
+  parser.add_argument("layers", nargs="+", type=Path, help="Runner layer files")
+  parser.add_argument("--args", nargs=argparse.REMAINDER,
+    help="Arguments for the boot scripts (default: the probe arguments of verify.py)")
+  parser.add_argument("--output-dir", type=Path, default=SCRIPT_DIR,
+    help=f"Where to write {{platform}}/{layer.ACCESS_FILE} (default: this repository)")
+  args = parser.parse_args()
+
+  if not args.image.is_file():
+    print(f"Error: {args.image} is not a regular file")
+    sys.exit(1)
+
+  # Logs are written under the build directory, the container only sees the home directory
+  build_dir = SCRIPT_DIR / "build"
+  build_dir.mkdir(exist_ok=True)
+  tmp_dir = Path(tempfile.mkdtemp(prefix="trace-", dir=build_dir))
+
+  # Structure: access[platform] = [paths], the first traced runner sets the order
+  access = {}
+  try:
+    for i, layer_path in enumerate(args.layers):
+      for j, version_dir in enumerate(list_runners(args.image, layer_path)):
+        platform = Path(version_dir).parts[4]
+        boot_args = args.args if args.args is not None else verify.PROBES.get(platform, (None, []))[1]
+        log_path = tmp_dir / f"{i}-{j}.log"
+
+        # wine.sh requires a prefix, a new one is created for the launch
+        env_vars = []
+        if platform == "wine":
+          prefix_dir = tmp_dir / f"{i}-{j}-prefix"
+          prefix_dir.mkdir()
+          env_vars.append(f"WINEPREFIX={prefix_dir.resolve()}")
+
+        print(f"Tracing {version_dir} {' '.join(boot_args)}")
+        if not trace_runner(args.image, layer_path, version_dir, boot_args, log_path, env_vars):
+          print("  No files recorded", file=sys.stderr)
+          continue
+
+        paths = parse_access_log(log_path, version_dir)
+        print(f"  {len(paths)} files opened")
+        access[platform] = list(dict.fromkeys(access.get(platform, []) + paths))
+  finally:
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+  for platform, paths in sorted(access.items()):
+    output = args.output_dir / platform / layer.ACCESS_FILE
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(
+      "# Files opened at launch, recorded by access.py\n" + "".join(f"{p}\n" for p in paths)
+    )
+    print(f"Wrote {len(paths)} paths to {output}")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+
+######################################################################
+# @author      : Ruan E. Formigoni (ruanformigoni@gmail.com)
+# @file        : bench
+# @description : Measure cold mount and launch read times of layers
+######################################################################
+
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import layer
+
+SCRIPT_DIR = Path(__file__).parent
+
+# Reads the files of each runner that are read at launch, a stand-in for the time to first
+# frame that needs no GPU
+HOT_READ = (
+  "for d in /opt/gameimage/runners/*/*/*/*/*/*/; do for f in "
+  + " ".join(f'"$d"{p}' for p in layer.HOT_PATTERNS)
+  + '; do if [ -f "$f" ]; then cat "$f"; fi; done; done > /dev/null'
+)
+
+
+def evict(path):
+  """
+  Drop the pages of a file from the page cache, so the next read is cold.
+
+  Args:
+    path: Path to the file
+  """
+  with open(path, "rb") as f:
+    os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+def timed_run(image_path, layer_path, command):
+  """
+  Run a command in the container with a layer mounted, starting with a cold page cache.
+
+  Args:
+    image_path: Path to the flatimage
+    layer_path: Path to the layer file
+    command: Command list
+
+  Returns:
+    Elapsed time in milliseconds or None if failed
+  """
+  evict(layer_path)
+  start = time.monotonic()
+  result = subprocess.run(
+    [str(image_path), "fim-exec", *command],
+    capture_output=True,
+    env={**os.environ, "FIM_DIRS_LAYER": str(Path(layer_path).resolve())},
+  )
+  elapsed = (time.monotonic() - start) * 1000
+
+  if result.returncode != 0:
+    print(f"Error running {' '.join(command)}: {result.stderr.decode(errors='replace')}", file=sys.stderr)
+    return None
+
+  return elapsed
+
+
+def bench_layer(image_path, layer_path, runs):
+  """
+  Measure the cold mount and launch read times of a layer.
+
+  Args:
+    image_path: Path to the flatimage
+    layer_path: Path to the layer file
+    runs: Number of runs, the median is reported
+
+  Returns:
+    Dictionary with the keys size, mount_ms and launch_ms, or None if failed
+  """
+  mounts = []
+  launches = []
+  for _ in range(runs):
+    mount = timed_run(image_path, layer_path, ["true"])
+    launch = timed_run(image_path, layer_path, ["sh", "-c", HOT_READ])
+    if mount is None or launch is None:
+      return None
+    mounts.append(mount)
+    launches.append(launch)
+
+  return {
+    "size": Path(layer_path).stat().st_size,
+    "mount_ms": statistics.median(mounts),
+    "launch_ms": statistics.median(launches),
+  }
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Measure cold mount and launch read times of layers")
+  parser.add_argument("image", type=Path, help="Path to the flatimage")
+  parser.add_argument("targets", nargs="+", type=Path,
+    help="Layer files, or staged layer trees built with each profile")
+  parser.add_argument("--profiles", nargs="+", default=list(layer.PROFILES), choices=list(layer.PROFILES),
+    help="Profiles to build staged trees with (default: all)")
+  parser.add_argument("--runs", type=int, default=3, help="Runs per layer (default: 3)")
+  args = parser.parse_args()
+
+  if not args.image.is_file():
+    print(f"Error: {args.image} is not a regular file")
+    sys.exit(1)
+
+  # Layers are built under the build directory, the container only sees the home directory
+  build_dir = SCRIPT_DIR / "build"
+  build_dir.mkdir(exist_ok=True)
+  tmp_dir = Path(tempfile.mkdtemp(prefix="bench-", dir=build_dir))
+
+  try:
+    # (target name, profile, layer path)
+    layers = []
+    for target in args.targets:
+      if target.is_dir():
+        for profile in args.profiles:
+          layer_path = tmp_dir / f"{target.name}-{profile}.layer"
+          print(f"Building {layer_path.name}...")
+          if layer.create_layer(args.image, target, layer_path, profile=profile):
+            layers.append((target.name, profile, layer_path))
+      else:
+        layers.append((target.name, None, target))
+
+    print(f"\n{'Layer':<60} {'Profile':<12} {'Size MiB':>9} {'Mount ms':>9} {'Launch ms':>10}")
+    baseline = {}
+    for name, profile, layer_path in layers:
+      result = bench_layer(args.image, layer_path, args.runs)
+      if result is None:
+        print(f"{name:<60} {profile or '-':<12} failed")
+        continue
+
+      line = (
+        f"{name:<60} {profile or '-':<12} {result['size'] / 2**20:>9.1f}"
+        f" {result['mount_ms']:>9.0f} {result['launch_ms']:>10.0f}"
+      )
+      # Relative to the first profile of the same tree
+      if profile and name in baseline:
+        base = baseline[name]
+        line += (
+          f"  (mount {(result['mount_ms'] / base['mount_ms'] - 1) * 100:+.0f}%,"
+          f" launch {(result['launch_ms'] / base['launch_ms'] - 1) * 100:+.0f}%)"
+        )
+      elif profile:
+        baseline[name] = result
+      print(line)
+  finally:
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+  main()
@@ -5,6 +5,23 @@
 # @file        : build
 ######################################################################
 
+# Usage: build.sh [--resume] [--workers N] [platform...] [-- builder options]
+#
+# Without platforms, dist/ is re-created and everything is built. With platforms, only
+# their layers are rebuilt and merged into the existing dist/, options after -- go to the
+# builder of a single platform, see <platform>/build-arch.py --help, e.g.:
+#   build.sh wine -- --dists staging --versions 10.0
+#   build.sh pcsx2 -- --channels stable --stable-count 1
+#
+# --resume continues an interrupted build with the same arguments, dist/ is kept and the
+# builders reuse the stages they completed, see journal.py
+#
+# GAMEIMAGE_DELTAS=1 also creates binary deltas from previous versions, see delta.py, pairs
+# are only skipped when dist/ and its build database are kept, e.g., with --resume
+#
+# --workers N builds the layers of all selected platforms as jobs of a queue, N at a time,
+# see jobqueue.py to add workers on other hosts
+
 set -e
 
 DIR_SCRIPT="$(cd -- "$(dirname -- "${BASH_SOURCE[0]}")" && pwd)"
@@ -20,13 +37,73 @@ IMAGE="$DIR_SCRIPT"/dist/arch.flatimage
 
 export FIM_OVERLAY=unionfs
 
-rm -rf dist && mkdir dist
+# Parse arguments
+SELECTED=()
+BUILDER_ARGS=()
+WORKERS=0
+while [ $# -gt 0 ]; do
+  case "$1" in
+    --) shift; BUILDER_ARGS=("$@"); break ;;
+    --resume) export GAMEIMAGE_RESUME=1; shift ;;
+    --workers) WORKERS="$2"; shift 2 ;;
+    *)
+      if [[ ! " ${PLATFORMS[*]} " =~ " $1 " ]]; then
+        echo "Unknown platform '$1', choose from: ${PLATFORMS[*]}" >&2
+        exit 1
+      fi
+      SELECTED+=("$1"); shift ;;
+  esac
+done
+
+if [ "${#BUILDER_ARGS[@]}" -gt 0 ] && [ "${#SELECTED[@]}" -ne 1 ]; then
+  echo "Builder options need exactly one platform" >&2
+  exit 1
+fi
+
+cd "$DIR_SCRIPT"
+
+if [ "${#SELECTED[@]}" -eq 0 ]; then
+  SELECTED=("${PLATFORMS[@]}")
+  if [ "${GAMEIMAGE_RESUME:-0}" != 1 ]; then
+    rm -rf dist && mkdir dist
+  fi
+fi
 
-# Create container
-( cd container && ./build-arch.sh )
+# Create container, kept by targeted rebuilds
+if [ ! -f "$IMAGE" ]; then
+  mkdir -p dist
+  ( cd container && ./build-arch.sh )
+fi
 
 # Create layers
-for platform in "${PLATFORMS[@]}"; do
-  cd "$DIR_SCRIPT"/"$platform"
-  ./build-arch.py "$IMAGE"
-done
\ No newline at end of file
+if [ "$WORKERS" -gt 0 ]; then
+  # Jobs left running by an interrupted build are requeued, done jobs are kept
+  if [ "${GAMEIMAGE_RESUME:-0}" = 1 ]; then
+    "$DIR_SCRIPT"/jobqueue.py requeue --running
+  else
+    rm -rf "${GAMEIMAGE_QUEUE_DIR:-"$DIR_SCRIPT"/build/queue}"
+  fi
+  "$DIR_SCRIPT"/jobqueue.py plan "$IMAGE" "${SELECTED[@]}" -- "${BUILDER_ARGS[@]}"
+  # Results of done jobs are collected before status fails the build on failed jobs
+  "$DIR_SCRIPT"/jobqueue.py worker "$IMAGE" --workers "$WORKERS" || true
+  "$DIR_SCRIPT"/jobqueue.py collect
+  "$DIR_SCRIPT"/jobqueue.py status
+else
+  for platform in "${SELECTED[@]}"; do
+    cd "$DIR_SCRIPT"/"$platform"
+    ./build-arch.py "$IMAGE" "${BUILDER_ARGS[@]}"
+  done
+fi
+
+# Smoke test layers
+"$DIR_SCRIPT"/verify.py "$IMAGE"
+
+# Binary deltas from previous versions, GAMEIMAGE_DELTAS=1
+if [ "${GAMEIMAGE_DELTAS:-0}" = 1 ]; then
+  "$DIR_SCRIPT"/delta.py
+fi
+
+# Content-defined chunks of all layers, GAMEIMAGE_CHUNKS=1, the store is kept in build/
+if [ "${GAMEIMAGE_CHUNKS:-0}" = 1 ]; then
+  "$DIR_SCRIPT"/chunkstore.py
+fi
\ No newline at end of file
@@ -0,0 +1,185 @@
+######################################################################
+# @author      : Ruan E. Formigoni (ruanformigoni@gmail.com)
+# @file        : buildbot
+# @description : Parse and cache buildbot directory listings
+######################################################################
+
+import asyncio
+import codecs
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+from html.parser import HTMLParser
+from pathlib import Path
+from urllib.parse import unquote, urljoin, urlsplit
+
+import httpclient
+import source
+
+# Cached listings, revalidated with Last-Modified/ETag once older than the TTL
+CACHE_DIR = Path(os.environ.get("GAMEIMAGE_CACHE_DIR", Path(__file__).parent / "build" / "cache")) / "buildbot"
+CACHE_TTL = int(os.environ.get("GAMEIMAGE_INDEX_TTL", "900"))
+
+# Modification dates of nginx autoindex (01-Jan-2025 00:00) and ISO style listings (2025-01-01 00:00:00)
+DATE = re.compile(r'(\d{2}-[A-Za-z]{3}-\d{4} \d{2}:\d{2})|(\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}(?::\d{2})?)')
+
+# Sizes in bytes or with a unit (1048576, 1.5M, 12 KiB), "-" for directories
+SIZE = re.compile(r'(?:^|\s)(\d+(?:\.\d+)?)\s*([KMGT]?)(?:i?B)?\s*$', re.IGNORECASE)
+UNITS = {"": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3, "t": 1024 ** 4}
+
+
+class IndexParser(HTMLParser):
+  """
+  Incremental parser of a directory listing.
+
+  Collects the links to direct children of the listed directory, the text after each
+  link up to the next one holds its date and size. Feed chunks as they arrive.
+  """
+
+  def __init__(self, url):
+    super().__init__(convert_charrefs=True)
+    self.path = urlsplit(url).path.rstrip("/") + "/"
+    self.entries = []
+    self._entry = None
+    self._in_link = False
+    self._tail = []
+
+  def handle_starttag(self, tag, attrs):
+    if tag != "a":
+      # Separates table cells
+      self._tail.append(" ")
+      return
+    self._finish()
+    href = dict(attrs).get("href")
+    if not href or "?" in href or "#" in href:
+      return
+    # Only direct children, skips parent and navigation links
+    path = urlsplit(urljoin(self.path, href)).path
+    if not path.startswith(self.path) or path == self.path:
+      return
+    name = unquote(path[len(self.path):])
+    if "/" in name.rstrip("/"):
+      return
+    self._entry = {"name": name.rstrip("/"), "is_dir": name.endswith("/"), "size": None, "date": None}
+    self._in_link = True
+
+  def handle_endtag(self, tag):
+    if tag == "a":
+      self._in_link = False
+    elif tag in ("tr", "pre", "table"):
+      self._finish()
+
+  def handle_data(self, data):
+    if self._entry and not self._in_link:
+      self._tail.append(data)
+
+  def close(self):
+    super().close()
+    self._finish()
+
+  def _finish(self):
+    if self._entry is None:
+      return
+    tail = " ".join("".join(self._tail).split())
+    if match := DATE.search(tail):
+      self._entry["date"] = match.group(0)
+      tail = tail[match.end():]
+    if not self._entry["is_dir"] and (match := SIZE.search(tail)):
+      self._entry["size"] = int(float(match.group(1)) * UNITS[match.group(2).lower()])
+    self.entries.append(self._entry)
+    self._entry = None
+    self._tail = []
+
+
+def _cache_file(url):
+  return CACHE_DIR / f"{hashlib.sha256(url.encode()).hexdigest()}.json"
+
+
+def _read_cache(url):
+  try:
+    cached = json.loads(_cache_file(url).read_text())
+  except (OSError, ValueError):
+    return None
+  return cached if cached.get("url") == url else None
+
+
+def _write_cache(url, last_modified, etag, entries):
+  CACHE_DIR.mkdir(parents=True, exist_ok=True)
+  cache_file = _cache_file(url)
+  tmp = cache_file.with_suffix(".tmp")
+  tmp.write_text(json.dumps({
+    "url": url,
+    "fetched": time.time(),
+    "last_modified": last_modified,
+    "etag": etag,
+    "entries": entries,
+  }))
+  tmp.replace(cache_file)
+
+
+async def fetch_index(client, url):
+  """
+  Fetch and parse a directory listing, using the on-disk cache.
+
+  A cached listing younger than GAMEIMAGE_INDEX_TTL seconds is used without a request,
+  an older one is revalidated with If-Modified-Since/If-None-Match.
+
+  Args:
+    client: httpclient.Client
+    url: Listing URL
+
+  Returns:
+    List of entry dictionaries with the keys name, is_dir, size (bytes or None) and
+    date (as listed or None), or None if failed
+  """
+  cached = _read_cache(url)
+  if cached and time.time() - cached["fetched"] < CACHE_TTL:
+    return cached["entries"]
+
+  headers = {}
+  if cached and cached["last_modified"]:
+    headers["If-Modified-Since"] = cached["last_modified"]
+  if cached and cached["etag"]:
+    headers["If-None-Match"] = cached["etag"]
+
+  # Parse the body as it arrives
+  parser = IndexParser(url)
+  decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+  try:
+    response = await client.get(url, headers, consumer=lambda chunk: parser.feed(decoder.decode(chunk)))
+  except (httpclient.HTTPError, OSError) as e:
+    print(f"Error fetching {url}: {e}", file=sys.stderr)
+    return None
+
+  if response.status == 304 and cached:
+    _write_cache(url, cached["last_modified"], cached["etag"], cached["entries"])
+    return cached["entries"]
+
+  if response.status != 200:
+    print(f"Error fetching {url}: HTTP {response.status}", file=sys.stderr)
+    return None
+
+  parser.feed(decoder.decode(b"", final=True))
+  parser.close()
+  _write_cache(url, response.headers.get("last-modified"), response.headers.get("etag"), parser.entries)
+  return parser.entries
+
+
+def index(url):
+  """
+  Fetch and parse a directory listing, see fetch_index.
+
+  Args:
+    url: Listing URL
+
+  Returns:
+    List of entry dictionaries or None if failed
+  """
+  async def fetch():
+    async with httpclient.Client(concurrency=source.CONCURRENCY, timeout=source.TIMEOUT) as client:
+      return await fetch_index(client, url)
+
+  return asyncio.run(fetch())
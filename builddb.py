@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+
+######################################################################
+# @author      : Ruan E. Formigoni (ruanformigoni@gmail.com)
+# @file        : builddb
+# @description : Record built layers in a SQLite database
+######################################################################
+
+import argparse
+import hashlib
+import json
+import sqlite3
+import time
+from pathlib import Path
+
+# Database file, lives in the dist directory next to the layers it describes
+DB_NAME = ".build.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS layers (
+  name TEXT PRIMARY KEY,
+  platform TEXT NOT NULL,
+  owner TEXT,
+  repo TEXT,
+  distribution TEXT,
+  channel TEXT,
+  version TEXT,
+  source_url TEXT,
+  size INTEGER NOT NULL,
+  sha256 TEXT NOT NULL,
+  built_at REAL NOT NULL,
+  build_seconds REAL,
+  compression TEXT,
+  meta TEXT
+);
+CREATE INDEX IF NOT EXISTS layers_platform
+  ON layers (platform, owner, repo, distribution, channel);
+CREATE TABLE IF NOT EXISTS deltas (
+  name TEXT PRIMARY KEY,
+  layer TEXT NOT NULL,
+  base TEXT NOT NULL,
+  layer_sha256 TEXT NOT NULL,
+  base_sha256 TEXT NOT NULL,
+  size INTEGER NOT NULL,
+  sha256 TEXT NOT NULL,
+  built_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS deltas_layer ON deltas (layer);
+CREATE TABLE IF NOT EXISTS discarded_deltas (
+  name TEXT PRIMARY KEY,
+  layer_sha256 TEXT NOT NULL,
+  base_sha256 TEXT NOT NULL,
+  ratio REAL NOT NULL,
+  built_at REAL NOT NULL
+);
+"""
+
+
+def connect(dist_dir):
+  """
+  Open the build database of a dist directory, creating it if needed.
+
+  Args:
+    dist_dir: Path to the dist directory
+
+  Returns:
+    sqlite3.Connection with rows as sqlite3.Row
+  """
+  db = sqlite3.connect(Path(dist_dir) / DB_NAME, timeout=30)
+  db.row_factory = sqlite3.Row
+  db.executescript(SCHEMA)
+  return db
+
+
+def parse_layer_name(name):
+  """
+  Split a layer file name into its platform tuple.
+
+  Args:
+    name: Layer file name, e.g., wine--Kron4ek--Wine-Builds--staging--stable--10.0.layer
+
+  Returns:
+    Dictionary with the keys platform, owner, repo, distribution, channel and version,
+    the last five are None for container layers (e.g., arch--lib32.layer), or None if
+    the name has an unexpected format
+  """
+  parts = Path(name).stem.split("--")
+  keys = ["platform", "owner", "repo", "distribution", "channel", "version"]
+  if len(parts) == 6:
+    return dict(zip(keys, parts))
+  if len(parts) == 2:
+    # Container layers, the component goes in the repo column
+    return {**dict.fromkeys(keys), "platform": parts[0], "repo": parts[1]}
+  return None
+
+
+def sha256(path):
+  """
+  Checksum of a file, read from its .sha256sum file if present.
+
+  Args:
+    path: Path to the file
+
+  Returns:
+    Hex digest string
+  """
+  checksum_file = path.parent / f"{path.name}.sha256sum"
+  if checksum_file.exists():
+    return checksum_file.read_text().split()[0]
+  digest = hashlib.sha256()
+  with open(path, "rb") as f:
+    while chunk := f.read(1 << 20):
+      digest.update(chunk)
+  return digest.hexdigest()
+
+
+def record_layer(layer_path, source_url=None, build_seconds=None, compression="default", meta=None):
+  """
+  Record a layer of the dist directory, updating a previous record of the same name.
+
+  Fields that are not given keep their recorded values, e.g., for layers copied again
+  from a previous build.
+
+  Args:
+    layer_path: Path to the layer in the dist directory
+    source_url: URL the layer contents were downloaded from
+    build_seconds: Time taken to download and build the layer
+    compression: Compression profile the layer was created with
+    meta: Dictionary of additional metadata
+
+  Returns:
+    True if recorded, False if the layer name has an unexpected format
+  """
+  layer_path = Path(layer_path)
+  fields = parse_layer_name(layer_path.name)
+  if fields is None:
+    return False
+
+  with connect(layer_path.parent) as db:
+    db.execute(
+      """
+      INSERT INTO layers
+        (name, platform, owner, repo, distribution, channel, version,
+         source_url, size, sha256, built_at, build_seconds, compression, meta)
+      VALUES
+        (:name, :platform, :owner, :repo, :distribution, :channel, :version,
+         :source_url, :size, :sha256, :built_at, :build_seconds, :compression, :meta)
+      ON CONFLICT (name) DO UPDATE SET
+        source_url = COALESCE(excluded.source_url, source_url),
+        size = excluded.size,
+        sha256 = excluded.sha256,
+        built_at = excluded.built_at,
+        build_seconds = COALESCE(excluded.build_seconds, build_seconds),
+        compression = excluded.compression,
+        meta = COALESCE(excluded.meta, meta)
+      """,
+      {
+        **fields,
+        "name": layer_path.name,
+        "source_url": source_url,
+        "size": layer_path.stat().st_size,
+        "sha256": sha256(layer_path),
+        "built_at": time.time(),
+        "build_seconds": build_seconds,
+        "compression": compression,
+        "meta": json.dumps(meta) if meta else None,
+      },
+    )
+  db.close()
+  return True
+
+
+def layers(dist_dir):
+  """
+  List the recorded layers that are present in the dist directory.
+
+  Args:
+    dist_dir: Path to the dist directory
+
+  Returns:
+    List of row dictionaries ordered by platform tuple and version, empty if there is
+    no database
+  """
+  dist_dir = Path(dist_dir)
+  if not (dist_dir / DB_NAME).exists():
+    return []
+
+  db = connect(dist_dir)
+  rows = db.execute(
+    "SELECT * FROM layers ORDER BY platform, owner, repo, distribution, channel, version"
+  ).fetchall()
+  db.close()
+
+  result = []
+  for row in rows:
+    if (dist_dir / row["name"]).exists():
+      result.append({**dict(row), "meta": json.loads(row["meta"]) if row["meta"] else None})
+  return result
+
+
+def record_delta(delta_path, layer_name, base_name, layer_sha256, base_sha256):
+  """
+  Record a binary delta of the dist directory, replacing a previous record of the same name.
+
+  Args:
+    delta_path: Path to the delta in the dist directory
+    layer_name: Layer the delta reconstructs
+    base_name: Layer the delta is applied to
+    layer_sha256: Checksum of the reconstructed layer
+    base_sha256: Checksum of the base layer
+  """
+  delta_path = Path(delta_path)
+  with connect(delta_path.parent) as db:
+    db.execute(
+      "INSERT OR REPLACE INTO deltas VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+      (delta_path.name, layer_name, base_name, layer_sha256, base_sha256,
+        delta_path.stat().st_size, sha256(delta_path), time.time()),
+    )
+  db.close()
+
+
+def deltas(dist_dir):
+  """
+  List the recorded deltas whose files and layers are present in the dist directory.
+
+  Args:
+    dist_dir: Path to the dist directory
+
+  Returns:
+    List of row dictionaries ordered by layer and base, empty if there is no database
+  """
+  dist_dir = Path(dist_dir)
+  if not (dist_dir / DB_NAME).exists():
+    return []
+
+  db = connect(dist_dir)
+  rows = db.execute("SELECT * FROM deltas ORDER BY layer, base").fetchall()
+  db.close()
+
+  return [
+    dict(row) for row in rows
+    if all((dist_dir / row[k]).exists() for k in ["name", "layer", "base"])
+  ]
+
+
+def record_discarded_delta(dist_dir, name, layer_sha256, base_sha256, ratio):
+  """
+  Record a delta that was created and discarded, so it is not created again for the same
+  layer contents.
+
+  Args:
+    dist_dir: Path to the dist directory
+    name: Delta file name
+    layer_sha256: Checksum of the reconstructed layer
+    base_sha256: Checksum of the base layer
+    ratio: Size of the delta as a fraction of the layer
+  """
+  with connect(dist_dir) as db:
+    db.execute(
+      "INSERT OR REPLACE INTO discarded_deltas VALUES (?, ?, ?, ?, ?)",
+      (name, layer_sha256, base_sha256, ratio, time.time()),
+    )
+  db.close()
+
+
+def discarded_deltas(dist_dir):
+  """
+  List the recorded discarded deltas.
+
+  Args:
+    dist_dir: Path to the dist directory
+
+  Returns:
+    List of row dictionaries, empty if there is no database
+  """
+  dist_dir = Path(dist_dir)
+  if not (dist_dir / DB_NAME).exists():
+    return []
+
+  db = connect(dist_dir)
+  rows = db.execute("SELECT * FROM discarded_deltas").fetchall()
+  db.close()
+
+  return [dict(row) for row in rows]
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Record built layers in the build database")
+  subparsers = parser.add_subparsers(dest="command", required=True)
+
+  record = subparsers.add_parser("record", help="Record layers of the dist directory")
+  record.add_argument("layers", nargs="+", type=Path, help="Layer files")
+  record.add_argument("--source-url", help="URL the layer contents were downloaded from")
+  record.add_argument("--compression", default="default", help="Compression profile")
+
+  args = parser.parse_args()
+
+  if args.command == "record":
+    for layer in args.layers:
+      if not record_layer(layer, source_url=args.source_url, compression=args.compression):
+        parser.error(f"unexpected layer name: {layer.name}")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+######################################################################
+# @author      : Ruan E. Formigoni (ruanformigoni@gmail.com)
+# @file        : chunkstore
+# @description : Split layers into a deduplicated content-defined chunk store
+######################################################################
+
+import argparse
+import hashlib
+import mmap
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+SCRIPT_DIR = Path(__file__).parent
+
+# Chunk store, kept across builds, chunks live in {store}/{sha256[:2]}/{sha256}
+# The store is not published, it measures how much layers share, GAMEIMAGE_CHUNKS=1 in build.sh
+STORE_DIR = Path(os.environ.get("GAMEIMAGE_CHUNK_STORE", SCRIPT_DIR / "build" / "chunks"))
+
+# Chunks end after an occurrence of the marker, so boundaries depend on the content around
+# them and realign after insertions and removals. On uniformly distributed data, like the
+# compressed blocks of a layer, the marker shows up every 64 KiB on average.
+MARKER = b"\x8f\x1d"
+MIN_SIZE = 16 * 1024
+MAX_SIZE = 256 * 1024
+
+# Index of the chunks of a layer, {store}/index/{layer}.chunks, one "sha256 size" line per
+# chunk in order
+INDEX_SUFFIX = ".chunks"
+
+
+def boundaries(data):
+  """
+  Split a buffer into content-defined chunks.
+
+  Args:
+    data: Buffer, e.g., a mapped file
+
+  Returns:
+    Generator of (start, end) offsets
+  """
+  start = 0
+  size = len(data)
+  while start < size:
+    end = data.find(MARKER, start + MIN_SIZE, start + MAX_SIZE)
+    end = min(size, start + MAX_SIZE) if end < 0 else end + len(MARKER)
+    yield start, end
+    start = end
+
+
+def store_chunk(store_dir, digest, chunk):
+  """
+  Write a chunk to the store unless it is already there.
+
+  Returns:
+    True if the chunk was new, False otherwise
+  """
+  path = store_dir / digest[:2] / digest
+  if path.exists():
+    return False
+  path.parent.mkdir(parents=True, exist_ok=True)
+  tmp = path.with_name(f"{digest}.{os.getpid()}.{id(chunk)}.tmp")
+  tmp.write_bytes(chunk)
+  tmp.replace(path)
+  return True
+
+
+def chunk_layer(layer_path, store_dir):
+  """
+  Split a layer into the chunk store and write its index in the store.
+
+  Args:
+    layer_path: Path to the layer file
+    store_dir: Chunk store directory
+
+  Returns:
+    List of (sha256, size) tuples of the chunks of the layer
+  """
+  chunks = []
+  with open(layer_path, "rb") as f:
+    if os.fstat(f.fileno()).st_size == 0:
+      return chunks
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+      for start, end in boundaries(data):
+        chunk = data[start:end]
+        digest = hashlib.sha256(chunk).hexdigest()
+        store_chunk(store_dir, digest, chunk)
+        chunks.append((digest, end - start))
+
+  index = store_dir / "index" / f"{layer_path.name}{INDEX_SUFFIX}"
+  index.parent.mkdir(exist_ok=True)
+  index.write_text("".join(f"{digest} {size}\n" for digest, size in chunks))
+  return chunks
+
+
+def read_index(index_path):
+  """
+  Read the chunk index of a layer.
+
+  Args:
+    index_path: Path to the {layer}.chunks file
+
+  Returns:
+    List of (sha256, size) tuples
+  """
+  chunks = []
+  for line in index_path.read_text().splitlines():
+    digest, size = line.split()
+    chunks.append((digest, int(size)))
+  return chunks
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Split layers into a deduplicated content-defined chunk store")
+  parser.add_argument("layers", nargs="*", type=Path, help="Layer files (default: all layers in dist/)")
+  parser.add_argument("--store", type=Path, default=STORE_DIR, help=f"Chunk store (default: {STORE_DIR})")
+  args = parser.parse_args()
+
+  layers = args.layers or sorted((SCRIPT_DIR / "dist").glob("*.layer"))
+  if not layers:
+    print("No layers to chunk")
+    return
+
+  args.store.mkdir(parents=True, exist_ok=True)
+
+  jobs = int(os.environ.get("CHUNK_JOBS", os.cpu_count() or 1))
+  with ThreadPoolExecutor(max_workers=jobs) as executor:
+    results = list(executor.map(lambda l: chunk_layer(l, args.store), layers))
+
+  # Dedup ratio of the given layers, chunks shared across layers are counted once
+  unique = {}
+  total = 0
+  for layer_path, chunks in zip(layers, results):
+    size = sum(s for _, s in chunks)
+    print(f"{layer_path.name}: {len(chunks)} chunks, {size / 2**20:.1f} MiB")
+    total += size
+    unique.update(chunks)
+
+  stored = sum(unique.values())
+  print(f"\nTotal: {total / 2**20:.1f} MiB in {len(layers)} layers")
+  print(f"Unique: {stored / 2**20:.1f} MiB in {len(unique)} chunks")
+  if stored:
+    print(f"Dedup ratio: {total / stored:.2f}x")
+
+
+if __name__ == "__main__":
+  main()
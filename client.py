@@ -0,0 +1,434 @@
+#!/usr/bin/env python3
+
+######################################################################
+# @author      : Ruan E. Formigoni (ruanformigoni@gmail.com)
+# @file        : client
+# @description : Resolve and fetch runner layers of a fetch JSON manifest
+######################################################################
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import sys
+from pathlib import Path
+from urllib.parse import urljoin
+
+import delta
+import httpclient
+
+# Manifest published with each release, see fetch.py and .github/workflows/default.yml
+MANIFEST_URL = "https://github.com/gameimage/runners/releases/download/gameimage-{version}.x/gameimage-{version}.x.json"
+
+# Layer cache, least recently used layers are evicted to stay within the budget in MiB
+CACHE_DIR = Path(os.environ.get("GAMEIMAGE_CACHE_DIR",
+  Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "gameimage" / "layers"))
+CACHE_BUDGET = int(os.environ.get("GAMEIMAGE_CACHE_BUDGET", "20480")) * 2**20
+
+# Parallel range requests per layer, layers smaller than two segments use one
+SEGMENTS = int(os.environ.get("GAMEIMAGE_FETCH_SEGMENTS", "4"))
+SEGMENT_MIN_SIZE = 16 * 2**20
+
+# Largest range requested at once, keeps each request within the client timeout
+REQUEST_SIZE = 64 * 2**20
+
+# Bytes downloaded by a segment between saves of the resume state
+STATE_INTERVAL = 8 * 2**20
+
+# Attempts of a range request, each continues where the previous one stopped
+RETRIES = 3
+
+# Suffixes of a download in progress and its resume state, in the cache directory
+PART_SUFFIX = ".part"
+STATE_SUFFIX = ".part.json"
+
+
+class ClientError(Exception):
+  """
+  Raised when a layer cannot be resolved, downloaded or verified.
+  """
+
+
+class Manifest:
+  """
+  Runner layers of a fetch JSON manifest, see fetch.py.
+
+  Layers are published next to the manifest, their URLs are relative to it.
+  """
+
+  def __init__(self, data, url):
+    self.data = data
+    self.url = url
+
+  def layers(self, platform):
+    """
+    List the layers of a platform.
+
+    Args:
+      platform: Platform name, e.g., pcsx2
+
+    Returns:
+      List of dictionaries with the keys name, platform, owner, repo, distribution,
+      channel, version, url, size, sha256 and runner (None if not published), runner is the
+      static metadata of the runner, see metadata.extract
+    """
+    result = []
+    entry = self.data.get(platform, {})
+    meta = entry.get("meta", {})
+    for owner, repos in entry.get("layer", {}).items():
+      for repo, distributions in repos.items():
+        for distribution, channels in distributions.items():
+          for channel, versions in channels.items():
+            for version in versions:
+              name = f"{platform}--{owner}--{repo}--{distribution}--{channel}--{version}.layer"
+              result.append({
+                "name": name,
+                "platform": platform,
+                "owner": owner,
+                "repo": repo,
+                "distribution": distribution,
+                "channel": channel,
+                "version": version,
+                "url": urljoin(self.url, name),
+                "size": meta.get(name, {}).get("size"),
+                "sha256": meta.get(name, {}).get("sha256"),
+                "runner": meta.get(name, {}).get("runner"),
+              })
+    return result
+
+  def resolve(self, platform, owner=None, repo=None, distribution=None, channel=None, version=None,
+      predicate=None):
+    """
+    Pick the layer that matches the given fields, the latest version of the stable channel
+    unless they narrow it down otherwise.
+
+    Args:
+      platform: Platform name, e.g., wine
+      owner: Repository owner, e.g., Kron4ek
+      repo: Repository name, e.g., Wine-Builds
+      distribution: Distribution, e.g., staging
+      channel: "stable" or "unstable"
+      version: Version, e.g., wine-9.2
+      predicate: Called with each layer dictionary, false to skip it, e.g., to filter on the
+        runner metadata: lambda l: (l["runner"] or {}).get("machine") == "x86_64"
+
+    Returns:
+      Layer dictionary, see layers
+
+    Raises:
+      ClientError if no layer matches
+    """
+    wanted = {"owner": owner, "repo": repo, "distribution": distribution, "channel": channel, "version": version}
+    candidates = [
+      l for l in self.layers(platform)
+      if all(v is None or l[k] == v for k, v in wanted.items()) and (predicate is None or predicate(l))
+    ]
+    if channel is None and any(l["channel"] == "stable" for l in candidates):
+      candidates = [l for l in candidates if l["channel"] == "stable"]
+
+    if not candidates:
+      given = ", ".join(f"{k}={v}" for k, v in wanted.items() if v is not None)
+      raise ClientError(f"No {platform} layer matches {given or 'the manifest'}")
+
+    return max(candidates, key=lambda l: (delta.version_key(l["version"]), l["owner"], l["repo"], l["distribution"]))
+
+
+async def load_manifest(client, url):
+  """
+  Download a manifest.
+
+  Args:
+    client: httpclient.Client
+    url: Manifest URL, see MANIFEST_URL
+
+  Returns:
+    Manifest
+
+  Raises:
+    ClientError if the manifest cannot be downloaded
+  """
+  try:
+    response = await client.get(url)
+  except httpclient.HTTPError as e:
+    raise ClientError(str(e)) from None
+  if response.status != 200:
+    raise ClientError(f"HTTP {response.status}: {url}")
+  # Relative to the published URL, redirects may lead to signed storage URLs
+  return Manifest(response.json(), url)
+
+
+class Cache:
+  """
+  Directory of verified layers, each with its {name}.sha256sum, evicted in least recently
+  used order to stay within a size budget. Uses update the modification time of a layer.
+  """
+
+  def __init__(self, directory=CACHE_DIR, budget=CACHE_BUDGET):
+    self.directory = Path(directory)
+    self.budget = budget
+    self.directory.mkdir(parents=True, exist_ok=True)
+
+  def lookup(self, layer):
+    """
+    Find a cached layer.
+
+    Args:
+      layer: Layer dictionary, see Manifest.layers
+
+    Returns:
+      Path to the layer or None if it is not cached or differs from the manifest
+    """
+    path = self.directory / layer["name"]
+    checksum_file = self.directory / f"{layer['name']}.sha256sum"
+    if not path.exists() or not checksum_file.exists():
+      return None
+
+    cached_sha256 = checksum_file.read_text().split()[0]
+    if (layer["sha256"] and cached_sha256 != layer["sha256"]) \
+        or (layer["size"] is not None and path.stat().st_size != layer["size"]):
+      return None
+
+    os.utime(path)
+    return path
+
+  def add(self, layer, sha256):
+    """
+    Record a layer downloaded to its path in the cache.
+    """
+    (self.directory / f"{layer['name']}.sha256sum").write_text(f"{sha256}  {layer['name']}\n")
+
+  def evict(self, size, keep=()):
+    """
+    Remove least recently used layers until size bytes fit in the budget.
+
+    Args:
+      size: Bytes about to be added
+      keep: Layer names that must stay, e.g., the one being downloaded
+    """
+    layers = sorted(
+      (p for p in self.directory.glob("*.layer") if p.name not in keep),
+      key=lambda p: p.stat().st_mtime,
+    )
+    used = sum(p.stat().st_size for p in self.directory.iterdir() if p.is_file() and p.name not in keep)
+    for path in layers:
+      if used + size <= self.budget:
+        break
+      print(f"Evicting {path.name}", file=sys.stderr)
+      used -= path.stat().st_size
+      path.unlink()
+      (self.directory / f"{path.name}.sha256sum").unlink(missing_ok=True)
+
+
+def plan_segments(size, segments):
+  """
+  Split a download into contiguous segments.
+
+  Returns:
+    List of [start, end, done] lists, done is the offset reached so far
+  """
+  count = max(1, min(segments, size // SEGMENT_MIN_SIZE)) if size else 1
+  bounds = [size * i // count for i in range(count + 1)]
+  return [[bounds[i], bounds[i + 1], bounds[i]] for i in range(count)]
+
+
+async def download(client, url, path, size, sha256, segments=SEGMENTS):
+  """
+  Download a file with parallel range requests, resuming a previous partial download, and
+  check its checksum while it arrives.
+
+  The checksum covers the contiguous prefix downloaded so far, the data of the first
+  segment is hashed as it is written and the following segments are read back from the page
+  cache once the previous ones complete.
+
+  Args:
+    client: httpclient.Client
+    url: File URL
+    path: Destination file, the partial download is kept in {path}.part
+    size: Expected size in bytes
+    sha256: Expected checksum, None to skip the check
+    segments: Maximum number of parallel range requests
+
+  Returns:
+    Checksum of the file
+
+  Raises:
+    ClientError on download failures and checksum mismatches
+  """
+  part_path = path.with_name(path.name + PART_SUFFIX)
+  state_path = path.with_name(path.name + STATE_SUFFIX)
+
+  # Resume the segments of a previous attempt at the same file
+  plan = plan_segments(size, segments)
+  if part_path.exists() and state_path.exists():
+    state = json.loads(state_path.read_text())
+    if state["url"] == url and state["size"] == size and state["sha256"] == sha256:
+      plan = state["segments"]
+      print(f"Resuming {path.name} at {sum(d - s for s, _, d in plan) / 2**20:.1f} MiB", file=sys.stderr)
+
+  # Servers without range support send the whole file in one response
+  try:
+    response = await client.head(url, {"Accept-Encoding": "identity"})
+  except httpclient.HTTPError as e:
+    raise ClientError(str(e)) from None
+  ranged = response.headers.get("accept-ranges", "").lower() == "bytes"
+  if not ranged:
+    plan = [[0, size, 0]]
+
+  def save_state():
+    state_path.write_text(json.dumps({"url": url, "size": size, "sha256": sha256, "segments": plan}))
+
+  digest = hashlib.sha256()
+  hashed = 0
+
+  fd = os.open(part_path, os.O_RDWR | os.O_CREAT, 0o644)
+  try:
+    os.ftruncate(fd, size)
+
+    def advance():
+      # Hash up to the end of the contiguous prefix, the done offset of the first
+      # incomplete segment
+      nonlocal hashed
+      frontier = next((d for _, e, d in plan if d < e), size)
+      while hashed < frontier:
+        data = os.pread(fd, min(frontier - hashed, httpclient.CHUNK_SIZE * 16), hashed)
+        digest.update(data)
+        hashed += len(data)
+
+    async def fetch_segment(segment):
+      start, end, _ = segment
+      saved = segment[2]
+      for attempt in range(RETRIES):
+        try:
+          while segment[2] < end:
+            offset = segment[2]
+            last = min(end, offset + REQUEST_SIZE) - 1 if ranged else end - 1
+
+            def consume(chunk):
+              if segment[2] + len(chunk) > last + 1:
+                raise httpclient.HTTPError(f"Server ignored the range {offset}-{last}: {url}")
+              os.pwrite(fd, chunk, segment[2])
+              segment[2] += len(chunk)
+              advance()
+
+            headers = {"Range": f"bytes={offset}-{last}"} if ranged else {}
+            response = await client.get(url, {**headers, "Accept-Encoding": "identity"}, consumer=consume)
+            if response.status not in (200, 206) or (response.status == 200 and (offset, last) != (0, size - 1)):
+              raise httpclient.HTTPError(f"HTTP {response.status}: {url}")
+            if segment[2] != last + 1:
+              raise httpclient.HTTPError(f"Incomplete range {offset}-{last}: {url}")
+            if segment[2] - saved >= STATE_INTERVAL:
+              save_state()
+              saved = segment[2]
+          return
+        except httpclient.HTTPError as e:
+          save_state()
+          if attempt == RETRIES - 1:
+            raise ClientError(str(e)) from None
+          print(f"Retrying {path.name} at {segment[2]} of {start}-{end}: {e}", file=sys.stderr)
+          if not ranged:
+            segment[2] = 0
+
+    try:
+      await asyncio.gather(*(fetch_segment(segment) for segment in plan))
+    finally:
+      save_state()
+
+    advance()
+  finally:
+    os.close(fd)
+
+  checksum = digest.hexdigest()
+  if sha256 and checksum != sha256:
+    part_path.unlink()
+    state_path.unlink()
+    raise ClientError(f"Checksum mismatch for {path.name}: {checksum}, expected {sha256}")
+
+  part_path.rename(path)
+  state_path.unlink()
+  return checksum
+
+
+async def fetch(client, layer, cache, segments=SEGMENTS):
+  """
+  Get a layer from the cache or download it into the cache.
+
+  Layers without a size or checksum in the manifest, e.g., built before the build database,
+  are checked against their published {name}.sha256sum.
+
+  Args:
+    client: httpclient.Client, with a timeout that fits REQUEST_SIZE
+    layer: Layer dictionary, see Manifest.layers
+    cache: Cache
+    segments: Maximum number of parallel range requests
+
+  Returns:
+    Path to the layer in the cache
+
+  Raises:
+    ClientError if the layer cannot be downloaded or verified
+  """
+  if path := cache.lookup(layer):
+    return path
+
+  try:
+    if layer["sha256"] is None:
+      response = await client.get(f"{layer['url']}.sha256sum")
+      if response.status == 200:
+        layer = {**layer, "sha256": response.text().split()[0]}
+    if layer["size"] is None:
+      response = await client.head(layer["url"], {"Accept-Encoding": "identity"})
+      if response.status != 200 or "content-length" not in response.headers:
+        raise ClientError(f"Unknown size of {layer['url']}")
+      layer = {**layer, "size": int(response.headers["content-length"])}
+  except httpclient.HTTPError as e:
+    raise ClientError(str(e)) from None
+
+  cache.evict(layer["size"], keep={layer["name"], layer["name"] + PART_SUFFIX})
+  path = cache.directory / layer["name"]
+  print(f"Downloading {layer['name']} ({layer['size'] / 2**20:.1f} MiB)", file=sys.stderr)
+  sha256 = await download(client, layer["url"], path, layer["size"], layer["sha256"], segments)
+  cache.add(layer, sha256)
+  return path
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Resolve and fetch runner layers of a fetch JSON manifest")
+  parser.add_argument("manifest", help="Manifest URL or gameimage version, e.g., 2.0")
+  parser.add_argument("platform", help="Platform, e.g., pcsx2")
+  parser.add_argument("--owner")
+  parser.add_argument("--repo")
+  parser.add_argument("--distribution")
+  parser.add_argument("--channel")
+  parser.add_argument("--version")
+  parser.add_argument("--machine", help="Runner architecture, e.g., x86_64, layers without metadata match")
+  parser.add_argument("--list", action="store_true", help="List the layers of the platform instead")
+  parser.add_argument("--cache", type=Path, default=CACHE_DIR, help=f"Cache directory (default: {CACHE_DIR})")
+  parser.add_argument("--budget", type=int, default=CACHE_BUDGET // 2**20, help="Cache budget in MiB")
+  parser.add_argument("--segments", type=int, default=SEGMENTS, help="Parallel range requests per layer")
+  args = parser.parse_args()
+
+  url = args.manifest if "://" in args.manifest else MANIFEST_URL.format(version=args.manifest)
+
+  async def run():
+    async with httpclient.Client(timeout=600) as client:
+      manifest = await load_manifest(client, url)
+      if args.list:
+        for l in manifest.layers(args.platform):
+          print(l["name"])
+        return
+      def predicate(l):
+        return args.machine is None or (l["runner"] or {}).get("machine") in (None, args.machine)
+      layer = manifest.resolve(args.platform, args.owner, args.repo, args.distribution, args.channel, args.version,
+        predicate)
+      print(await fetch(client, layer, Cache(args.cache, args.budget * 2**20), args.segments))
+
+  try:
+    asyncio.run(run())
+  except ClientError as e:
+    print(f"Error: {e}", file=sys.stderr)
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+  main()
@@ -14,89 +14,232 @@ DIR_DIST="$(dirname -- "$DIR_SCRIPT")/dist"
 # Set global vars
 # export FIM_DEBUG=1
 
-# Create a base image
+# The container is split in a minimal core image and optional layers
+# arch.flatimage      : core, enough for the emulators
+# arch--lib32.layer   : 32-bit libraries, requires core
+# arch--wine.layer    : wine and game dependencies, requires core and lib32
+# arch--amd.layer     : AMD vulkan drivers, requires core (32-bit drivers also require lib32)
+# arch--intel.layer   : Intel vulkan drivers, requires core (32-bit drivers also require lib32)
+
+# Core packages, installed in a single pacman transaction
+declare -a PKGS_CORE=(
+  xorg-server libxinerama mesa vulkan-icd-loader glxinfo gcc-libs pcre freetype2 wget aria2
+  zenity noto-fonts sdl2 libxkbcommon libxkbcommon-x11 libsm fontconfig
+  # General linux audio
+  pipewire-alsa wireplumber alsa-plugins pulseaudio-{alsa,equalizer,jack,lirc,zeroconf}
+  # Others
+  # libpng12 # Removed from remote
+  libpng xorg-xwininfo
+  # Gameimage dependencies
+  libappindicator-gtk3
+)
+
+# 32-bit packages
+declare -a PKGS_LIB32=(
+  lib32-libxinerama lib32-mesa lib32-vulkan-icd-loader lib32-gcc-libs lib32-freetype2 lib32-sdl2
+  lib32-libxkbcommon lib32-libxkbcommon-x11 lib32-libsm lib32-gstreamer lib32-gst-plugins-{base,good}
+  # General linux audio
+  lib32-pipewire lib32-libpulse
+  # GOG Mojo setup & also Trine enchanted edition
+  # lib32-gtk2 # Removed from remote
+  # Amnesia A Machine For Pigs
+  lib32-glu
+  # Amnesia The Dark Descent
+  lib32-openal lib32-libtheora
+  # Crypt of the necrodancer
+  lib32-libxss
+  # Hotline miami (sound)
+  lib32-speexdsp
+  # lib32-pipewire-jack
+  lib32-jack2
+  # Jazz jackrabbit
+  lib32-libcaca
+  # Others
+  # lib32-libpng12 # Removed from remote
+  lib32-libpng
+  # Gameimage dependencies
+  lib32-libappindicator-gtk3
+)
+
+# Wine dependencies
+declare -a PKGS_WINE=(
+  # wine is only installed to pull its dependencies, it is removed afterwards
+  wine gstreamer gst-libav gst-plugins-{bad,base,good,ugly} ffmpeg
+  # GOG Mojo setup & also Trine enchanted edition
+  # gtk2 # Removed from remote
+  # Amnesia A Machine For Pigs
+  glu
+  # Amnesia The Dark Descent
+  openal libtheora
+  # Crypt of the necrodancer
+  libxss
+  # Hotline miami (sound)
+  speexdsp
+  # pipewire-jack
+  jack2
+  # Jazz jackrabbit
+  speex libcaca
+  # Wine UMU
+  python python-xlib python-filelock
+  # Winetricks
+  cabextract
+)
+
+# AMD video drivers
+declare -a PKGS_AMD=(xf86-video-amdgpu vulkan-radeon lib32-vulkan-radeon vulkan-tools)
+
+# Intel video drivers
+declare -a PKGS_INTEL=(xf86-video-intel vulkan-intel lib32-vulkan-intel vulkan-tools)
+
+# Optional layers
+declare -a LAYERS=(lib32 wine amd intel)
+
+# Flatimage release used as the base image
+URL_BASE="https://github.com/flatimage/flatimage/releases/download/v2.0.0/arch-x86_64.flatimage"
+URL_WINETRICKS="https://raw.githubusercontent.com/Winetricks/winetricks/master/src/winetricks"
+
+# Use the fixture server as source, see fixtures/server.py
+if [[ -n "$GAMEIMAGE_SOURCE" ]] && [[ "$GAMEIMAGE_SOURCE" != github ]]; then
+  URL_BASE="$GAMEIMAGE_SOURCE/download/flatimage/flatimage/v2.0.0/arch-x86_64.flatimage"
+  URL_WINETRICKS="$GAMEIMAGE_SOURCE/download/Winetricks/winetricks/master/winetricks"
+fi
+
+# Append the pacman arguments to use the local package cache to an array
+# The cache is kept between builds, so unchanged packages are not downloaded again
+# $1 image file
+# $2 cache directory
+# $3 name of the array the arguments are appended to
+function _pacman_cache_args()
+{
+  local image="$1"
+  local dir_cache="$2"
+  local -n ref_args="$3"
+
+  mkdir -p "$dir_cache"
+
+  # The container only sees the host directory through the home permission
+  if "$image" fim-exec test -w "$dir_cache" &>/dev/null; then
+    ref_args+=(--cachedir "$dir_cache")
+  else
+    echo "Package cache '$dir_cache' is not visible in the container, using default" >&2
+  fi
+}
+
+# Create the core image
 # $1 image file
+# $2 cache directory
 function _create_base()
 {
   local image="$1"
+  local dir_cache="$2"
 
-  # Update
-  "$image" fim-root pacman -Syu --noconfirm
-
-  # Install wine dependencies
-  "$image" fim-root pacman -S --noconfirm wine xorg-server libxinerama lib32-libxinerama \
-    mesa lib32-mesa glxinfo lib32-gcc-libs gcc-libs pcre freetype2 lib32-freetype2 wget aria2 \
-    zenity gstreamer lib32-gstreamer gst-libav gst-plugins-{bad,base,good,ugly} lib32-gst-plugins-{base,good} \
-    noto-fonts sdl2 lib32-sdl2 libxkbcommon libxkbcommon-x11 lib32-libxkbcommon lib32-libxkbcommon-x11 \
-    libsm lib32-libsm fontconfig lib32-freetype2 freetype2
-  "$image" fim-root pacman -R --noconfirm wine
-
-  # Game dependencies
-  declare -a GAME_DEPS=(
-    # General linux audio
-    lib32-pipewire pipewire-alsa wireplumber alsa-plugins
-    lib32-libpulse pulseaudio-{alsa,equalizer,jack,lirc,zeroconf}
-    # GOG Mojo setup & also Trine enchanted edition
-    # gtk2 lib32-gtk2 # Removed from remote
-    # Amnesia A Machine For Pigs
-    lib32-glu glu
-    # Amnesia The Dark Descent
-    openal lib32-openal libtheora lib32-libtheora
-    # Crypt of the necrodancer
-    lib32-libxss libxss
-    # Hotline miami (sound)
-    speexdsp lib32-speexdsp
-    # pipewire-jack lib32-pipewire-jack
-    jack2 lib32-jack2
-    # Jazz jackrabbit
-    speex libcaca lib32-libcaca
-    # Others
-    # libpng12 lib32-libpng12 # Removed from remote
-    libpng lib32-libpng xorg-xwininfo ffmpeg 
-  )
+  local -a args_cache=()
+  _pacman_cache_args "$image" "$dir_cache" args_cache
 
+  # Conflicts with pulseaudio
   "$image" fim-root pacman -Rs --noconfirm pipewire-pulse || true
-  "$image" fim-root pacman -S --noconfirm "${GAME_DEPS[@]}"
-
-  # Gameimage dependencies
-  "$image" fim-root pacman -S --noconfirm noto-fonts libappindicator-gtk3 lib32-libappindicator-gtk3
 
-  # Wine UMU
-  "$image" fim-root pacman -S --noconfirm python python-xlib python-filelock
+  # Update and install all packages in one transaction
+  "$image" fim-root pacman -Syu --noconfirm --needed "${args_cache[@]}" "${PKGS_CORE[@]}"
 }
 
-# Include winetricks
-# $1 image file
-function _include_winetricks()
+# Install packages into a layer directory, on top of the packages of a pacman database
+# Package files go to the layer directory, the core image is left untouched
+# Install scriptlets and alpm hooks run in the layer directory, it is seeded with the
+# filesystem of the core image and of the base layer first, for /bin/sh, the hooks and their
+# tools. The caches the hooks regenerate (ld.so.cache, gdk-pixbuf loaders, gio modules,
+# fontconfig, ...) cover the core image, the base layer and the layer, see _prune_layer.
+# $1 image file (core)
+# $2 layer directory
+# $3 pacman database the layer is installed on top of
+# $4 pacman database of the layer, created
+# $5 cache directory
+# $6 layer directory of the base layer, empty for layers on top of the core image
+# $@ packages
+function _install_layer()
 {
   local image="$1"
+  local dir_layer="$2"
+  local db_base="$3"
+  local db_layer="$4"
+  local dir_cache="$5"
+  local dir_base="$6"
+  shift 6
+
+  local -a args_cache=()
+  _pacman_cache_args "$image" "$dir_cache" args_cache
+
+  rm -rf "$dir_layer" "$db_layer"
+  mkdir -p "$dir_layer"
+  cp -r "$db_base" "$db_layer"
+
+  # Seed, removed by _prune_layer unless the installation changes it
+  "$image" fim-root cp -a --reflink=auto /bin /lib /lib64 /sbin /usr /etc "$dir_layer"/
+  if [[ -n "$dir_base" ]]; then
+    cp -a --reflink=auto "$dir_base"/. "$dir_layer"/
+  fi
+  # Changes of the installation are strictly newer than the seed
+  touch "$dir_layer.seed"
+  sleep 1
 
-  "$image" fim-root pacman -S cabextract --noconfirm
+  "$image" fim-root pacman -S --noconfirm --needed "${args_cache[@]}" \
+    --root "$dir_layer" --dbpath "$db_layer" --logfile /dev/null "$@"
+}
 
-  wget -q --show-progress --progress=dot \
-    "https://raw.githubusercontent.com/Winetricks/winetricks/master/src/winetricks" \
-    -O winetricks
+# Remove the seed of _install_layer, what the core image and the base layer already provide
+# Files are kept when they were created or changed after the seed (their ctime, which copies
+# do not preserve), e.g., package files and regenerated caches. Limitations: files removed by
+# the installation cannot be represented in a layer and come back from the layers below, and
+# caches of layers installed on the same base (wine, amd, intel) hide each other when these
+# layers are mounted together, e.g., ld.so.cache only lists the libraries of the top one and
+# the dynamic loader falls back to its default directories for the others
+# $1 layer directory
+function _prune_layer()
+{
+  local dir_layer="$1"
 
-  "$image" fim-exec cp ./winetricks /usr/bin/winetricks
-  "$image" fim-exec chmod +x /usr/bin/winetricks
+  find "$dir_layer" ! -type d ! -cnewer "$dir_layer.seed" -delete
+  find "$dir_layer" -mindepth 1 -depth -type d -empty -delete
+  rm -f "$dir_layer.seed"
 }
 
-# Include amd video drivers in image
-# $1 image file
-function _include_amd()
+# Include winetricks
+# $1 layer directory
+# $2 winetricks script
+function _include_winetricks()
 {
-  local image="$1"
+  local dir_layer="$1"
+  local winetricks="$2"
 
-  "$image" fim-root pacman -S xf86-video-amdgpu vulkan-radeon lib32-vulkan-radeon vulkan-tools --noconfirm
+  mkdir -p "$dir_layer"/usr/bin
+  cp "$winetricks" "$dir_layer"/usr/bin/winetricks
+  chmod +x "$dir_layer"/usr/bin/winetricks
 }
 
-# Include intel video drivers in image
+# Report the packages that contribute most to the image size
 # $1 image file
-function _include_intel()
+# $2 report file
+# $3 pacman database
+function _report_sizes()
 {
   local image="$1"
+  local report="$2"
+  local db="${3:-/var/lib/pacman}"
 
-  "$image" fim-root pacman -S xf86-video-intel vulkan-intel lib32-vulkan-intel vulkan-tools --noconfirm
+  # shellcheck disable=2016
+  "$image" fim-exec pacman -Qi --dbpath "$db" | awk -F' *: *' '
+    $1 == "Name" { name = $2 }
+    $1 == "Installed Size" {
+      split($2, size, " ")
+      mult = 1
+      if (size[2] == "KiB") mult = 1024
+      if (size[2] == "MiB") mult = 1024 ^ 2
+      if (size[2] == "GiB") mult = 1024 ^ 3
+      printf "%d %s\n", size[1] * mult, name
+    }' | sort -rn | awk '{ printf "%10.1f MiB  %s\n", $1 / 1024 ^ 2, $2 }' > "$report"
+
+  echo "Largest packages (full list in $report):"
+  head -n 25 "$report"
 }
 
 function main()
@@ -112,57 +255,108 @@ function main()
   # shellcheck disable=2155
   local basename_image=arch.flatimage
   local image="$DIR_SCRIPT/build/$basename_image"
+  local image_base="$DIR_SCRIPT/build/base.flatimage"
+  local dir_cache="${PACMAN_CACHE:-$DIR_SCRIPT/build/pkg}"
+  local -a outputs=("$basename_image")
+  local layer
+  for layer in "${LAYERS[@]}"; do outputs+=("arch--$layer.layer"); done
 
-  # Fetch
+  # Fetch base image, the download is kept between builds
   if [[ "$1" = --flatimage ]]; then
     [[ -z "$2" ]] && { echo "Please specify image path"; exit 1; }
-    cp "$2" "$image"
-  else
-    wget -O "$image" "https://github.com/flatimage/flatimage/releases/download/v2.0.0/arch-x86_64.flatimage"
-    chmod +x "$image"
+    cp "$2" "$image_base"
+  elif ! [[ -f "$image_base" ]] || [[ "$(cat "$image_base.url" 2>/dev/null)" != "$URL_BASE" ]]; then
+    wget -O "$image_base" "$URL_BASE"
+    echo "$URL_BASE" > "$image_base.url"
   fi
+  chmod +x "$image_base"
 
-  # Enable only home and network
-  "$image" fim-perms set home,network
+  # Fetch winetricks
+  wget -q --show-progress --progress=dot "$URL_WINETRICKS" -O winetricks
 
-  # Create base image
-  _create_base "$image"
-
-  # Create AMD/Intel base
-  _include_amd        "$image"
-  _include_intel      "$image"
-  _include_winetricks "$image"
-
-  # Remove /opt
-  # "$image" fim-exec rm -rf /opt
-
-  # Create directories
-  "$image" fim-exec sh -c 'mkdir -p /home/gameimage/.config'
-  "$image" fim-exec sh -c 'mkdir -p /home/gameimage/.local/share'
-
-  # Set environment
-  ## there is a bug in fuse-overlayfs that causes undefined symbols
-  # shellcheck disable=2016
-  "$image" fim-env set \
-    'USER=gameimage' \
-    'HOME=/home/gameimage' \
-    'XDG_CONFIG_HOME=/home/gameimage/.config' \
-    'XDG_DATA_HOME=/home/gameimage/.local/share'
-
-  # Set permissions
-  "$image" fim-boot set sh -c 'echo "FlatImage ($FIM_VERSION) for GameImage"'
-
-  # Set permissions
-  "$image" fim-perms set home,media,audio,wayland,xorg,dbus_user,dbus_system,udev,usb,input,gpu,network,dev
-
-  # Commit packages and configurations
-  "$image" fim-layer commit binary
+  # Skip the build if the base image, this script (package lists) and winetricks are unchanged
+  # shellcheck disable=2155
+  local stamp="$(cat "$image_base" "$DIR_SCRIPT/build-arch.sh" winetricks | sha256sum | cut -d' ' -f1)"
+  if ls "${outputs[@]}" &>/dev/null && [[ "$(cat "$image.stamp" 2>/dev/null)" = "$stamp" ]]; then
+    echo "Container is up-to-date, skipping build"
+  else
+    rm -f "$image.stamp"
+    cp "$image_base" "$image"
+
+    # Enable only home and network
+    "$image" fim-perms set home,network
+
+    # Create core image
+    _create_base "$image" "$dir_cache"
+
+    # Remove /opt
+    # "$image" fim-exec rm -rf /opt
+
+    # Create directories
+    "$image" fim-exec sh -c 'mkdir -p /home/gameimage/.config'
+    "$image" fim-exec sh -c 'mkdir -p /home/gameimage/.local/share'
+
+    # Set environment
+    ## there is a bug in fuse-overlayfs that causes undefined symbols
+    # shellcheck disable=2016
+    "$image" fim-env set \
+      'USER=gameimage' \
+      'HOME=/home/gameimage' \
+      'XDG_CONFIG_HOME=/home/gameimage/.config' \
+      'XDG_DATA_HOME=/home/gameimage/.local/share'
+
+    # Set permissions
+    "$image" fim-boot set sh -c 'echo "FlatImage ($FIM_VERSION) for GameImage"'
+
+    # Report package sizes
+    _report_sizes "$image" "$DIR_SCRIPT/build/package-sizes.txt"
+
+    # Set permissions
+    "$image" fim-perms set home,media,audio,wayland,xorg,dbus_user,dbus_system,udev,usb,input,gpu,network,dev
+
+    # Commit packages and configurations
+    "$image" fim-layer commit binary
+
+    # Package database of the core image, optional layers are installed on top of it
+    rm -rf db-core
+    "$image" fim-exec cp -r /var/lib/pacman "$DIR_SCRIPT/build/db-core"
+
+    # Create optional layers, wine and the drivers are installed on top of lib32
+    for layer in "${LAYERS[@]}"; do
+      case "$layer" in
+        lib32) _install_layer "$image" "$PWD/root" "$PWD/db-core" "$PWD/db-lib32" "$dir_cache" "" "${PKGS_LIB32[@]}" ;;
+        wine)
+          _install_layer "$image" "$PWD/root" "$PWD/db-lib32" "$PWD/db-wine" "$dir_cache" "$PWD/root-lib32" "${PKGS_WINE[@]}"
+          # Keep wine dependencies only
+          "$image" fim-root pacman -R --noconfirm --root "$PWD/root" --dbpath "$PWD/db-wine" --logfile /dev/null wine
+          _include_winetricks "$PWD/root" winetricks
+        ;;
+        amd) _install_layer "$image" "$PWD/root" "$PWD/db-lib32" "$PWD/db-amd" "$dir_cache" "$PWD/root-lib32" "${PKGS_AMD[@]}" ;;
+        intel) _install_layer "$image" "$PWD/root" "$PWD/db-lib32" "$PWD/db-intel" "$dir_cache" "$PWD/root-lib32" "${PKGS_INTEL[@]}" ;;
+      esac
+      _prune_layer "$PWD/root"
+      rm -f "arch--$layer.layer"
+      "$image" fim-layer create "$PWD/root" "arch--$layer.layer"
+      # The lib32 tree seeds the layers installed on top of it
+      rm -rf "$PWD/root-$layer"
+      mv "$PWD/root" "$PWD/root-$layer"
+    done
+    rm -rf "$PWD"/root-*
+
+    # Report package sizes of the wine stack, core + lib32 + wine
+    _report_sizes "$image" "$DIR_SCRIPT/build/package-sizes-full.txt" "$DIR_SCRIPT/build/db-wine"
+
+    echo "$stamp" > "$image.stamp"
+  fi
 
-  # Create SHA
-  sha256sum "${basename_image}" > "$DIR_DIST"/"${basename_image}".sha256sum
+  # Create SHA and release image and layers
+  for output in "${outputs[@]}"; do
+    sha256sum "$output" > "$DIR_DIST/$output.sha256sum"
+    cp ./"$output" "$DIR_DIST"
+  done
 
-  # Release image
-  cp ./"${basename_image}" "$DIR_DIST"
+  # Record the layers in the build database
+  python3 "$(dirname -- "$DIR_SCRIPT")/builddb.py" record "$DIR_DIST"/arch--*.layer
 }
 
 main "$@"
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+
+######################################################################
+# @author      : Ruan E. Formigoni (ruanformigoni@gmail.com)
+# @file        : delta
+# @description : Create binary deltas between consecutive runner layers
+######################################################################
+
+import argparse
+import os
+import re
+import shutil
+import subprocess
+import sys
+from collections import defaultdict
+from pathlib import Path
+
+import builddb
+
+SCRIPT_DIR = Path(__file__).parent
+
+# Number of previous versions of the same channel to create deltas from
+DEPTH = int(os.environ.get("GAMEIMAGE_DELTA_DEPTH", "1"))
+
+# Deltas larger than this fraction of the layer are not worth publishing
+MAX_RATIO = 0.5
+
+# zstd level, higher levels find few more matches against the base layer at a much higher cost
+LEVEL = int(os.environ.get("GAMEIMAGE_DELTA_LEVEL", "12"))
+
+# zstd --patch-from needs a window that covers the base layer, 2 GiB, clients must pass the
+# same --long value to apply the delta
+WINDOW_LOG = 31
+
+# Delta file suffix, e.g., pcsx2--PCSX2--pcsx2--main--stable--2.4.0.layer.from-2.2.0.zst
+SUFFIX = ".zst"
+
+
+def version_key(version):
+  """
+  Sort key of a version string, numbers compare numerically (wine-9.10 > wine-9.2).
+  """
+  return [(0, int(part), "") if part.isdigit() else (1, 0, part) for part in re.split(r'(\d+)', version) if part]
+
+
+def plan_deltas(dist_dir, depth):
+  """
+  Pair each runner layer with the previous versions of its channel.
+
+  Args:
+    dist_dir: Path to the dist directory
+    depth: Number of previous versions per layer
+
+  Returns:
+    List of (base layer path, layer path) tuples
+  """
+  # Structure: channels[(platform, owner, repo, distribution, channel)] = [(version, path)]
+  channels = defaultdict(list)
+  for layer_path in dist_dir.glob("*.layer"):
+    fields = builddb.parse_layer_name(layer_path.name)
+    if fields is None or fields["version"] is None:
+      continue
+    key = tuple(fields[k] for k in ["platform", "owner", "repo", "distribution", "channel"])
+    channels[key].append((fields["version"], layer_path))
+
+  pairs = []
+  for versions in channels.values():
+    versions.sort(key=lambda v: version_key(v[0]))
+    for i, (_, layer_path) in enumerate(versions):
+      pairs += [(base_path, layer_path) for _, base_path in versions[max(0, i - depth):i]]
+
+  return pairs
+
+
+def delta_name(base_path, layer_path):
+  """
+  File name of the delta that turns a base layer into a layer.
+  """
+  return f"{layer_path.name}.from-{builddb.parse_layer_name(base_path.name)['version']}{SUFFIX}"
+
+
+def create_delta(base_path, layer_path, delta_path):
+  """
+  Create a zstd --patch-from delta.
+
+  Args:
+    base_path: Layer the delta is applied to
+    layer_path: Layer the delta reconstructs
+    delta_path: Output file
+
+  Returns:
+    True if successful, False otherwise
+  """
+  result = subprocess.run(
+    ["zstd", "-q", "-f", f"-{LEVEL}", "-T0", f"--long={WINDOW_LOG}", f"--patch-from={base_path}",
+      str(layer_path), "-o", str(delta_path)],
+    capture_output=True,
+  )
+
+  if result.returncode != 0:
+    print(f"Error creating {delta_path.name}: {result.stderr.decode(errors='replace')}", file=sys.stderr)
+    delta_path.unlink(missing_ok=True)
+    return False
+
+  return True
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Create binary deltas between consecutive runner layers")
+  parser.add_argument("--depth", type=int, default=DEPTH,
+    help=f"Previous versions per layer to create deltas from (default: {DEPTH})")
+  parser.add_argument("--dist", type=Path, default=SCRIPT_DIR / "dist", help="Dist directory")
+  args = parser.parse_args()
+
+  if not shutil.which("zstd"):
+    print("Warning: zstd not found, skipping deltas", file=sys.stderr)
+    return
+
+  # Deltas already created, published or discarded, for the same base and layer contents
+  existing = {d["name"]: d for d in builddb.discarded_deltas(args.dist)}
+  existing.update({d["name"]: d for d in builddb.deltas(args.dist)})
+  checksums = {}
+
+  def checksum(path):
+    if path not in checksums:
+      checksums[path] = builddb.sha256(path)
+    return checksums[path]
+
+  for base_path, layer_path in plan_deltas(args.dist, args.depth):
+    delta_path = args.dist / delta_name(base_path, layer_path)
+    layer_sha256, base_sha256 = checksum(layer_path), checksum(base_path)
+
+    if (recorded := existing.get(delta_path.name)) \
+        and (recorded["layer_sha256"], recorded["base_sha256"]) == (layer_sha256, base_sha256):
+      print(f"Unchanged, skipping: {delta_path.name}")
+      continue
+
+    print(f"Creating delta: {delta_path.name}")
+    checksum_file = args.dist / f"{delta_path.name}.sha256sum"
+    checksum_file.unlink(missing_ok=True)
+    if not create_delta(base_path, layer_path, delta_path):
+      continue
+
+    # Publish only deltas that save enough of the download
+    ratio = delta_path.stat().st_size / max(1, layer_path.stat().st_size)
+    if ratio > MAX_RATIO:
+      print(f"  {ratio:.0%} of the layer, discarded")
+      delta_path.unlink()
+      builddb.record_discarded_delta(args.dist, delta_path.name, layer_sha256, base_sha256, ratio)
+      continue
+    print(f"  {ratio:.0%} of the layer")
+
+    checksum_file.write_text(f"{builddb.sha256(delta_path)}  {delta_path.name}\n")
+    builddb.record_delta(delta_path, layer_path.name, base_path.name, layer_sha256, base_sha256)
+
+
+if __name__ == "__main__":
+  main()
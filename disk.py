@@ -0,0 +1,167 @@
+######################################################################
+# @author      : Ruan E. Formigoni (ruanformigoni@gmail.com)
+# @file        : disk
+# @description : Disk space admission and RAM staging of builder work items
+######################################################################
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+# Free space to leave untouched on the build filesystem, in MiB
+RESERVE = int(os.environ.get("GAMEIMAGE_DISK_RESERVE", "1024")) * 2**20
+
+# Peak disk usage of a work item as a multiple of its download size, until one was measured.
+# The download and its extracted tree coexist until the download is removed, then the tree
+# and the layer created from it
+EXPANSION = float(os.environ.get("GAMEIMAGE_DISK_EXPANSION", "4"))
+
+# RAM-backed directory to extract and assemble layer trees in, and its budget in MiB, 0
+# keeps all trees on the build filesystem
+STAGE_DIR = Path(os.environ.get("GAMEIMAGE_STAGE_DIR", "/dev/shm"))
+STAGE_BUDGET = int(os.environ.get("GAMEIMAGE_STAGE_BUDGET", "0")) * 2**20
+
+# Builders sharing the build and staging filesystems at the same time, each admits work items
+# against its share of the free space, set by jobqueue.py for its workers
+SHARES = max(1, int(os.environ.get("GAMEIMAGE_DISK_SHARES", "1")))
+
+# Seconds between free space samples while a work item runs
+SAMPLE_INTERVAL = 0.5
+
+
+def free(path):
+  """
+  Free space available to unprivileged users on the filesystem of a path, in bytes.
+  """
+  return shutil.disk_usage(path).free
+
+
+def remove(*paths):
+  """
+  Remove intermediate files and directories that exist, symlinks are not followed.
+  """
+  for path in map(Path, paths):
+    if path.is_dir() and not path.is_symlink():
+      shutil.rmtree(path, ignore_errors=True)
+    else:
+      path.unlink(missing_ok=True)
+
+
+class Budget:
+  """
+  Admit work items of a builder only when their projected peak usage fits in the free space.
+
+  The peak usage of each work item is measured while it runs and replaces EXPANSION in the
+  projections of the following ones, across the build and the staging filesystems. Concurrent
+  builders each admit against their share of the free space, see SHARES. Work items that were
+  not admitted are listed in skipped, the builders fail with them.
+  """
+
+  def __init__(self, build_dir, reserve=RESERVE):
+    self.build_dir = Path(build_dir)
+    self.reserve = reserve
+    self.expansion = None
+    self.skipped = []
+
+  def admit(self, name, size):
+    """
+    Check if a work item fits in the free space.
+
+    Args:
+      name: Work item name for messages
+      size: Download size in bytes, None if unknown
+
+    Returns:
+      True if the work item may start, False otherwise
+    """
+    available = (free(self.build_dir) - self.reserve) // SHARES
+    projected = (size or 0) * (self.expansion or EXPANSION)
+    if available < projected or available <= 0:
+      print(
+        f"Not enough disk space for {name}: needs ~{projected / 2**20:.0f} MiB,"
+        f" {max(0, available) / 2**20:.0f} MiB available above the reserve, skipping",
+        file=sys.stderr,
+      )
+      self.skipped.append(name)
+      return False
+    return True
+
+  @contextmanager
+  def track(self, name, size, cleanup=()):
+    """
+    Measure the peak disk usage of a work item and remove its intermediates when it ends.
+
+    Args:
+      name: Work item name for messages
+      size: Download size in bytes, None if unknown
+      cleanup: Paths left behind by failed stages, removed when the work item ends unless it
+        was interrupted by an exception
+    """
+    filesystems = [self.build_dir]
+    if STAGE_BUDGET and STAGE_DIR.is_dir() and os.stat(STAGE_DIR).st_dev != os.stat(self.build_dir).st_dev:
+      filesystems.append(STAGE_DIR)
+
+    start = [free(path) for path in filesystems]
+    lowest = list(start)
+    done = threading.Event()
+
+    def sample():
+      for i, path in enumerate(filesystems):
+        lowest[i] = min(lowest[i], free(path))
+
+    def sampler_loop():
+      while not done.wait(SAMPLE_INTERVAL):
+        sample()
+
+    sampler = threading.Thread(target=sampler_loop, daemon=True)
+    sampler.start()
+    interrupted = False
+    try:
+      yield
+    except BaseException:
+      # Intermediates of interrupted work items are kept for a resumed build, see journal.py
+      interrupted = True
+      raise
+    finally:
+      done.set()
+      sampler.join()
+      sample()
+      if not interrupted:
+        remove(*cleanup)
+      peak = sum(s - l for s, l in zip(start, lowest))
+      print(f"Disk usage of {name}: peak {max(0, peak) / 2**20:.0f} MiB, {free(self.build_dir) / 2**20:.0f} MiB free")
+      if size and peak > 0:
+        self.expansion = max(self.expansion or 0, peak / size)
+
+  @contextmanager
+  def stage(self, name, size):
+    """
+    Directory to extract and assemble the tree of a work item in.
+
+    Trees that fit in the share of STAGE_BUDGET and the free space of STAGE_DIR are staged in
+    RAM, which spares the build filesystem the small-file writes of extraction and layer
+    creation.
+
+    Args:
+      name: Work item name for messages
+      size: Download size in bytes, None if unknown
+
+    Yields:
+      A temporary directory under STAGE_DIR, removed afterwards, or the build directory
+    """
+    projected = (size or 0) * (self.expansion or EXPANSION)
+    if not STAGE_BUDGET or not size or not STAGE_DIR.is_dir() \
+        or projected > min(STAGE_BUDGET, free(STAGE_DIR)) // SHARES:
+      yield self.build_dir
+      return
+
+    stage_dir = Path(tempfile.mkdtemp(prefix="gameimage-", dir=STAGE_DIR))
+    print(f"Staging {name} in {stage_dir}")
+    try:
+      yield stage_dir
+    finally:
+      remove(stage_dir)
@@ -0,0 +1,232 @@
+######################################################################
+# @author      : Ruan E. Formigoni (ruanformigoni@gmail.com)
+# @file        : elf
+# @description : Read dynamic linking information from ELF files
+######################################################################
+
+import mmap
+import struct
+
+ELF_MAGIC = b"\x7fELF"
+
+# Program header types
+PT_LOAD = 1
+PT_DYNAMIC = 2
+PT_INTERP = 3
+PT_NOTE = 4
+
+# Note types
+NT_GNU_BUILD_ID = 3
+
+# Dynamic section tags
+DT_NULL = 0
+DT_NEEDED = 1
+DT_STRTAB = 5
+DT_SONAME = 14
+DT_RPATH = 15
+DT_RUNPATH = 29
+
+MACHINES = {
+  0x03: "i386",
+  0x3e: "x86_64",
+  0x28: "arm",
+  0xb7: "aarch64",
+}
+
+
+def read_elf(path):
+  """
+  Read the dynamic linking information of an ELF file.
+
+  Args:
+    path: Path to the ELF file
+
+  Returns:
+    Dictionary with the keys bits, machine, interp, needed, soname, runpath and build_id,
+    or None if the file is not a readable ELF file
+  """
+  try:
+    with open(path, "rb") as f:
+      # Map the file instead of reading it, only the headers and tables are touched
+      with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        return _read_elf(data)
+  except (OSError, ValueError):
+    return None
+
+
+def _read_elf(data):
+  """
+  Read the dynamic linking information of a mapped ELF file.
+
+  Args:
+    data: Buffer with the file contents
+
+  Returns:
+    Same as read_elf
+  """
+  if len(data) < 52 or data[:4] != ELF_MAGIC:
+    return None
+
+  bits = 64 if data[4] == 2 else 32
+  endian = "<" if data[5] == 1 else ">"
+
+  try:
+    if bits == 64:
+      (machine,) = struct.unpack_from(endian + "H", data, 18)
+      phoff, = struct.unpack_from(endian + "Q", data, 32)
+      phentsize, phnum = struct.unpack_from(endian + "HH", data, 54)
+      fmt_phdr = endian + "IIQQQQQQ"
+      fmt_dyn = endian + "qQ"
+    else:
+      (machine,) = struct.unpack_from(endian + "H", data, 18)
+      phoff, = struct.unpack_from(endian + "I", data, 28)
+      phentsize, phnum = struct.unpack_from(endian + "HH", data, 42)
+      fmt_phdr = endian + "IIIIIIII"
+      fmt_dyn = endian + "iI"
+
+    # Collect program headers as (type, offset, vaddr, filesz)
+    segments = []
+    for i in range(phnum):
+      fields = struct.unpack_from(fmt_phdr, data, phoff + i * phentsize)
+      if bits == 64:
+        p_type, _, p_offset, p_vaddr, _, p_filesz, _, _ = fields
+      else:
+        p_type, p_offset, p_vaddr, _, p_filesz, _, _, _ = fields
+      segments.append((p_type, p_offset, p_vaddr, p_filesz))
+
+    info = {
+      "bits": bits,
+      "machine": MACHINES.get(machine, hex(machine)),
+      "interp": None,
+      "needed": [],
+      "soname": None,
+      "runpath": [],
+      "build_id": None,
+    }
+
+    for p_type, p_offset, _, p_filesz in segments:
+      if p_type == PT_INTERP:
+        info["interp"] = data[p_offset:p_offset + p_filesz].split(b"\0", 1)[0].decode(errors="replace")
+      elif p_type == PT_NOTE:
+        info["build_id"] = info["build_id"] or _build_id(data, p_offset, p_filesz, endian)
+
+    dynamic = next((s for s in segments if s[0] == PT_DYNAMIC), None)
+    if dynamic is None:
+      return info
+
+    # Read dynamic entries
+    entries = []
+    size_dyn = struct.calcsize(fmt_dyn)
+    for offset in range(dynamic[1], dynamic[1] + dynamic[3], size_dyn):
+      tag, value = struct.unpack_from(fmt_dyn, data, offset)
+      if tag == DT_NULL:
+        break
+      entries.append((tag, value))
+
+    # Map the string table address to a file offset through the loaded segments
+    strtab = next((value for tag, value in entries if tag == DT_STRTAB), None)
+    if strtab is None:
+      return info
+    strtab_offset = None
+    for p_type, p_offset, p_vaddr, p_filesz in segments:
+      if p_type == PT_LOAD and p_vaddr <= strtab < p_vaddr + p_filesz:
+        strtab_offset = strtab - p_vaddr + p_offset
+        break
+    if strtab_offset is None:
+      return info
+
+    def string(index):
+      start = strtab_offset + index
+      return data[start:data.find(b"\0", start)].decode(errors="replace")
+
+    for tag, value in entries:
+      if tag == DT_NEEDED:
+        info["needed"].append(string(value))
+      elif tag == DT_SONAME:
+        info["soname"] = string(value)
+      elif tag in (DT_RPATH, DT_RUNPATH):
+        info["runpath"].extend(p for p in string(value).split(":") if p)
+
+    return info
+  except (struct.error, ValueError):
+    return None
+
+
+def _build_id(data, offset, size, endian):
+  """
+  Find the GNU build ID in a note segment.
+
+  Returns:
+    Hex string or None if the segment has no build ID note
+  """
+  end = offset + size
+  while offset + 12 <= end:
+    namesz, descsz, note_type = struct.unpack_from(endian + "III", data, offset)
+    name_start = offset + 12
+    desc_start = name_start + (namesz + 3) // 4 * 4
+    if note_type == NT_GNU_BUILD_ID and data[name_start:name_start + namesz] == b"GNU\0":
+      return data[desc_start:desc_start + descsz].hex()
+    offset = desc_start + (descsz + 3) // 4 * 4
+  return None
+
+
+def read_section(path, name):
+  """
+  Read the contents of a section of an ELF file, e.g., .rodata.
+
+  Args:
+    path: Path to the ELF file
+    name: Section name
+
+  Returns:
+    Section bytes or None if the file is not a readable ELF file or has no such section
+  """
+  try:
+    with open(path, "rb") as f:
+      with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        return _read_section(data, name.encode())
+  except (OSError, ValueError):
+    return None
+
+
+def _read_section(data, name):
+  """
+  Read the contents of a section of a mapped ELF file.
+
+  Args:
+    data: Buffer with the file contents
+    name: Section name bytes
+
+  Returns:
+    Same as read_section
+  """
+  if len(data) < 52 or data[:4] != ELF_MAGIC:
+    return None
+
+  bits = 64 if data[4] == 2 else 32
+  endian = "<" if data[5] == 1 else ">"
+
+  try:
+    if bits == 64:
+      shoff, = struct.unpack_from(endian + "Q", data, 40)
+      shentsize, shnum, shstrndx = struct.unpack_from(endian + "HHH", data, 58)
+      fmt_shdr = endian + "IIQQQQ"
+    else:
+      shoff, = struct.unpack_from(endian + "I", data, 32)
+      shentsize, shnum, shstrndx = struct.unpack_from(endian + "HHH", data, 46)
+      fmt_shdr = endian + "IIIIII"
+
+    # Name, offset and size of each section, from name, type, flags, addr, offset, size
+    headers = []
+    for i in range(shnum):
+      sh_name, _, _, _, sh_offset, sh_size = struct.unpack_from(fmt_shdr, data, shoff + i * shentsize)
+      headers.append((sh_name, sh_offset, sh_size))
+
+    _, names_offset, _ = headers[shstrndx]
+    for name_index, offset, size in headers:
+      start = names_offset + name_index
+      if data[start:data.find(b"\0", start)] == name:
+        return bytes(data[offset:offset + size])
+    return None
+  except (struct.error, ValueError, IndexError):
+    return None
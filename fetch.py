@@ -8,35 +8,30 @@
 
 import json
 import sys
-import re
 from pathlib import Path
 from collections import defaultdict
-from urllib.request import urlopen
-from urllib.error import URLError
+
+import builddb
+import buildbot
+import delta
+import source
 
 def fetch_retroarch_cores():
   """Fetch the list of RetroArch cores from buildbot."""
-  url = "http://buildbot.libretro.com/nightly/linux/x86_64/latest/"
-
-  try:
-    with urlopen(url) as response:
-      html = response.read().decode('utf-8')
+  url = f"{source.BUILDBOT_URL}/nightly/linux/x86_64/latest/"
 
-    # Extract .so.zip files using regex
-    # Pattern matches: href=".*?latest/(.*?\.so.zip)"
-    pattern = r'href=".*?latest/(.*?\.so\.zip)"'
-    matches = re.findall(pattern, html, re.IGNORECASE)
+  entries = buildbot.index(url)
+  if entries is None:
+    print(f"Warning: Failed to fetch RetroArch cores from {url}", file=sys.stderr)
+    return None
 
-    # Remove duplicates and sort
-    core_files = sorted(set(matches))
+  # Core archives, e.g., 2048_libretro.so.zip
+  core_files = sorted(e["name"] for e in entries if not e["is_dir"] and e["name"].endswith(".so.zip"))
 
-    return {
-      "url": url,
-      "files": core_files
-    }
-  except URLError as e:
-    print(f"Warning: Failed to fetch RetroArch cores from {url}: {e}", file=sys.stderr)
-    return None
+  return {
+    "url": url,
+    "files": core_files
+  }
 
 def main():
   if len(sys.argv) != 2:
@@ -54,20 +49,54 @@ def main():
 
   result = {}
 
-  # Parse layer files from dist directory
+  # Layers recorded in the build database, layers built before it are parsed from their names
+  records = {r["name"]: r for r in builddb.layers(dist_dir)}
+  for layer_file in dist_dir.glob("*.layer"):
+    if layer_file.name in records:
+      continue
+    fields = builddb.parse_layer_name(layer_file.name)
+    if fields is None:
+      print(f"Warning: Unexpected layer format: {layer_file.stem}", file=sys.stderr)
+      continue
+    records[layer_file.name] = {**fields, "name": layer_file.name}
+
   # Structure: platforms[platform][owner][repo][distribution][channel] = [versions]
   platforms = defaultdict(lambda: defaultdict(lambda: defaultdict(lambda: defaultdict(lambda: defaultdict(list)))))
+  # Structure: container_layers[container][component] = file
+  container_layers = defaultdict(dict)
+  # Structure: meta[platform][file] = {size, sha256, ...}
+  meta = defaultdict(dict)
+  # Structure: deltas[platform][file] = [{from, file, size, sha256}]
+  deltas = defaultdict(lambda: defaultdict(list))
+
+  for row in builddb.deltas(dist_dir):
+    # Layers that are gone or have an unexpected name are not published
+    if row["layer"] not in records:
+      continue
+    deltas[records[row["layer"]]["platform"]][row["layer"]].append({
+      "from": row["base"],
+      "file": row["name"],
+      "size": row["size"],
+      "sha256": row["sha256"],
+    })
+
+  for name, record in sorted(records.items()):
+    if record.get("sha256"):
+      meta[record["platform"]][name] = {
+        "size": record["size"],
+        "sha256": record["sha256"],
+        "url": record["source_url"],
+        "built": int(record["built_at"]),
+        "compression": record["compression"],
+        **(record["meta"] or {}),
+      }
 
-  for layer_file in dist_dir.glob("*.layer"):
-    filename = layer_file.stem
-    parts = filename.split("--")
-
-    if len(parts) != 6:
-      print(f"Warning: Unexpected layer format: {filename}", file=sys.stderr)
+    # Optional container layers, e.g., arch--lib32.layer
+    if record["owner"] is None:
+      container_layers[record["platform"]][record["repo"]] = name
       continue
 
-    platform, owner, repo, distribution, channel, version_str = parts
-    platforms[platform][owner][repo][distribution][channel].append(version_str)
+    platforms[record["platform"]][record["owner"]][record["repo"]][record["distribution"]][record["channel"]].append(record["version"])
 
   # Build JSON structure
   result["version"] = version.replace("gameimage-", "").replace(".x", "")
@@ -77,6 +106,15 @@ def main():
     "arch": "arch.flatimage"
   }
 
+  # Optional container layers, mounted on top of the core image
+  if container_layers:
+    result["containers"]["layer"] = {
+      container: dict(sorted(components.items()))
+      for container, components in sorted(container_layers.items())
+    }
+    if layer_meta := {n: m for c in container_layers for n, m in meta[c].items()}:
+      result["containers"]["meta"] = layer_meta
+
   # Add each platform with nested structure
   for platform in ["linux", "pcsx2", "rpcs3", "wine", "retroarch"]:
     if platform in platforms:
@@ -93,6 +131,18 @@ def main():
         "layer": layer_data
       }
 
+      # Size, checksum and source of the layers in the build database
+      if meta[platform]:
+        result[platform]["meta"] = meta[platform]
+
+      # Binary deltas from previous versions, see delta.py
+      if deltas[platform]:
+        result[platform]["delta"] = {
+          "algorithm": "zstd-patch-from",
+          "window_log": delta.WINDOW_LOG,
+          "layer": dict(deltas[platform]),
+        }
+
   # Fetch retroarch cores from buildbot
   if "retroarch" in result:
     cores = fetch_retroarch_cores()
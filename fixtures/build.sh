@@ -0,0 +1,50 @@
+#!/usr/bin/env bash
+
+######################################################################
+# @author      : Ruan E. Formigoni (ruanformigoni@gmail.com)
+# @file        : build
+# @description : Run build.sh hermetically against the fixture server
+######################################################################
+
+# Usage: fixtures/build.sh [server options, e.g., --latency 50 --bandwidth 10240] [-- build.sh arguments]
+
+set -e
+
+DIR_SCRIPT="$(cd -- "$(dirname -- "${BASH_SOURCE[0]}")" && pwd)"
+DIR_ROOT="$(dirname -- "$DIR_SCRIPT")"
+
+# Split server options and build.sh arguments
+SERVER_ARGS=()
+while [ $# -gt 0 ] && [ "$1" != "--" ]; do
+  SERVER_ARGS+=("$1"); shift
+done
+[ $# -gt 0 ] && shift
+
+# Pick a free port
+PORT="$(python3 -c 'import socket; s = socket.socket(); s.bind(("127.0.0.1", 0)); print(s.getsockname()[1])')"
+
+# Start server
+python3 "$DIR_SCRIPT"/server.py --port "$PORT" "${SERVER_ARGS[@]}" &
+PID_SERVER=$!
+trap 'kill "$PID_SERVER"' EXIT
+
+# Wait for the server
+for _ in $(seq 50); do
+  python3 -c "import urllib.request; urllib.request.urlopen('http://127.0.0.1:$PORT/buildbot/stable/')" \
+    &>/dev/null && break
+  sleep 0.1
+done
+
+export GAMEIMAGE_SOURCE="http://127.0.0.1:$PORT"
+
+# Tools for the layers of the synthetic flatimage, e.g., dwarfsextract for verify.py
+export PATH="$DIR_SCRIPT/bin:$PATH"
+
+# Build
+TIME_START="$(date +%s%N)"
+"$DIR_ROOT"/build.sh "$@"
+TIME_END="$(date +%s%N)"
+
+echo "Build time: $(( (TIME_END - TIME_START) / 1000000 ))ms"
+
+#  vim: set expandtab fdm=marker ts=2 sw=2 tw=100 et :
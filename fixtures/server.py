@@ -0,0 +1,500 @@
+#!/usr/bin/env python3
+
+######################################################################
+# @author      : Ruan E. Formigoni (ruanformigoni@gmail.com)
+# @file        : server
+# @description : Local stand-in for GitHub and buildbot
+######################################################################
+
+import argparse
+import io
+import json
+import random
+import re
+import shutil
+import struct
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlparse, parse_qs
+
+SCRIPT_DIR = Path(__file__).parent
+
+# Shared modules live in the repository root
+sys.path.insert(0, str(SCRIPT_DIR.resolve().parent))
+import source  # noqa: E402
+
+# Recorded release JSON, fixtures/recorded/{owner}/{repo}/releases.json
+RECORDED_DIR = SCRIPT_DIR / "recorded"
+
+# Synthetic releases used when there is no recording
+# Structure: repo -> [(tag, prerelease, [asset names])], newest first like the GitHub API
+CATALOG = {
+  "PCSX2/pcsx2": [
+    ("v2.5.12", True, ["pcsx2-v2.5.12-linux-appimage-x64-Qt.AppImage"]),
+    ("v2.5.4", True, ["pcsx2-v2.5.4-linux-appimage-x64-Qt.AppImage"]),
+    ("v2.4.0", False, ["pcsx2-v2.4.0-linux-appimage-x64-Qt.AppImage"]),
+    ("v2.3.200", True, ["pcsx2-v2.3.200-linux-appimage-x64-Qt.AppImage"]),
+    ("v2.2.0", False, ["pcsx2-v2.2.0-linux-appimage-x64-Qt.AppImage"]),
+    ("v2.0.2", False, ["pcsx2-v2.0.2-linux-appimage-x64-Qt.AppImage"]),
+  ],
+  "RPCS3/rpcs3-binaries-linux": [
+    ("build-17200", False, ["rpcs3-v0.0.37-17200-1a2b3c4d_linux64.AppImage"]),
+    ("build-17100", False, ["rpcs3-v0.0.37-17100-2b3c4d5e_linux64.AppImage"]),
+    ("build-16900", False, ["rpcs3-v0.0.36-16900-3c4d5e6f_linux64.AppImage"]),
+    ("build-16500", False, ["rpcs3-v0.0.35-16500-4d5e6f7a_linux64.AppImage"]),
+  ],
+  "bottlesdevs/wine": [
+    ("caffe-9.7", False, ["caffe-9.7-x86_64.tar.xz"]),
+    ("caffe-8.21", False, ["caffe-8.21-x86_64.tar.xz"]),
+    ("soda-9.0-1", False, ["soda-9.0-1-x86_64.tar.xz"]),
+    ("vaniglia-8.0", False, ["vaniglia-8.0-x86_64.tar.xz"]),
+  ],
+  "Kron4ek/Wine-Builds": [
+    ("9.2", False, ["wine-9.2-staging-amd64.tar.xz", "wine-9.2-staging-tkg-amd64.tar.xz"]),
+    ("9.0", False, ["wine-9.0-staging-amd64.tar.xz", "wine-9.0-staging-tkg-amd64.tar.xz"]),
+    ("8.21", False, ["wine-8.21-staging-amd64.tar.xz", "wine-8.21-staging-tkg-amd64.tar.xz"]),
+  ],
+}
+
+# Buildbot listings
+BUILDBOT_STABLE = ["1.21.0", "1.20.0", "1.19.1", "1.19.0", "1.18.0"]
+BUILDBOT_CORES = ["mgba_libretro.so.zip", "snes9x_libretro.so.zip", "swanstation_libretro.so.zip"]
+
+# Modification time of the buildbot listings, matches the dates rendered by autoindex
+LISTING_MODIFIED = "Wed, 01 Jan 2025 00:00:00 GMT"
+
+# Main binary of the synthetic AppImages
+APPIMAGE_BINARIES = {
+  "pcsx2": "pcsx2-qt",
+  "rpcs3": "rpcs3",
+  "RetroArch": "retroarch",
+}
+
+SYNTHETIC_FLATIMAGE = r'''#!/usr/bin/env bash
+# Synthetic flatimage served by fixtures/server.py
+# Runs commands on the host, package management is a no-op and layers are tarballs
+cmd="$1"; shift
+case "$cmd" in
+  fim-perms|fim-env|fim-boot|fim-bind) exit 0 ;;
+  fim-layer)
+    case "$1" in
+      create) tar --sort=name -C "$2" -cf "$3" . ;;
+    esac
+  ;;
+  fim-root|fim-exec)
+    if [[ "$1" = pacman ]]; then
+      [[ " $* " = *" -Qi "* ]] && printf 'Name            : synthetic\nInstalled Size  : 1.00 MiB\n\n'
+      exit 0
+    fi
+    # Image paths do not exist on the host
+    [[ "$*" = *"/home/gameimage"* ]] && exit 0
+    if [[ "$*" = *"/var/lib/pacman"* ]]; then mkdir -p "${@: -1}"; exit 0; fi
+    # Seed of container/build-arch.sh, the image filesystem is not copied from the host
+    if [[ "$1" = cp ]] && [[ " $* " = *" /usr "* ]]; then mkdir -p "${@: -1}"; exit 0; fi
+    exec "$@"
+  ;;
+  *) echo "Synthetic flatimage" ;;
+esac
+'''
+
+SYNTHETIC_WINETRICKS = '#!/bin/sh\necho "winetricks (synthetic)"\n'
+
+
+def payload(key, size):
+  """
+  Deterministic incompressible payload, so assets have a realistic size.
+
+  Args:
+    key: Seed of the payload
+    size: Size in bytes
+
+  Returns:
+    Payload bytes
+  """
+  return random.Random(key).randbytes(size)
+
+
+def synthetic_elf(message):
+  """
+  Create a static x86-64 ELF that prints a message and exits, a runner binary that
+  verify.py checks like a real one, without interpreter or libraries.
+
+  Args:
+    message: Line to print
+
+  Returns:
+    ELF bytes
+  """
+  text = f"{message}\n".encode()
+  base = 0x400000
+  entry = 64 + 56
+  code = b"".join([
+    b"\xb8\x01\x00\x00\x00",                      # mov eax, 1 (write)
+    b"\xbf\x01\x00\x00\x00",                      # mov edi, 1 (stdout)
+    b"\x48\x8d\x35" + struct.pack("<i", 16),        # lea rsi, [rip + 16] (text)
+    b"\xba" + struct.pack("<I", len(text)),          # mov edx, len
+    b"\x0f\x05",                                     # syscall
+    b"\xb8\x3c\x00\x00\x00",                      # mov eax, 60 (exit)
+    b"\x31\xff",                                     # xor edi, edi
+    b"\x0f\x05",                                     # syscall
+  ])
+  size = entry + len(code) + len(text)
+  header = struct.pack(
+    "<16sHHIQQQIHHHHHH", b"\x7fELF\x02\x01\x01", 2, 0x3e, 1, base + entry, 64, 0, 0, 64, 56, 1, 64, 0, 0
+  )
+  segment = struct.pack("<IIQQQQQQ", 1, 5, 0, base, base, size, size, 0x1000)
+  return header + segment + code + text
+
+
+def synthetic_appimage(name, size):
+  """
+  Create a synthetic AppImage that supports --appimage-extract.
+
+  Args:
+    name: AppImage file name
+    size: Payload size in bytes
+
+  Returns:
+    AppImage bytes
+  """
+  binary = next((b for k, b in APPIMAGE_BINARIES.items() if k.lower() in name.lower()), "app")
+  match = re.search(r'v?(\d+\.\d+\.\d+(?:-\d+)?)', name)
+  version = match.group(1) if match else "0.0.0"
+  elf = "".join(f"\\{b:03o}" for b in synthetic_elf(f"{binary} {version}"))
+  script = f'''#!/bin/sh
+# Synthetic AppImage served by fixtures/server.py
+if [ "$1" = --appimage-extract ]; then
+  mkdir -p squashfs-root/usr/bin squashfs-root/usr/lib squashfs-root/usr/share
+  printf '{elf}' > squashfs-root/usr/bin/{binary}
+  chmod +x squashfs-root/usr/bin/{binary}
+  tail -c {size} "$0" > squashfs-root/usr/share/payload.bin
+  exit 0
+fi
+echo "{binary} {version}"
+exit 0
+'''
+  return script.encode() + payload(name, size)
+
+
+def synthetic_wine_tarball(name, size):
+  """
+  Create a synthetic wine tarball with a bin/wine that reports its version, see synthetic_elf.
+
+  Args:
+    name: Tarball file name
+    size: Payload size in bytes
+
+  Returns:
+    Tarball bytes
+  """
+  match = re.search(r'(\d+\.\d+)', name)
+  version = match.group(1) if match else "0.0"
+  stem = re.sub(r'\.tar\.\w+$', '', name)
+  mode = "w:xz" if name.endswith(".xz") else "w:gz"
+
+  files = {
+    f"{stem}/bin/wine": (synthetic_elf(f"wine-{version} (Synthetic)"), 0o755),
+    f"{stem}/share/wine/wine.inf": (b"[Version]\n", 0o644),
+    f"{stem}/lib/wine/payload.bin": (payload(name, size), 0o644),
+  }
+
+  buffer = io.BytesIO()
+  with tarfile.open(fileobj=buffer, mode=mode) as tar:
+    for path, (data, mode_file) in files.items():
+      info = tarfile.TarInfo(path)
+      info.size = len(data)
+      info.mode = mode_file
+      tar.addfile(info, io.BytesIO(data))
+  return buffer.getvalue()
+
+
+def synthetic_retroarch_7z(version, size):
+  """
+  Create a synthetic RetroArch.7z with the layout of the buildbot archives.
+
+  Args:
+    version: RetroArch version
+    size: Payload size in bytes
+
+  Returns:
+    Archive bytes or None if 7z is not available
+  """
+  if not shutil.which("7z"):
+    return None
+
+  with tempfile.TemporaryDirectory() as tmp:
+    extracted = Path(tmp) / "RetroArch-Linux-x86_64"
+    config = extracted / "RetroArch-Linux-x86_64.AppImage.home" / ".config" / "retroarch"
+    config.mkdir(parents=True)
+    (config / "retroarch.cfg").write_text("# Synthetic\n")
+    appimage = extracted / "RetroArch-Linux-x86_64.AppImage"
+    appimage.write_bytes(synthetic_appimage(f"RetroArch-v{version}.AppImage", size))
+    appimage.chmod(0o755)
+    archive = Path(tmp) / "RetroArch.7z"
+    subprocess.run(["7z", "a", str(archive), extracted.name], cwd=tmp, capture_output=True, check=True)
+    return archive.read_bytes()
+
+
+def autoindex(path, entries):
+  """
+  Render a directory listing like the buildbot nginx autoindex.
+
+  Args:
+    path: Listed path
+    entries: List of (href, name, size) tuples, size is "-" for directories
+
+  Returns:
+    HTML bytes
+  """
+  rows = "\n".join(
+    f'<a href="{href}">{name}</a>{" " * max(1, 51 - len(name))}01-Jan-2025 00:00{size:>20}'
+    for href, name, size in entries
+  )
+  return (
+    f"<html>\n<head><title>Index of {path}</title></head>\n<body>\n<h1>Index of {path}</h1><hr><pre>"
+    f'<a href="../">../</a>\n{rows}\n</pre><hr></body>\n</html>\n'
+  ).encode()
+
+
+def load_releases(repo):
+  """
+  Load the releases of a repository, recorded if available, synthetic otherwise.
+
+  Args:
+    repo: Repository as owner/name
+
+  Returns:
+    List of release dictionaries or None if unknown
+  """
+  recorded = RECORDED_DIR / repo / "releases.json"
+  if recorded.exists():
+    return json.loads(recorded.read_text())
+
+  if repo not in CATALOG:
+    return None
+
+  return [
+    {
+      "tag_name": tag,
+      "draft": False,
+      "prerelease": prerelease,
+      "assets": [
+        {"name": name, "browser_download_url": f"https://github.com/{repo}/releases/download/{tag}/{name}"}
+        for name in names
+      ],
+    }
+    for tag, prerelease, names in CATALOG[repo]
+  ]
+
+
+def record(repos):
+  """
+  Record the releases of repositories, keeping the fields the builders use.
+
+  Args:
+    repos: List of repositories as owner/name
+  """
+  for repo, releases in source.github_releases(repos).items():
+    if releases is None:
+      print(f"Error recording {repo}", file=sys.stderr)
+      continue
+
+    output = RECORDED_DIR / repo / "releases.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(releases, indent=2))
+    print(f"Recorded {len(releases)} releases of {repo} in {output}")
+
+
+class Handler(BaseHTTPRequestHandler):
+  """
+  Serves release JSON, buildbot listings and synthetic assets.
+  """
+  # Set by main
+  latency = 0.0
+  bandwidth = 0
+  asset_size = 0
+  cache = {}
+
+  def base_url(self):
+    return f"http://{self.headers.get('Host', '127.0.0.1')}"
+
+  def send_bytes(self, data, content_type="application/octet-stream", headers=None):
+    """
+    Send a response body, honoring Range requests and the configured bandwidth.
+    """
+    status = 200
+    headers = dict(headers or {})
+    headers["Accept-Ranges"] = "bytes"
+
+    match = re.match(r'bytes=(\d*)-(\d*)$', self.headers.get("Range", ""))
+    if match and (match.group(1) or match.group(2)):
+      start = int(match.group(1)) if match.group(1) else max(0, len(data) - int(match.group(2)))
+      end = int(match.group(2)) if match.group(1) and match.group(2) else len(data) - 1
+      end = min(end, len(data) - 1)
+      if start >= len(data) or start > end:
+        self.send_response(416)
+        self.send_header("Content-Range", f"bytes */{len(data)}")
+        self.end_headers()
+        return
+      headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+      data = data[start:end + 1]
+      status = 206
+
+    self.send_response(status)
+    self.send_header("Content-Type", content_type)
+    self.send_header("Content-Length", str(len(data)))
+    for key, value in headers.items():
+      self.send_header(key, value)
+    self.end_headers()
+
+    if self.command == "HEAD":
+      return
+
+    # Throttle in chunks to model the configured bandwidth
+    chunk = 64 * 1024
+    for offset in range(0, len(data), chunk):
+      self.wfile.write(data[offset:offset + chunk])
+      if self.bandwidth:
+        time.sleep(min(chunk, len(data) - offset) / self.bandwidth)
+
+  def send_error_text(self, status, message):
+    self.send_response(status)
+    self.send_header("Content-Type", "text/plain")
+    self.send_header("Content-Length", str(len(message)))
+    self.end_headers()
+    self.wfile.write(message.encode())
+
+  def cached(self, key, factory):
+    if key not in self.cache:
+      self.cache[key] = factory()
+    return self.cache[key]
+
+  def do_HEAD(self):
+    self.do_GET()
+
+  def do_GET(self):
+    if self.latency:
+      time.sleep(self.latency)
+
+    url = urlparse(self.path)
+    path = url.path
+
+    # GitHub API
+    if match := re.fullmatch(r'/api/repos/([^/]+/[^/]+)/releases', path):
+      return self.serve_releases(match.group(1), parse_qs(url.query))
+
+    # GitHub release assets
+    if match := re.fullmatch(r'/download/([^/]+)/([^/]+)/([^/]+)/([^/]+)', path):
+      return self.serve_asset(match.group(4))
+
+    # Buildbot listings, revalidated with If-Modified-Since
+    if path in ("/buildbot/stable/", "/buildbot/nightly/linux/x86_64/latest/"):
+      if self.headers.get("If-Modified-Since") == LISTING_MODIFIED:
+        self.send_response(304)
+        self.end_headers()
+        return
+      if path == "/buildbot/stable/":
+        entries = [(f"{v}/", f"{v}/", "-") for v in BUILDBOT_STABLE]
+      else:
+        entries = [(f"{path}{c}", c, "1048576") for c in BUILDBOT_CORES]
+      listing = autoindex(path.removeprefix("/buildbot"), entries)
+      return self.send_bytes(listing, "text/html", {"Last-Modified": LISTING_MODIFIED})
+
+    if match := re.fullmatch(r'/buildbot/stable/([^/]+)/linux/x86_64/RetroArch\.7z', path):
+      if match.group(1) not in BUILDBOT_STABLE:
+        return self.send_error_text(404, "Unknown version\n")
+      data = self.cached(path, lambda: synthetic_retroarch_7z(match.group(1), self.asset_size))
+      if data is None:
+        return self.send_error_text(501, "7z is required to create synthetic RetroArch archives\n")
+      return self.send_bytes(data)
+
+    self.send_error_text(404, f"Not found: {path}\n")
+
+  def serve_releases(self, repo, query):
+    releases = load_releases(repo)
+    if releases is None:
+      return self.send_error_text(404, f"Unknown repository: {repo}\n")
+
+    # Assets are downloaded from this server
+    base = self.base_url()
+    for release in releases:
+      for asset in release.get("assets", []):
+        name = asset.get("name") or Path(asset["browser_download_url"]).name
+        asset["browser_download_url"] = f"{base}/download/{repo}/{release.get('tag_name')}/{name}"
+
+    # Paginate like the GitHub API
+    per_page = int(query.get("per_page", ["30"])[0])
+    page = int(query.get("page", ["1"])[0])
+    pages = max(1, -(-len(releases) // per_page))
+    headers = {}
+    links = []
+    if page < pages:
+      links.append(f'<{base}/api/repos/{repo}/releases?per_page={per_page}&page={page + 1}>; rel="next"')
+      links.append(f'<{base}/api/repos/{repo}/releases?per_page={per_page}&page={pages}>; rel="last"')
+    if links:
+      headers["Link"] = ", ".join(links)
+
+    # Asset sizes like the GitHub API, of the served page only
+    releases = releases[(page - 1) * per_page:page * per_page]
+    for release in releases:
+      for asset in release.get("assets", []):
+        if (data := self.asset_data(Path(asset["browser_download_url"]).name)) is not None:
+          asset["size"] = len(data)
+
+    body = json.dumps(releases).encode()
+    self.send_bytes(body, "application/json", headers)
+
+  def asset_data(self, name):
+    if name.endswith(".flatimage"):
+      return SYNTHETIC_FLATIMAGE.encode()
+    if name == "winetricks":
+      return SYNTHETIC_WINETRICKS.encode()
+    if name.endswith(".AppImage"):
+      return self.cached(name, lambda: synthetic_appimage(name, self.asset_size))
+    if re.search(r'\.tar\.(xz|gz)$', name):
+      return self.cached(name, lambda: synthetic_wine_tarball(name, self.asset_size))
+    return None
+
+  def serve_asset(self, name):
+    data = self.asset_data(name)
+    if data is None:
+      return self.send_error_text(404, f"Unknown asset: {name}\n")
+    self.send_bytes(data)
+
+  def log_message(self, format, *args):
+    print(f"[server] {self.address_string()} {format % args}", file=sys.stderr)
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Local stand-in for GitHub and buildbot")
+  parser.add_argument("--host", default="127.0.0.1")
+  parser.add_argument("--port", type=int, default=8000)
+  parser.add_argument("--latency", type=float, default=0, help="Latency per request in milliseconds")
+  parser.add_argument("--bandwidth", type=float, default=0, help="Bandwidth in KiB/s, 0 for unlimited")
+  parser.add_argument("--asset-size", type=float, default=1, help="Payload of synthetic assets in MiB")
+  parser.add_argument("--record", nargs="+", metavar="REPO", help="Record releases of owner/name repositories and exit")
+  args = parser.parse_args()
+
+  if args.record:
+    record(args.record)
+    return
+
+  Handler.latency = args.latency / 1000
+  Handler.bandwidth = args.bandwidth * 1024
+  Handler.asset_size = int(args.asset_size * 1024 * 1024)
+
+  server = ThreadingHTTPServer((args.host, args.port), Handler)
+  print(f"Serving on http://{args.host}:{server.server_port}", flush=True)
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+
+
+if __name__ == "__main__":
+  main()
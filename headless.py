@@ -0,0 +1,34 @@
+######################################################################
+# @author      : Ruan E. Formigoni (ruanformigoni@gmail.com)
+# @file        : headless
+# @description : Run the flatimage without a GPU or a display
+######################################################################
+
+import os
+from pathlib import Path
+
+# Environment for a run without a GPU or a display
+ENV = [
+  "QT_QPA_PLATFORM=offscreen",
+  "SDL_VIDEODRIVER=dummy",
+  "SDL_AUDIODRIVER=dummy",
+  "DISPLAY=",
+  "WAYLAND_DISPLAY=",
+  "WINEDEBUG=-all",
+]
+
+
+def container_env(image_path, *layers):
+  """
+  Environment to run the image with its optional container layers mounted.
+
+  Args:
+    image_path: Path to the flatimage
+    layers: Additional layer files mounted after the container layers
+
+  Returns:
+    Environment dictionary
+  """
+  container_layers = sorted(Path(image_path).resolve().parent.glob("arch--*.layer"))
+  paths = [*container_layers, *(Path(l).resolve() for l in layers)]
+  return {**os.environ, "FIM_DIRS_LAYER": ":".join(str(p) for p in paths)}
@@ -0,0 +1,259 @@
+######################################################################
+# @author      : Ruan E. Formigoni (ruanformigoni@gmail.com)
+# @file        : httpclient
+# @description : Asyncio HTTP/1.1 client with connection pooling
+######################################################################
+
+import asyncio
+import json
+import ssl
+import zlib
+from collections import defaultdict
+from urllib.parse import urljoin, urlsplit
+
+USER_AGENT = "gameimage-runners"
+
+# Statuses without a response body
+NO_BODY_STATUS = {204, 304}
+
+# Size of the body reads
+CHUNK_SIZE = 64 * 1024
+
+
+class HTTPError(Exception):
+  """
+  Raised on malformed responses, connection failures and timeouts.
+  """
+
+
+class Response:
+  """
+  A complete HTTP response.
+
+  Attributes:
+    url: Final URL, after redirects
+    status: Status code
+    headers: Dictionary of lower-case header names to values
+    body: Decoded body bytes
+  """
+
+  def __init__(self, url, status, headers, body):
+    self.url = url
+    self.status = status
+    self.headers = headers
+    self.body = body
+
+  def text(self):
+    return self.body.decode("utf-8", errors="replace")
+
+  def json(self):
+    return json.loads(self.body)
+
+
+class Client:
+  """
+  HTTP client with keep-alive connection pooling, gzip, bounded concurrency and timeouts.
+
+  Use as an async context manager, pooled connections are closed on exit.
+  """
+
+  def __init__(self, concurrency=8, timeout=30, headers=None):
+    """
+    Args:
+      concurrency: Maximum number of requests in flight
+      timeout: Timeout in seconds for each request, including the body
+      headers: Headers sent with every request
+    """
+    self.timeout = timeout
+    self.headers = headers or {}
+    self._semaphore = asyncio.Semaphore(concurrency)
+    self._idle = defaultdict(list)
+    self._ssl = ssl.create_default_context()
+
+  async def __aenter__(self):
+    return self
+
+  async def __aexit__(self, *exc):
+    await self.close()
+
+  async def close(self):
+    """
+    Close all idle connections.
+    """
+    for connections in self._idle.values():
+      for _, writer in connections:
+        writer.close()
+    self._idle.clear()
+
+  async def get(self, url, headers=None, redirects=5, consumer=None):
+    """
+    Send a GET request, following redirects.
+
+    Args:
+      url: Request URL
+      headers: Additional request headers
+      redirects: Maximum number of redirects to follow
+      consumer: Called with each decoded chunk of a 200 or 206 (range) response body as it
+        arrives, the body is then not kept in the response
+
+    Returns:
+      Response
+
+    Raises:
+      HTTPError on connection failures, malformed responses and timeouts
+    """
+    return await self._follow("GET", url, headers, redirects, consumer)
+
+  async def head(self, url, headers=None, redirects=5):
+    """
+    Send a HEAD request, following redirects.
+
+    Args:
+      url: Request URL
+      headers: Additional request headers
+      redirects: Maximum number of redirects to follow
+
+    Returns:
+      Response with an empty body
+
+    Raises:
+      HTTPError on connection failures, malformed responses and timeouts
+    """
+    return await self._follow("HEAD", url, headers, redirects)
+
+  async def _follow(self, method, url, headers, redirects, consumer=None):
+    async with self._semaphore:
+      for _ in range(redirects + 1):
+        try:
+          response = await asyncio.wait_for(self._request(method, url, headers or {}, consumer), self.timeout)
+        except asyncio.TimeoutError:
+          raise HTTPError(f"Timed out after {self.timeout}s: {url}") from None
+        if response.status in (301, 302, 303, 307, 308) and "location" in response.headers:
+          url = urljoin(url, response.headers["location"])
+          continue
+        return response
+    raise HTTPError(f"Too many redirects: {url}")
+
+  async def _connect(self, key):
+    scheme, host, port = key
+    # Reuse an idle connection if the server has not closed it
+    while self._idle[key]:
+      reader, writer = self._idle[key].pop()
+      if not reader.at_eof() and not writer.is_closing():
+        return reader, writer, True
+      writer.close()
+    reader, writer = await asyncio.open_connection(
+      host, port, ssl=self._ssl if scheme == "https" else None,
+      server_hostname=host if scheme == "https" else None,
+    )
+    return reader, writer, False
+
+  async def _request(self, method, url, headers, consumer=None):
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https"):
+      raise HTTPError(f"Unsupported scheme: {url}")
+    port = parts.port or (443 if parts.scheme == "https" else 80)
+    key = (parts.scheme, parts.hostname, port)
+    target = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+
+    request_headers = {
+      "Host": parts.netloc,
+      "User-Agent": USER_AGENT,
+      "Accept-Encoding": "gzip, deflate",
+      "Connection": "keep-alive",
+      **self.headers,
+      **headers,
+    }
+    request = f"{method} {target} HTTP/1.1\r\n"
+    request += "".join(f"{k}: {v}\r\n" for k, v in request_headers.items()) + "\r\n"
+
+    # A reused connection may have been closed by the server, retry once on a new one
+    for attempt in range(2):
+      # Name resolution, refused connections and TLS handshakes fail with OSError
+      try:
+        reader, writer, reused = await self._connect(key)
+      except OSError as e:
+        raise HTTPError(f"Connection failed: {url}: {e}") from None
+      try:
+        writer.write(request.encode())
+        await writer.drain()
+        status, response_headers, body, keep_alive = await self._read_response(reader, method, consumer)
+      except (OSError, asyncio.IncompleteReadError) as e:
+        writer.close()
+        if reused and attempt == 0:
+          continue
+        raise HTTPError(f"Connection failed: {url}: {e}") from None
+      except asyncio.LimitOverrunError:
+        writer.close()
+        raise HTTPError(f"Malformed response, line too long: {url}") from None
+      except BaseException:
+        writer.close()
+        raise
+      break
+
+    if keep_alive:
+      self._idle[key].append((reader, writer))
+    else:
+      writer.close()
+
+    return Response(url, status, response_headers, body)
+
+  async def _read_response(self, reader, method, consumer=None):
+    status_line = await reader.readuntil(b"\r\n")
+    try:
+      version, status, *_ = status_line.decode("latin-1").split(" ", 2)
+      status = int(status)
+    except ValueError:
+      raise HTTPError(f"Malformed status line: {status_line!r}") from None
+
+    headers = {}
+    while (line := await reader.readuntil(b"\r\n")) != b"\r\n":
+      name, _, value = line.decode("latin-1").partition(":")
+      headers[name.strip().lower()] = value.strip()
+
+    keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+
+    # Decode and hand over the body chunk by chunk
+    decoder = _decoder(headers.get("content-encoding"))
+    body = bytearray()
+    sink = consumer if consumer and status in (200, 206) else body.extend
+
+    def feed(chunk):
+      if data := decoder.decompress(chunk) if decoder else chunk:
+        sink(data)
+
+    if method == "HEAD" or status in NO_BODY_STATUS or 100 <= status < 200:
+      pass
+    elif headers.get("transfer-encoding", "").lower() == "chunked":
+      while size := int((await reader.readuntil(b"\r\n")).split(b";")[0], 16):
+        feed(await reader.readexactly(size))
+        await reader.readexactly(2)
+      # Trailers
+      while await reader.readuntil(b"\r\n") != b"\r\n":
+        pass
+    elif "content-length" in headers:
+      remaining = int(headers["content-length"])
+      while remaining:
+        chunk = await reader.readexactly(min(remaining, CHUNK_SIZE))
+        remaining -= len(chunk)
+        feed(chunk)
+    else:
+      while chunk := await reader.read(CHUNK_SIZE):
+        feed(chunk)
+      keep_alive = False
+
+    if decoder and (data := decoder.flush()):
+      sink(data)
+
+    return status, headers, bytes(body), keep_alive
+
+
+def _decoder(encoding):
+  """
+  Incremental decoder of a gzip or deflate encoded body, None for identity.
+  """
+  if encoding == "gzip":
+    return zlib.decompressobj(16 + zlib.MAX_WBITS)
+  if encoding == "deflate":
+    return zlib.decompressobj()
+  return None
@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+
+######################################################################
+# @author      : Ruan E. Formigoni (ruanformigoni@gmail.com)
+# @file        : jobqueue
+# @description : Distribute layer builds across workers through a directory queue
+######################################################################
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import builddb
+import disk
+
+SCRIPT_DIR = Path(__file__).parent
+
+# Queue directory, share it (e.g., over NFS) to run workers on several hosts
+# Structure:
+#   pending/, running/, done/, failed/  one {id}.json job per file, claimed by an atomic rename
+#   results/{id}/                       layers, checksums and build database of a job
+#   logs/{id}.log                       builder output of the last run of a job
+#   plans/, work/                       scratch directories of the planners and workers
+QUEUE_DIR = Path(os.environ.get("GAMEIMAGE_QUEUE_DIR", SCRIPT_DIR / "build" / "queue"))
+
+STATES = ["pending", "running", "done", "failed"]
+
+PLATFORMS = ["wine", "pcsx2", "retroarch", "rpcs3"]
+
+
+def job_id(platform, job):
+  """
+  Identifier of a job, stable across plans of the same release.
+  """
+  return f"{platform}-{hashlib.sha256(job['url'].encode()).hexdigest()[:16]}"
+
+
+def job_state(queue_dir, id):
+  """
+  State of a job or None if it is not in the queue.
+  """
+  return next((state for state in STATES if (queue_dir / state / f"{id}.json").exists()), None)
+
+
+def plan(image_path, platforms, queue_dir, builder_args):
+  """
+  Queue the jobs the builders select, jobs already in the queue are kept as they are.
+
+  Args:
+    image_path: Path to the flatimage the jobs are built with
+    platforms: List of platform names
+    queue_dir: Queue directory
+    builder_args: Options for the builders, see <platform>/build-arch.py --help
+
+  Returns:
+    Number of queued jobs or None if a builder failed
+  """
+  image_sha256 = builddb.sha256(image_path)
+  queued = 0
+
+  for platform in platforms:
+    plan_file = queue_dir / "plans" / f"{platform}.json"
+    result = subprocess.run(
+      [str(SCRIPT_DIR / platform / "build-arch.py"), str(image_path.resolve()), "--plan", str(plan_file.resolve()),
+        *builder_args],
+      env={**os.environ, "GAMEIMAGE_BUILD_DIR": str((queue_dir / "plans" / platform).resolve())},
+    )
+    if result.returncode != 0:
+      print(f"Error planning {platform} jobs", file=sys.stderr)
+      return None
+
+    for job in json.loads(plan_file.read_text()):
+      id = job_id(platform, job)
+      if state := job_state(queue_dir, id):
+        print(f"Already {state}: {id}")
+        continue
+
+      # Written aside and renamed, workers never see a partial job
+      spec = {"id": id, "platform": platform, "image_sha256": image_sha256, "job": job}
+      tmp = queue_dir / "pending" / f".{id}.json.tmp"
+      tmp.write_text(json.dumps(spec, indent=2))
+      tmp.rename(queue_dir / "pending" / f"{id}.json")
+      print(f"Queued: {id} ({Path(job['url']).name})")
+      queued += 1
+
+  return queued
+
+
+def claim(queue_dir):
+  """
+  Claim the next pending job, rename is atomic, so each job goes to a single worker.
+
+  Returns:
+    Path to the job in running/ or None if there are no pending jobs
+  """
+  for path in sorted((queue_dir / "pending").glob("*.json")):
+    target = queue_dir / "running" / path.name
+    try:
+      path.rename(target)
+    except FileNotFoundError:
+      # Claimed by another worker
+      continue
+    return target
+  return None
+
+
+def run_job(image_path, image_sha256, job_path, queue_dir, workers):
+  """
+  Build a claimed job into its result directory.
+
+  Args:
+    image_path: Path to the flatimage of this worker
+    image_sha256: Checksum of the flatimage
+    job_path: Path to the job in running/
+    queue_dir: Queue directory
+    workers: Number of jobs built at the same time on this host, they share its disk space
+
+  Returns:
+    True if successful, False otherwise
+  """
+  spec = json.loads(job_path.read_text())
+  id = spec["id"]
+
+  # Layers built with another container would not match the rest of dist/
+  if spec["image_sha256"] != image_sha256:
+    print(f"Failed: {id}, planned for image {spec['image_sha256'][:12]}, this worker has {image_sha256[:12]}",
+      file=sys.stderr)
+    job_path.rename(queue_dir / "failed" / job_path.name)
+    return False
+
+  result_dir = queue_dir / "results" / id
+  work_dir = queue_dir / "work" / f"{socket.gethostname()}-{id}"
+  disk.remove(result_dir, work_dir)
+
+  print(f"Building: {id} ({Path(spec['job']['url']).name})")
+  with open(queue_dir / "logs" / f"{id}.log", "w") as log:
+    result = subprocess.run(
+      [str(SCRIPT_DIR / spec["platform"] / "build-arch.py"), str(image_path.resolve()),
+        "--job", json.dumps(spec["job"])],
+      stdout=log,
+      stderr=subprocess.STDOUT,
+      env={
+        **os.environ,
+        "GAMEIMAGE_BUILD_DIR": str(work_dir.resolve()),
+        "GAMEIMAGE_DIST_DIR": str(result_dir.resolve()),
+        "GAMEIMAGE_DISK_SHARES": str(workers),
+      },
+    )
+  disk.remove(work_dir)
+
+  success = result.returncode == 0 and any(result_dir.glob("*.layer"))
+  job_path.rename(queue_dir / ("done" if success else "failed") / job_path.name)
+  print(f"{'Done' if success else 'Failed'}: {id}")
+  return success
+
+
+def work(image_path, queue_dir, workers):
+  """
+  Build pending jobs until none is left.
+
+  Args:
+    image_path: Path to the flatimage
+    queue_dir: Queue directory
+    workers: Number of jobs built at the same time
+
+  Returns:
+    Tuple of (built, failed) job counts
+  """
+  image_sha256 = builddb.sha256(image_path)
+
+  def worker():
+    counts = [0, 0]
+    while job_path := claim(queue_dir):
+      counts[0 if run_job(image_path, image_sha256, job_path, queue_dir, workers) else 1] += 1
+    return counts
+
+  with ThreadPoolExecutor(max_workers=workers) as executor:
+    results = list(executor.map(lambda _: worker(), range(workers)))
+
+  return sum(r[0] for r in results), sum(r[1] for r in results)
+
+
+def collect(queue_dir, dist_dir):
+  """
+  Move the results of done jobs into the dist directory and its build database.
+
+  Args:
+    queue_dir: Queue directory
+    dist_dir: Path to the dist directory
+
+  Returns:
+    Number of collected layers
+  """
+  collected = 0
+  for job_path in sorted((queue_dir / "done").glob("*.json")):
+    result_dir = queue_dir / "results" / job_path.stem
+    if not result_dir.is_dir():
+      continue
+
+    records = {record["name"]: record for record in builddb.layers(result_dir)}
+    for layer_file in sorted(result_dir.glob("*.layer")):
+      checksum_file = result_dir / f"{layer_file.name}.sha256sum"
+      if checksum_file.exists():
+        shutil.move(checksum_file, dist_dir / checksum_file.name)
+      shutil.move(layer_file, dist_dir / layer_file.name)
+
+      record = records.get(layer_file.name, {})
+      builddb.record_layer(
+        dist_dir / layer_file.name,
+        source_url=record.get("source_url"),
+        build_seconds=record.get("build_seconds"),
+        compression=record.get("compression") or "default",
+        meta=record.get("meta"),
+      )
+      print(f"Collected {layer_file.name}")
+      collected += 1
+
+    shutil.rmtree(result_dir)
+
+  return collected
+
+
+def main():
+  # Options after -- go to the builders
+  argv = sys.argv[1:]
+  builder_args = []
+  if "--" in argv:
+    argv, builder_args = argv[:argv.index("--")], argv[argv.index("--") + 1:]
+
+  parser = argparse.ArgumentParser(description="Distribute layer builds across workers through a directory queue")
+  parser.add_argument("--queue", type=Path, default=QUEUE_DIR, help=f"Queue directory (default: {QUEUE_DIR})")
+  subparsers = parser.add_subparsers(dest="command", required=True)
+
+  plan_parser = subparsers.add_parser("plan", help="Queue the jobs of platforms, [-- builder options]")
+  plan_parser.add_argument("image", type=Path, help="Path to the flatimage")
+  # Validated by hand, argparse checks a list default against choices as a single value
+  plan_parser.add_argument("platforms", nargs="*", default=None,
+    help=f"Platforms, from {', '.join(PLATFORMS)} (default: all)")
+
+  worker_parser = subparsers.add_parser("worker", help="Build pending jobs")
+  worker_parser.add_argument("image", type=Path, help="Path to the flatimage, must match the planned one")
+  worker_parser.add_argument("--workers", type=int, default=1, help="Jobs built at the same time (default: 1)")
+
+  collect_parser = subparsers.add_parser("collect", help="Move the results of done jobs into dist/")
+  collect_parser.add_argument("--dist", type=Path, default=SCRIPT_DIR / "dist", help="Dist directory")
+
+  subparsers.add_parser("status", help="Count the jobs in each state, fails if any job failed")
+
+  requeue_parser = subparsers.add_parser("requeue", help="Move failed jobs back to pending")
+  requeue_parser.add_argument("--running", action="store_true",
+    help="Also move running jobs back, e.g., of workers that died")
+
+  args = parser.parse_args(argv)
+
+  if args.command == "plan":
+    args.platforms = args.platforms or PLATFORMS
+    for platform in args.platforms:
+      if platform not in PLATFORMS:
+        plan_parser.error(f"invalid platform '{platform}', choose from {', '.join(PLATFORMS)}")
+
+  for name in [*STATES, "results", "logs", "plans", "work"]:
+    (args.queue / name).mkdir(parents=True, exist_ok=True)
+
+  if args.command in ["plan", "worker"] and not args.image.is_file():
+    print(f"Error: {args.image} is not a regular file")
+    sys.exit(1)
+
+  if args.command == "plan":
+    queued = plan(args.image, args.platforms, args.queue, builder_args)
+    if queued is None:
+      sys.exit(1)
+    print(f"\nQueued {queued} jobs")
+
+  elif args.command == "worker":
+    built, failed = work(args.image, args.queue, args.workers)
+    print(f"\nBuilt {built} jobs, {failed} failed, see {args.queue / 'logs'}")
+    if failed:
+      sys.exit(1)
+
+  elif args.command == "collect":
+    args.dist.mkdir(exist_ok=True)
+    print(f"\nCollected {collect(args.queue, args.dist)} layers into {args.dist}")
+
+  elif args.command == "status":
+    for state in STATES:
+      print(f"{state}: {len(list((args.queue / state).glob('*.json')))}")
+    failed = sorted((args.queue / "failed").glob("*.json"))
+    for job_path in failed:
+      print(f"  failed {job_path.stem}, see {args.queue / 'logs' / f'{job_path.stem}.log'}")
+    # Failed jobs are missing from dist/
+    if failed:
+      sys.exit(1)
+
+  elif args.command == "requeue":
+    for state in ["failed", "running"] if args.running else ["failed"]:
+      for job_path in (args.queue / state).glob("*.json"):
+        job_path.rename(args.queue / "pending" / job_path.name)
+        print(f"Requeued: {job_path.stem}")
+
+
+if __name__ == "__main__":
+  main()
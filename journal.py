@@ -0,0 +1,163 @@
+######################################################################
+# @author      : Ruan E. Formigoni (ruanformigoni@gmail.com)
+# @file        : journal
+# @description : Checkpoint builder work items to resume interrupted builds
+######################################################################
+
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import time
+from pathlib import Path
+
+import builddb
+
+# Resume an interrupted build instead of starting over, see build.sh --resume
+RESUME = os.environ.get("GAMEIMAGE_RESUME", "0") == "1"
+
+# Journal file, lives in the build directory of each builder
+JOURNAL_NAME = ".journal.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS stages (
+  item TEXT NOT NULL,
+  stage TEXT NOT NULL,
+  data TEXT NOT NULL,
+  done_at REAL NOT NULL,
+  PRIMARY KEY (item, stage)
+);
+"""
+
+
+def tree_digest(path):
+  """
+  Checksum of the layout of a directory tree, paths, sizes, modes and symlink targets.
+
+  File contents are not read, the digest detects trees that were removed or left
+  incomplete by an interrupted stage.
+
+  Args:
+    path: Path to the directory
+
+  Returns:
+    Hex digest string
+  """
+  digest = hashlib.sha256()
+  for root, dirs, files in os.walk(path):
+    dirs.sort()
+    for name in sorted(dirs + files):
+      entry = Path(root) / name
+      st = entry.lstat()
+      target = os.readlink(entry) if entry.is_symlink() else ""
+      digest.update(f"{entry.relative_to(path)}\0{st.st_mode}\0{st.st_size}\0{target}\n".encode())
+  return digest.hexdigest()
+
+
+def digest(path):
+  """
+  Checksum of a file (see builddb.sha256) or the layout of a directory (see tree_digest).
+  """
+  path = Path(path)
+  return tree_digest(path) if path.is_dir() else builddb.sha256(path)
+
+
+def check_size(path, size):
+  """
+  Check a download against the size announced by the server.
+
+  Args:
+    path: Path to the downloaded file
+    size: Expected size in bytes, None if unknown
+
+  Returns:
+    True if the size matches or is unknown, False otherwise
+  """
+  if size is not None and path.stat().st_size != size:
+    print(f"Error: {path.name} has {path.stat().st_size} bytes, expected {size}", file=sys.stderr)
+    return False
+  return True
+
+
+class Journal:
+  """
+  Completed stages of the work items of a builder, e.g., the download, the extracted tree
+  and the layer of a release, with the checksums to validate their outputs on resume.
+  """
+
+  def __init__(self, build_dir):
+    self.db = sqlite3.connect(Path(build_dir) / JOURNAL_NAME, timeout=30)
+    self.db.executescript(SCHEMA)
+
+  def done(self, item, stage, path=None, **data):
+    """
+    Record a completed stage.
+
+    Args:
+      item: Work item, e.g., its download URL
+      stage: Stage name, e.g., download, extract, layer
+      path: Output of the stage, its checksum is recorded
+      data: Additional JSON serializable fields
+    """
+    if path is not None:
+      data = {**data, "path": str(Path(path).resolve()), "digest": digest(path)}
+    with self.db:
+      self.db.execute(
+        "INSERT OR REPLACE INTO stages VALUES (?, ?, ?, ?)",
+        (item, stage, json.dumps(data), time.time()),
+      )
+
+  def get(self, item, stage):
+    """
+    Read the record of a completed stage.
+
+    Returns:
+      Dictionary of the recorded fields or None if the stage was not completed
+    """
+    row = self.db.execute("SELECT data FROM stages WHERE item = ? AND stage = ?", (item, stage)).fetchone()
+    return json.loads(row[0]) if row else None
+
+  def reuse(self, item, stage):
+    """
+    Read the record of a completed stage whose output is still intact.
+
+    Returns:
+      Dictionary of the recorded fields with path as a Path, or None if the stage was not
+      completed or its output changed since
+    """
+    record = self.get(item, stage)
+    if record is None or "path" not in record:
+      return record
+
+    path = Path(record["path"])
+    if not path.exists() or digest(path) != record["digest"]:
+      print(f"Not reusing {stage} of {item}: {path.name} is missing or changed")
+      return None
+
+    print(f"Reusing {stage} of {item}: {path.name}")
+    return {**record, "path": path}
+
+  def memo(self, item, key, compute):
+    """
+    Reuse the result of a computation recorded with the same key, e.g., the release
+    selection of the same builder options.
+
+    Args:
+      item: Work item
+      key: JSON serializable arguments of the computation
+      compute: Called without arguments if there is no recorded result
+
+    Returns:
+      The recorded or computed result, after a JSON round trip, empty results (e.g., of a
+      failed fetch) are not recorded
+    """
+    record = self.get(item, "memo")
+    if record is not None and record["key"] == json.loads(json.dumps(key)):
+      print(f"Reusing {item}")
+      return record["result"]
+
+    result = json.loads(json.dumps(compute()))
+    if any(result.values() if isinstance(result, dict) else result):
+      self.done(item, "memo", key=key, result=result)
+    return result
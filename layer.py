@@ -0,0 +1,184 @@
+######################################################################
+# @author      : Ruan E. Formigoni (ruanformigoni@gmail.com)
+# @file        : layer
+# @description : Create layers with selectable compression profiles
+######################################################################
+
+import fnmatch
+import os
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+# Profile used by the builders, see PROFILES
+PROFILE = os.environ.get("GAMEIMAGE_LAYER_PROFILE", "default")
+
+# Compression profiles
+# "default": whatever fim-layer create uses, its mkdwarfs options are not ours, so layers are
+# only byte-identical if it does not stamp the creation time, not verified with a real
+# flatimage, see reproduce.py
+# "fast-mount": tuned for launch latency, small blocks that decompress quickly on random
+# access, files read at launch first, incompressible files stored without compression
+PROFILES = {
+  "default": None,
+  "fast-mount": [
+    # 1 MiB blocks instead of 16 MiB, a cold read decompresses less data it does not need
+    "--block-size-bits=20",
+    "--categorize=incompressible",
+    "-C", "zstd:level=19",
+    "-C", "incompressible::null",
+  ],
+}
+
+# Modification time of every entry of a layer tree, layers created from the same tree are
+# byte-identical. Defaults to 1980-01-01, the earliest time zip and some archivers can store
+SOURCE_DATE_EPOCH = int(os.environ.get("SOURCE_DATE_EPOCH", "315532800"))
+
+# Files opened at launch recorded by access.py, {platform}/access.txt in this repository,
+# one path relative to the runner version directory per line in access order
+ACCESS_FILE = "access.txt"
+
+# Files read at launch, relative to a runner version directory, after the recorded ones
+# Structure: /opt/gameimage/runners/{platform}/{owner}/{repo}/{dist}/{channel}/{version}/
+HOT_PATTERNS = [
+  "boot",
+  "profile.sh",
+  "bin/*",
+  "lib/*",
+  "data/bin/*",
+  "data/lib/*",
+]
+
+
+def recorded_access(platform):
+  """
+  Read the recorded launch access order of a platform.
+
+  Args:
+    platform: Platform name, e.g., pcsx2
+
+  Returns:
+    List of paths relative to a runner version directory, empty if none was recorded
+  """
+  access_file = Path(__file__).parent / platform / ACCESS_FILE
+  if not access_file.exists():
+    return []
+  return [line for line in access_file.read_text().splitlines() if line and not line.startswith("#")]
+
+
+def launch_order(root_dir, hot=None):
+  """
+  Order the files of a layer tree with the files read at launch first.
+
+  Args:
+    root_dir: Root of the layer tree
+    hot: List of paths relative to root_dir read at launch, in order; the recorded access
+      order and the files matching HOT_PATTERNS of each runner follow them
+
+  Returns:
+    List of file paths relative to root_dir
+  """
+  root_dir = Path(root_dir)
+  files = sorted(str(p.relative_to(root_dir)) for p in root_dir.rglob("*") if p.is_file() and not p.is_symlink())
+
+  order = [p for p in (hot or []) if (root_dir / p).is_file()]
+  for version_dir in sorted(root_dir.glob("opt/gameimage/runners/*/*/*/*/*/*")):
+    prefix = str(version_dir.relative_to(root_dir))
+    platform = version_dir.relative_to(root_dir).parts[3]
+    order += [f"{prefix}/{p}" for p in recorded_access(platform) if (version_dir / p).is_file()]
+    for pattern in HOT_PATTERNS:
+      order += [f for f in files if fnmatch.fnmatch(f, f"{prefix}/{pattern}")]
+
+  # Remaining files in path order
+  order += files
+  return list(dict.fromkeys(order))
+
+
+def normalize(root_dir, epoch=None):
+  """
+  Clamp the metadata of a layer tree that extractors and builders leave behind.
+
+  Timestamps are set to epoch, permissions to 0755 for directories and executables and
+  0644 for other files, and ownership to root when running as root, e.g., for tarballs
+  extracted with the uid of their packager. Unprivileged builds keep the builder uid, so
+  layers are only identical across hosts built with the same uid. Entries are ordered by
+  the layer tools, dwarfs directories are sorted by name.
+
+  Args:
+    root_dir: Root of the layer tree
+    epoch: Timestamp in seconds, defaults to SOURCE_DATE_EPOCH
+  """
+  epoch = SOURCE_DATE_EPOCH if epoch is None else epoch
+  root = os.geteuid() == 0
+
+  # Children first, updating an entry changes the modification time of its directory
+  for parent, dirs, files in os.walk(root_dir, topdown=False):
+    for name in sorted(dirs + files):
+      path = os.path.join(parent, name)
+      st = os.lstat(path)
+      if root:
+        os.lchown(path, 0, 0)
+      if not stat.S_ISLNK(st.st_mode):
+        executable = stat.S_ISDIR(st.st_mode) or st.st_mode & 0o111
+        os.chmod(path, 0o755 if executable else 0o644)
+      os.utime(path, (epoch, epoch), follow_symlinks=False)
+
+  if root:
+    os.lchown(root_dir, 0, 0)
+  os.chmod(root_dir, 0o755)
+  os.utime(root_dir, (epoch, epoch))
+
+
+def create_layer(image_path, root_dir, layer_name, profile=None, hot=None):
+  """
+  Create a layer from a directory as it is, builders normalize it first, see normalize.
+
+  Args:
+    image_path: Path to the flatimage
+    root_dir: Root of the layer tree
+    layer_name: Output layer file
+    profile: Compression profile, defaults to GAMEIMAGE_LAYER_PROFILE
+    hot: Paths read at launch for profiles that order files, see launch_order
+
+  Returns:
+    True if successful, False otherwise
+  """
+  profile = profile or PROFILE
+  if profile not in PROFILES:
+    print(f"Error: unknown layer profile '{profile}', choose from {', '.join(PROFILES)}", file=sys.stderr)
+    return False
+
+  if PROFILES[profile] is None:
+    result = subprocess.run(
+      [str(image_path), "fim-layer", "create", str(root_dir), str(layer_name)],
+      capture_output=True,
+      env={**os.environ, "FIM_DEBUG": "1"}
+    )
+    if result.returncode != 0:
+      print(f"Error creating layer: {result.stderr.decode()}", file=sys.stderr)
+      return False
+    return True
+
+  if not shutil.which("mkdwarfs"):
+    print(f"Error: mkdwarfs is required for the '{profile}' layer profile", file=sys.stderr)
+    return False
+
+  with tempfile.NamedTemporaryFile("w", prefix="order-", suffix=".txt") as order_file:
+    order_file.write("".join(f"{p}\n" for p in launch_order(root_dir, hot)))
+    order_file.flush()
+
+    result = subprocess.run(
+      ["mkdwarfs", "-i", str(root_dir), "-o", str(layer_name), "--force", "--log-level=warn",
+        f"--order=explicit:file={order_file.name}", f"--set-time={SOURCE_DATE_EPOCH}", "--no-create-timestamp",
+        *PROFILES[profile]],
+      capture_output=True,
+    )
+
+  if result.returncode != 0:
+    print(f"Error creating layer: {result.stderr.decode()}", file=sys.stderr)
+    return False
+
+  return True
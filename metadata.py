@@ -0,0 +1,116 @@
+######################################################################
+# @author      : Ruan E. Formigoni (ruanformigoni@gmail.com)
+# @file        : metadata
+# @description : Read runner metadata from staged trees without executing them
+######################################################################
+
+import re
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+import elf
+import verify
+
+# Libraries whose read-only data holds the wine build string, relative to a wine directory,
+# the unix side of ntdll since wine 6, libwine before
+WINE_VERSION_FILES = [
+  "lib/wine/x86_64-unix/ntdll.so",
+  "lib64/wine/x86_64-unix/ntdll.so",
+  "lib/wine/i386-unix/ntdll.so",
+  "lib64/wine/ntdll.so",
+  "lib/wine/ntdll.so",
+  "lib64/libwine.so.1",
+  "lib/libwine.so.1",
+]
+
+# Build string reported by wine --version, e.g., "wine-9.2 (Staging)"
+WINE_BUILD = re.compile(rb"(?:^|\0)(wine-\d+\.\d+[\w.\-]*)(?: \([^\0)]*\))?\0")
+
+# AppStream metadata of a runner, relative to a runner version directory
+APPSTREAM_PATTERNS = [
+  "share/metainfo/*.xml",
+  "share/appdata/*.xml",
+  "data/share/metainfo/*.xml",
+]
+
+
+def wine_version(wine_dir):
+  """
+  Read the version of a wine build from its libraries.
+
+  Args:
+    wine_dir: Path to the extracted wine directory
+
+  Returns:
+    Version as printed by wine --version, e.g., wine-9.2, or None if not found
+  """
+  for name in WINE_VERSION_FILES:
+    rodata = elf.read_section(Path(wine_dir) / name, ".rodata")
+    if rodata and (match := WINE_BUILD.search(rodata)):
+      return match.group(1).decode()
+  return None
+
+
+def appstream_version(version_dir):
+  """
+  Read the latest release version of the AppStream metadata of a runner.
+
+  Args:
+    version_dir: Runner version directory
+
+  Returns:
+    Version string or None if there is no metadata with releases
+  """
+  for pattern in APPSTREAM_PATTERNS:
+    for path in sorted(Path(version_dir).glob(pattern)):
+      try:
+        releases = ET.parse(path).getroot().findall("releases/release")
+      except ET.ParseError:
+        continue
+      # Releases are listed newest first
+      if releases and releases[0].get("version"):
+        return releases[0].get("version")
+  return None
+
+
+def bundled_sonames(version_dir):
+  """
+  List the sonames of the libraries bundled with a runner, see verify.BUNDLED_LIB_DIRS.
+
+  Returns:
+    Sorted list of sonames
+  """
+  sonames = set()
+  for lib_dir in verify.BUNDLED_LIB_DIRS:
+    for path in (Path(version_dir) / lib_dir).glob("*.so*"):
+      if path.is_file() and not path.is_symlink() and (info := elf.read_elf(path)) and info["soname"]:
+        sonames.add(info["soname"])
+  return sorted(sonames)
+
+
+def extract(platform, version_dir, version=None):
+  """
+  Read the metadata of a staged runner, recorded with its layer in the build database and
+  published by fetch.py.
+
+  Args:
+    platform: Platform name, e.g., pcsx2
+    version_dir: Runner version directory
+    version: Version read beforehand, e.g., by wine_version, defaults to the AppStream one
+
+  Returns:
+    Dictionary with the keys version, machine, bits, interp, build_id and sonames, values
+    that could not be read are None
+  """
+  version_dir = Path(version_dir)
+  binary = version_dir / verify.PROBES[platform][0]
+  info = elf.read_elf(binary) or {}
+
+  return {
+    "version": version or appstream_version(version_dir),
+    "machine": info.get("machine"),
+    "bits": info.get("bits"),
+    "interp": info.get("interp"),
+    "build_id": info.get("build_id"),
+    "sonames": bundled_sonames(version_dir),
+  }
@@ -2,11 +2,31 @@
 
 SCRIPT_DIR="$(cd -- "$(dirname -- "${BASH_SOURCE[0]}")" && pwd)"
 
+# Launch profiling and seeding, see profile.sh
+source "$SCRIPT_DIR/profile.sh"
+
+_profile_start
+
 # Main directory
 export DIR_PCSX2="$SCRIPT_DIR"
 
 # Use included libs
 export LD_LIBRARY_PATH="$DIR_PCSX2/lib:$LD_LIBRARY_PATH"
 
+# Seed a new configuration with the one prewarmed at build time, see prewarm.py
+# Set GAMEIMAGE_PREWARM_SEED=0 to let PCSX2 create it instead
+if [[ "${GAMEIMAGE_PREWARM_SEED:-1}" = 1 ]]; then
+  _seed /home/pcsx2/.config "${XDG_CONFIG_HOME:-$HOME/.config}"
+  _seed /home/pcsx2/.cache "${XDG_CACHE_HOME:-$HOME/.cache}"
+fi
+
+# Launch report next to the pcsx2 logs
+PROFILE_DIR="${GAMEIMAGE_PROFILE_DIR:-${XDG_CONFIG_HOME:-$HOME/.config}/PCSX2/logs}"
+
 # Start pcsx2
-"$DIR_PCSX2"/bin/pcsx2-qt "$@"
+_profile_mark exec
+_profile_exec "$DIR_PCSX2"/bin/pcsx2-qt "$@"
+EXIT_CODE=$?
+_profile_mark exit
+_profile_report
+exit "$EXIT_CODE"
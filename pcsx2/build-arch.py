@@ -6,59 +6,118 @@
 # @description : Build pcsx2 distribution layers
 ######################################################################
 
+import argparse
+import contextlib
 import json
+import os
 import subprocess
 import sys
 import shutil
 import re
+import time
 from pathlib import Path
 
 SCRIPT_DIR = Path(__file__).parent
 
+# Build and dist directories, overridden by the workers of a job queue, see jobqueue.py
+BUILD_DIR = Path(os.environ.get("GAMEIMAGE_BUILD_DIR", SCRIPT_DIR / "build")).resolve()
+DIST_DIR = Path(os.environ.get("GAMEIMAGE_DIST_DIR", SCRIPT_DIR.parent / "dist")).resolve()
 
-def fetch_pcsx2_urls():
+# Shared modules live in the repository root
+sys.path.insert(0, str(SCRIPT_DIR.resolve().parent))
+import builddb  # noqa: E402
+import disk  # noqa: E402
+import journal  # noqa: E402
+import layer  # noqa: E402
+import metadata  # noqa: E402
+import prewarm  # noqa: E402
+import source  # noqa: E402
+
+
+def get_appimage_urls(releases):
   """
-  Fetch download URLs for PCSX2 AppImages from GitHub releases.
+  Collect the AppImage download URLs of GitHub releases.
+
+  Args:
+    releases: List of release dictionaries
 
   Returns:
     Tuple of (stable_urls, unstable_urls) where stable are from non-draft and non-prerelease
     and unstable are from prerelease releases
   """
-  result = subprocess.run(
-    ["gh", "api", "--paginate", "repos/PCSX2/pcsx2/releases"],
-    capture_output=True,
-    text=True
-  )
+  stable_urls = []
+  unstable_urls = []
+
+  for release in releases:
+    is_draft = release.get("draft", False)
+    is_prerelease = release.get("prerelease", False)
+
+    # Skip draft releases
+    if is_draft:
+      continue
+
+    for asset in release.get("assets", []):
+      url = asset.get("browser_download_url", "")
+      if url.endswith(".AppImage"):
+        if is_prerelease:
+          unstable_urls.append(url)
+        else:
+          stable_urls.append(url)
+
+  return stable_urls, unstable_urls
 
-  if result.returncode != 0:
-    print(f"Error fetching PCSX2 releases: {result.stderr}", file=sys.stderr)
-    return [], []
 
-  try:
-    releases = json.loads(result.stdout)
-    stable_urls = []
-    unstable_urls = []
+def fetch_pcsx2_urls(stable_count=None, unstable_count=None):
+  """
+  Fetch download URLs for PCSX2 AppImages from GitHub releases.
+
+  Releases are fetched page by page and fetching stops once both selections of
+  get_latest_per_minor_version are complete, all releases are fetched without counts.
+
+  Args:
+    stable_count: Number of stable minor versions to select
+    unstable_count: Number of unstable minor versions to select
+
+  Returns:
+    Tuple of (stable_urls, unstable_urls, sizes), see get_appimage_urls and
+    source.asset_sizes
+  """
+  def is_complete(repo, releases):
+    stable_urls, unstable_urls = get_appimage_urls(releases)
+    # Stable releases can be many pages of nightlies apart, a channel that is not requested
+    # is complete, otherwise paging goes on until the pages run out
+    stable_done = not stable_count or is_selection_complete(stable_urls, stable_count)
+    unstable_done = not unstable_count or is_selection_complete(unstable_urls, unstable_count)
+    return stable_done and unstable_done
+
+  until = is_complete if stable_count is not None and unstable_count is not None else None
+  releases = source.github_releases(["PCSX2/pcsx2"], until=until)["PCSX2/pcsx2"]
+  if releases is None:
+    return [], [], {}
 
-    for release in releases:
-      is_draft = release.get("draft", False)
-      is_prerelease = release.get("prerelease", False)
+  return (*get_appimage_urls(releases), source.asset_sizes(releases))
+
+
+def is_selection_complete(urls, count):
+  """
+  Check if older releases can no longer change the result of get_latest_per_minor_version.
 
-      # Skip draft releases
-      if is_draft:
-        continue
+  Releases are listed newest first, once more than count minor versions showed up the
+  remaining releases belong to older minor versions than the selected ones.
 
-      for asset in release.get("assets", []):
-        url = asset.get("browser_download_url", "")
-        if url.endswith(".AppImage"):
-          if is_prerelease:
-            unstable_urls.append(url)
-          else:
-            stable_urls.append(url)
+  Args:
+    urls: List of download URLs, newest first
+    count: Number of minor versions to keep
 
-    return stable_urls, unstable_urls
-  except json.JSONDecodeError as e:
-    print(f"Error parsing JSON: {e}", file=sys.stderr)
-    return [], []
+  Returns:
+    True if the selection is complete, False otherwise
+  """
+  minors = set()
+  for url in urls:
+    match = re.search(r'v?(\d+)\.(\d+)\.(\d+)', Path(url).name)
+    if match:
+      minors.add(match.group(1, 2))
+  return len(minors) > count
 
 
 def get_latest_per_minor_version(urls, count=10):
@@ -124,12 +183,9 @@ def download_appimage(url, dest_dir):
   print(f"Downloading: {url}")
   print(f"Destination: {filepath}")
 
-  if filepath.exists():
-    print(f"File already exists: {filepath}")
-    return filepath
-
+  # Continue the partial download of an interrupted build
   result = subprocess.run(
-    ["wget", "--progress=dot:mega", "-O", str(filepath), url],
+    ["wget", "--progress=dot:mega", "-c", "-O", str(filepath), url],
     capture_output=False
   )
 
@@ -149,7 +205,7 @@ def extract_appimage(appimage_path, build_dir):
 
   Args:
     appimage_path: Path to the AppImage
-    build_dir: Build directory
+    build_dir: Build or staging directory to extract in
 
   Returns:
     Path to extracted pcsx2 directory or None if failed
@@ -206,7 +262,7 @@ def get_version_from_appimage(appimage_name):
   return Path(appimage_name).stem
 
 
-def build_layer(image_path, pcsx2_dir, version, channel):
+def build_layer(image_path, pcsx2_dir, version, channel, stage_dir):
   """
   Build a PCSX2 layer.
 
@@ -215,9 +271,11 @@ def build_layer(image_path, pcsx2_dir, version, channel):
     pcsx2_dir: Path to the pcsx2 directory
     version: Version string
     channel: "stable" or "unstable"
+    stage_dir: Directory to assemble the layer tree in
 
   Returns:
-    Path to created layer file or None if failed
+    Tuple of (path to created layer file, runner metadata, see metadata.extract) or None if
+    failed
   """
   print(f"Building layer for version: {version} ({channel})")
 
@@ -225,10 +283,11 @@ def build_layer(image_path, pcsx2_dir, version, channel):
   boot_script = SCRIPT_DIR / "boot.sh"
   boot_dest = pcsx2_dir / "boot"
   shutil.copy(boot_script, boot_dest)
+  shutil.copy(SCRIPT_DIR.resolve().parent / "profile.sh", pcsx2_dir / "profile.sh")
 
   # Create layer directories
   # Structure: /opt/gameimage/runners/pcsx2/PCSX2/pcsx2/main/{channel}/{version}/
-  root_dir = Path("root")
+  root_dir = stage_dir / "root"
   layer_version_dir = root_dir / "opt" / "gameimage" / "runners" / "pcsx2" / "PCSX2" / "pcsx2" / "main" / channel / version
   config_dir = root_dir / "home" / "pcsx2" / ".config"
 
@@ -238,109 +297,215 @@ def build_layer(image_path, pcsx2_dir, version, channel):
   # Move pcsx2_dir (which contains boot) to version directory
   shutil.move(str(pcsx2_dir), str(layer_version_dir))
 
+  # Optionally ship the configuration and caches PCSX2 creates on first launch
+  if prewarm.PREWARM and not prewarm.prewarm(image_path, layer_version_dir / "boot", config_dir.parent):
+    print(f"Continuing without prewarmed caches for {version}", file=sys.stderr)
+
+  # Static metadata of the staged runner, published with the layer
+  runner = metadata.extract("pcsx2", layer_version_dir)
+
   # Create layer with distribution=main and channel
   layer_name = f"pcsx2--PCSX2--pcsx2--main--{channel}--{version}.layer"
   print(f"Creating layer: {layer_name}")
 
-  result = subprocess.run(
-    [str(image_path), "fim-layer", "create", str(root_dir), layer_name],
-    capture_output=True,
-    env={**subprocess.os.environ, "FIM_DEBUG": "1"}
-  )
+  # A partial layer of an interrupted build
+  disk.remove(layer_name)
 
-  if result.returncode != 0:
-    print(f"Error creating layer: {result.stderr.decode()}", file=sys.stderr)
+  # Identical metadata across builds, the layer is byte-identical for the same sources
+  layer.normalize(root_dir)
+  if not layer.create_layer(image_path, root_dir, layer_name):
+    disk.remove(layer_name)
     return None
 
   # Remove temporary directory
   shutil.rmtree(root_dir)
 
-  return Path(layer_name)
+  return Path(layer_name), runner
 
 
-def package_pcsx2(image_path, stable_count=5, unstable_count=5):
+def build_release(image_path, url, channel, size, budget, build_journal):
   """
-  Package PCSX2 distributions.
+  Download, extract and package a PCSX2 release, reusing the stages an interrupted build
+  completed.
 
   Args:
     image_path: Path to the flatimage
+    url: Download URL of the AppImage
+    channel: "stable" or "unstable"
+    size: Download size in bytes, None if unknown
+    budget: disk.Budget of the build directory
+    build_journal: journal.Journal of the build directory
+
+  Returns:
+    Tuple of (layer name, build database fields) or None if failed
+  """
+  if record := build_journal.reuse(url, "layer"):
+    return record["path"].name, record["fields"]
+
+  if not budget.admit(Path(url).name, size):
+    return None
+
+  build_dir = BUILD_DIR
+  start = time.monotonic()
+
+  # Intermediates of failed stages
+  cleanup = [build_dir / Path(url).name, build_dir / "squashfs-root", build_dir / "pcsx2", Path("root")]
+
+  # The prewarm runs inside the container, keep the tree where the container sees it
+  if prewarm.PREWARM:
+    stage = contextlib.nullcontext(build_dir)
+  else:
+    stage = budget.stage(Path(url).name, size)
+
+  with budget.track(Path(url).name, size, cleanup), stage as stage_dir:
+    if record := build_journal.reuse(url, "extract"):
+      pcsx2_dir = record["path"]
+    else:
+      # Download AppImage
+      appimage_path = build_dir / Path(url).name
+      if not build_journal.reuse(url, "download"):
+        appimage_path = download_appimage(url, build_dir)
+        if not appimage_path or not journal.check_size(appimage_path, size):
+          return None
+        build_journal.done(url, "download", appimage_path)
+
+      # Extract AppImage, over leftovers of an interrupted extraction
+      disk.remove(stage_dir / "squashfs-root", stage_dir / "pcsx2")
+      pcsx2_dir = extract_appimage(appimage_path, stage_dir)
+      if not pcsx2_dir:
+        return None
+      build_journal.done(url, "extract", pcsx2_dir)
+
+    # Get version from filename
+    version = get_version_from_appimage(Path(url).name)
+
+    # Build layer, over leftovers of an interrupted layer creation
+    disk.remove(stage_dir / "root")
+    result = build_layer(image_path, pcsx2_dir, version, channel, stage_dir)
+    if not result:
+      print(f"Failed to build layer for {url}", file=sys.stderr)
+      return None
+    layer_path, runner = result
+
+  fields = {
+    "source_url": url,
+    "build_seconds": time.monotonic() - start,
+    "compression": layer.PROFILE,
+    "meta": {"runner": runner},
+  }
+  build_journal.done(url, "layer", layer_path, fields=fields)
+
+  return layer_path.name, fields
+
+
+def select_versions(urls, versions):
+  """
+  Select the URLs of specific versions.
+
+  Args:
+    urls: List of download URLs
+    versions: List of version strings, see get_version_from_appimage
+
+  Returns:
+    List of URLs whose version is in versions
+  """
+  return [url for url in urls if get_version_from_appimage(Path(url).name) in versions]
+
+
+def select_jobs(build_journal, stable_count=5, unstable_count=5, versions=None):
+  """
+  Select the PCSX2 releases to build.
+
+  Args:
+    build_journal: journal.Journal of the build directory
     stable_count: Number of stable minor versions to build (default: 5)
     unstable_count: Number of unstable minor versions to build (default: 5)
+    versions: Build these versions of the channels with a non-zero count instead of the
+      latest of each minor version
+
+  Returns:
+    List of jobs, dictionaries with the keys url, channel and size, see build_release
   """
   print("\n=== Fetching PCSX2 releases ===")
 
-  # Fetch all URLs (separated by stability)
-  stable_urls, unstable_urls = fetch_pcsx2_urls()
+  # Fetch all URLs (separated by stability), specific versions can be in any release, a resumed
+  # build reuses the URLs of the interrupted one
+  if versions:
+    stable_urls, unstable_urls, sizes = build_journal.memo("fetch", [source.SOURCE, None, None], fetch_pcsx2_urls)
+  else:
+    stable_urls, unstable_urls, sizes = build_journal.memo(
+      "fetch", [source.SOURCE, stable_count, unstable_count], lambda: fetch_pcsx2_urls(stable_count, unstable_count)
+    )
 
   if not stable_urls and not unstable_urls:
     print("No URLs found for PCSX2, exiting...")
-    return
+    return []
 
-  build_dir = SCRIPT_DIR / "build"
+  jobs = []
+  for channel, urls, count in [("stable", stable_urls, stable_count), ("unstable", unstable_urls, unstable_count)]:
+    if not urls or not count:
+      continue
 
-  # Process stable releases
-  if stable_urls:
-    print(f"\n=== Processing STABLE releases ===")
-    selected_stable = get_latest_per_minor_version(stable_urls, count=stable_count)
-    print(f"Found {len(selected_stable)} stable versions to build")
+    if versions:
+      selected = select_versions(urls, versions)
+    else:
+      selected = get_latest_per_minor_version(urls, count=count)
+    print(f"Found {len(selected)} {channel} versions to build")
 
-    for url in selected_stable:
-      print(f"\n=== Processing {Path(url).name} (STABLE) ===")
+    jobs += [{"url": url, "channel": channel, "size": sizes.get(url)} for url in selected]
 
-      # Download AppImage
-      appimage_path = download_appimage(url, build_dir)
-      if not appimage_path:
-        continue
-
-      # Extract AppImage
-      pcsx2_dir = extract_appimage(appimage_path, build_dir)
-      if not pcsx2_dir:
-        continue
+  return jobs
 
-      # Get version from filename
-      version = get_version_from_appimage(appimage_path.name)
 
-      # Build layer
-      layer_path = build_layer(image_path, pcsx2_dir, version, "stable")
-      if not layer_path:
-        print(f"Failed to build layer for {url}", file=sys.stderr)
-        continue
-
-  # Process unstable releases
-  if unstable_urls:
-    print(f"\n=== Processing UNSTABLE releases ===")
-    selected_unstable = get_latest_per_minor_version(unstable_urls, count=unstable_count)
-    print(f"Found {len(selected_unstable)} unstable versions to build")
+def package_pcsx2(image_path, jobs, budget, build_journal):
+  """
+  Package PCSX2 distributions.
 
-    for url in selected_unstable:
-      print(f"\n=== Processing {Path(url).name} (UNSTABLE) ===")
+  Args:
+    image_path: Path to the flatimage
+    jobs: List of jobs, see select_jobs
+    budget: disk.Budget of the build directory
+    build_journal: journal.Journal of the build directory
 
-      # Download AppImage
-      appimage_path = download_appimage(url, build_dir)
-      if not appimage_path:
-        continue
+  Returns:
+    Dictionary of built layer names to their build database fields
+  """
+  builds = {}
 
-      # Extract AppImage
-      pcsx2_dir = extract_appimage(appimage_path, build_dir)
-      if not pcsx2_dir:
-        continue
+  for job in jobs:
+    print(f"\n=== Processing {Path(job['url']).name} ({job['channel'].upper()}) ===")
 
-      # Get version from filename
-      version = get_version_from_appimage(appimage_path.name)
+    # Already moved to dist/ by an interrupted build
+    if build_journal.reuse(job["url"], "dist"):
+      continue
 
-      # Build layer
-      layer_path = build_layer(image_path, pcsx2_dir, version, "unstable")
-      if not layer_path:
-        print(f"Failed to build layer for {url}", file=sys.stderr)
-        continue
+    result = build_release(image_path, **job, budget=budget, build_journal=build_journal)
+    if result:
+      layer_name, fields = result
+      builds[layer_name] = fields
 
+  return builds
 
 def main():
-  if len(sys.argv) != 2:
-    print("Usage: build-arch.py <image_path>")
-    sys.exit(1)
-
-  image_path = Path(sys.argv[1])
+  parser = argparse.ArgumentParser(description="Build pcsx2 distribution layers")
+  parser.add_argument("image", type=Path, help="Path to the flatimage")
+  parser.add_argument("--channels", nargs="+", choices=["stable", "unstable"], default=["stable", "unstable"],
+    help="Channels to build (default: all)")
+  parser.add_argument("--stable-count", type=int, default=5,
+    help="Stable minor versions to build (default: 5)")
+  parser.add_argument("--unstable-count", type=int, default=5,
+    help="Unstable minor versions to build (default: 5)")
+  parser.add_argument("--versions", nargs="+",
+    help="Build these versions instead of the latest of each minor version")
+  parser.add_argument("--resume", action="store_true", default=journal.RESUME,
+    help="Resume an interrupted build, reusing its completed stages")
+  parser.add_argument("--plan", type=Path,
+    help="Write the selected jobs to this JSON file instead of building them")
+  parser.add_argument("--job", type=json.loads,
+    help="Build a single job of a plan, given as JSON, instead of selecting releases")
+  args = parser.parse_args()
+
+  image_path = args.image
 
   if not image_path.is_file():
     print(f"Error: {image_path} is not a regular file")
@@ -350,22 +515,42 @@ def main():
   subprocess.os.chdir(SCRIPT_DIR)
 
   # Create dist directory
-  dist_dir = SCRIPT_DIR.parent / "dist"
-  dist_dir.mkdir(exist_ok=True)
+  dist_dir = DIST_DIR
+  dist_dir.mkdir(parents=True, exist_ok=True)
 
-  # Re-create build directory
-  build_dir = SCRIPT_DIR / "build"
-  if build_dir.exists():
+  # Re-create build directory, unless resuming an interrupted build
+  build_dir = BUILD_DIR
+  if build_dir.exists() and not args.resume:
     shutil.rmtree(build_dir)
-  build_dir.mkdir()
+  build_dir.mkdir(parents=True, exist_ok=True)
   subprocess.os.chdir(build_dir)
+  build_journal = journal.Journal(build_dir)
+
+  # Select the releases, a channel that is not selected builds no versions
+  if args.job:
+    jobs = [args.job]
+  else:
+    jobs = select_jobs(
+      build_journal,
+      stable_count=args.stable_count if "stable" in args.channels else 0,
+      unstable_count=args.unstable_count if "unstable" in args.channels else 0,
+      versions=args.versions,
+    )
 
-  # Build PCSX2 distributions (5 stable + 5 unstable)
-  package_pcsx2(image_path, stable_count=5, unstable_count=5)
+  if args.plan:
+    args.plan.write_text(json.dumps(jobs, indent=2))
+    print(f"Planned {len(jobs)} jobs in {args.plan}")
+    return
+
+  # Build PCSX2 distributions
+  budget = disk.Budget(BUILD_DIR)
+  builds = package_pcsx2(image_path, jobs, budget, build_journal)
 
   # Create SHA256 checksums and move to dist
   print("\n=== Creating SHA256 checksums ===")
-  for layer_file in Path.cwd().glob("*.layer"):
+  # Only the layers of this run, leftovers of other runs stay out of dist/
+  for layer_name, fields in builds.items():
+    layer_file = build_dir / layer_name
     # Create checksum
     checksum_file = dist_dir / f"{layer_file.name}.sha256sum"
     result = subprocess.run(
@@ -376,9 +561,20 @@ def main():
     if result.returncode == 0:
       checksum_file.write_text(result.stdout)
 
-    # Move layer to dist
-    shutil.copy(layer_file, dist_dir)
-    print(f"Copied {layer_file.name} to dist/")
+    # Move layer to dist, a rename on the same filesystem
+    shutil.move(layer_file, dist_dir / layer_file.name)
+    print(f"Moved {layer_file.name} to dist/")
+
+    # Record in the build database
+    builddb.record_layer(dist_dir / layer_file.name, **fields)
+
+    # Completed, a resumed build skips it
+    build_journal.done(fields["source_url"], "dist", dist_dir / layer_file.name)
+
+  # Releases skipped for lack of disk space are missing from dist/
+  if budget.skipped:
+    print(f"\nNot enough disk space for {len(budget.skipped)} releases: {', '.join(budget.skipped)}", file=sys.stderr)
+    sys.exit(1)
 
 
 if __name__ == "__main__":
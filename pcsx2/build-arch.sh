@@ -57,6 +57,7 @@ function compress_pcsx2()
   msg "${PCSX2_DIR:?PCSX2_DIR is undefined}"
   # Copy pcsx2 runner
   cp "$SCRIPT_DIR"/boot.sh "$PCSX2_DIR"/boot
+  cp "$SCRIPT_DIR"/../profile.sh "$PCSX2_DIR"/profile.sh
   # Create layer dirs
   mkdir -p ./root/opt
   mkdir -p ./root/home/pcsx2/.config
@@ -0,0 +1,99 @@
+######################################################################
+# @author      : Ruan E. Formigoni (ruanformigoni@gmail.com)
+# @file        : prewarm
+# @description : Run runners headless at build time to ship their first-run caches
+######################################################################
+
+import fnmatch
+import os
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+import headless
+
+# Prewarm the layers of the builders that support it, GAMEIMAGE_PREWARM=1
+PREWARM = os.environ.get("GAMEIMAGE_PREWARM", "0") == "1"
+
+# Seconds a runner gets to initialize, GUI runners keep running and are stopped afterwards
+TIMEOUT = int(os.environ.get("GAMEIMAGE_PREWARM_TIMEOUT", "30"))
+
+# Files that describe the prewarm run or the build host instead of the runner, e.g., logs
+# and the font cache of the host fonts
+VOLATILE_PATTERNS = [
+  "*.log",
+  "*.log.gz",
+  "*.lock",
+  "logs",
+  "fontconfig",
+  "qtshadercache*",
+]
+
+
+def prune(home_dir):
+  """
+  Remove the volatile files of a prewarmed home directory.
+
+  Args:
+    home_dir: Home directory the runner was prewarmed in
+
+  Returns:
+    List of the remaining file paths relative to home_dir
+  """
+  for parent, dirs, files in os.walk(home_dir):
+    for name in dirs + files:
+      if any(fnmatch.fnmatch(name, pattern) for pattern in VOLATILE_PATTERNS):
+        path = Path(parent) / name
+        if name in dirs:
+          dirs.remove(name)
+        if path.is_dir() and not path.is_symlink():
+          shutil.rmtree(path)
+        else:
+          path.unlink()
+
+  return sorted(str(p.relative_to(home_dir)) for p in Path(home_dir).rglob("*") if p.is_file())
+
+
+def prewarm(image_path, boot_path, home_dir, args=()):
+  """
+  Run a runner once in the container with home_dir as its home, so the configuration and
+  caches it creates on first launch are shipped with the layer, see the boot scripts.
+
+  Only what the runner generates for itself is kept, e.g., no firmware or game is provided.
+
+  Args:
+    image_path: Path to the flatimage
+    boot_path: Boot script of the runner
+    home_dir: Home directory in the layer tree, e.g., root/home/rpcs3
+    args: Arguments for the boot script
+
+  Returns:
+    True if the runner created files to ship, False otherwise
+  """
+  home_dir = Path(home_dir).resolve()
+  print(f"Prewarming {boot_path} for {TIMEOUT}s in {home_dir}")
+
+  result = subprocess.run(
+    [str(image_path), "fim-exec", "env", *headless.ENV,
+      f"HOME={home_dir}",
+      f"XDG_CONFIG_HOME={home_dir / '.config'}",
+      f"XDG_CACHE_HOME={home_dir / '.cache'}",
+      "GAMEIMAGE_PREWARM_SEED=0",
+      "timeout", "-k", "5", str(TIMEOUT), str(boot_path.resolve()), *args],
+    capture_output=True,
+    env=headless.container_env(image_path),
+  )
+
+  # timeout exits with 124 when it stopped the runner
+  if result.returncode not in (0, 124):
+    print(f"Error prewarming: exit code {result.returncode}: {result.stderr.decode(errors='replace')[-500:]}",
+      file=sys.stderr)
+    shutil.rmtree(home_dir, ignore_errors=True)
+    (home_dir / ".config").mkdir(parents=True)
+    return False
+
+  files = prune(home_dir)
+  size = sum((home_dir / f).stat().st_size for f in files)
+  print(f"Prewarmed {len(files)} files, {size / 2**20:.1f} MiB")
+  return bool(files)
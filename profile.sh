@@ -0,0 +1,113 @@
+#!/usr/bin/env bash
+
+######################################################################
+# @author      : Ruan E. Formigoni (ruanformigoni@gmail.com)
+# @file        : profile
+# @description : Launch profiling and seeding of the boot scripts, sourced next to boot
+######################################################################
+
+# Launch profiling, enabled with GAMEIMAGE_PROFILE=1
+# GAMEIMAGE_PROFILE_T0       : launcher timestamp in microseconds, e.g., $(date +%s%6N)
+# GAMEIMAGE_PROFILE_LD=1     : capture LD_DEBUG=statistics of the runner
+# GAMEIMAGE_PROFILE_STRACE=1 : count file open calls of the runner with strace
+# GAMEIMAGE_ACCESS_LOG=file  : record the files opened by the runner with strace, independent
+#                              of GAMEIMAGE_PROFILE
+declare -a PROFILE_PHASES=()
+
+# $1 phase name
+# $2 timestamp in microseconds, defaults to now
+function _profile_mark()
+{
+  [[ "$GAMEIMAGE_PROFILE" = 1 ]] || return 0
+  PROFILE_PHASES+=("$1" "${2:-${EPOCHREALTIME/[.,]/}}")
+}
+
+# Marks the launcher and the sandbox start, the gap up to the boot script
+# covers container mount and layer overlay setup
+function _profile_start()
+{
+  [[ "$GAMEIMAGE_PROFILE" = 1 ]] || return 0
+  local btime ticks start
+  # The sandbox start is only told apart from the host init with a launcher timestamp
+  if [[ -n "$GAMEIMAGE_PROFILE_T0" ]]; then
+    _profile_mark launcher "$GAMEIMAGE_PROFILE_T0"
+    btime="$(awk '/^btime/ { print $2 }' /proc/stat 2>/dev/null)"
+    ticks="$(getconf CLK_TCK 2>/dev/null)"
+    start="$(awk '{ print $22 }' /proc/1/stat 2>/dev/null)"
+    if [[ -n "$btime" ]] && [[ -n "$ticks" ]] && [[ -n "$start" ]]; then
+      start="$(( btime * 1000000 + start * 1000000 / ticks ))"
+      # Outside of a sandbox pid 1 is the host init, which predates the launcher
+      (( start >= GAMEIMAGE_PROFILE_T0 )) && _profile_mark sandbox "$start"
+    fi
+  fi
+  _profile_mark boot
+}
+
+# $@ command to profile
+function _profile_exec()
+{
+  local -a prefix=()
+  if [[ "$GAMEIMAGE_PROFILE" = 1 ]]; then
+    mkdir -p "$PROFILE_DIR"
+    if [[ "$GAMEIMAGE_PROFILE_STRACE" = 1 ]] && [[ -z "$GAMEIMAGE_ACCESS_LOG" ]] \
+      && command -v strace &>/dev/null; then
+      prefix+=(strace -f -c -e trace=open,openat,openat2 -o "$PROFILE_DIR/strace.log")
+    fi
+    if [[ "$GAMEIMAGE_PROFILE_LD" = 1 ]]; then
+      prefix+=(env LD_DEBUG=statistics LD_DEBUG_OUTPUT="$PROFILE_DIR/ld-debug")
+    fi
+  fi
+  # Files opened at launch in order, see access.py
+  if [[ -n "$GAMEIMAGE_ACCESS_LOG" ]] && command -v strace &>/dev/null; then
+    prefix=(strace -f -qq -e trace=execve,open,openat,openat2 -e status=successful \
+      -o "$GAMEIMAGE_ACCESS_LOG" "${prefix[@]}")
+  fi
+  "${prefix[@]}" "$@"
+}
+
+# Writes the JSON launch report to $PROFILE_DIR/launch.json
+function _profile_report()
+{
+  [[ "$GAMEIMAGE_PROFILE" = 1 ]] || return 0
+  local file="$PROFILE_DIR/launch.json" sep="" prev="" i calls errors
+  mkdir -p "$PROFILE_DIR"
+  read -r calls errors < <(awk '$NF ~ /^open/ { c += $4; if (NF == 6) e += $5 }
+    END { print c + 0, e + 0 }' "$PROFILE_DIR/strace.log" 2>/dev/null)
+  {
+    echo "{"
+    echo "  \"runner\": \"$SCRIPT_DIR\","
+    echo "  \"phases\": ["
+    for (( i = 0; i < ${#PROFILE_PHASES[@]}; i += 2 )); do
+      printf '%s    {"name": "%s", "time_us": %s, "delta_ms": %s}' "$sep" \
+        "${PROFILE_PHASES[i]}" "${PROFILE_PHASES[i+1]}" \
+        "$(( prev ? (PROFILE_PHASES[i+1] - prev) / 1000 : 0 ))"
+      prev="${PROFILE_PHASES[i+1]}"
+      sep=$',\n'
+    done
+    echo
+    echo "  ],"
+    echo "  \"open_calls\": ${calls:-null},"
+    echo "  \"open_errors\": ${errors:-null},"
+    echo "  \"ld_debug\": $([[ "$GAMEIMAGE_PROFILE_LD" = 1 ]] && echo "\"$PROFILE_DIR/ld-debug\"" || echo null)"
+    echo "}"
+  } > "$file"
+  echo "Launch report: $file"
+}
+
+# Copies the entries of a shipped directory that are missing in a directory of the user
+# $1 shipped directory
+# $2 user directory
+function _seed()
+{
+  local entry
+  [[ -d "$1" ]] && [[ ! "$1" -ef "$2" ]] || return 0
+  for entry in "$1"/*; do
+    [[ -e "$entry" ]] && [[ ! -e "$2/${entry##*/}" ]] || continue
+    mkdir -p "$2"
+    echo "Seeding     : $2/${entry##*/}"
+    # Uses copy-on-write clones when the filesystem supports it
+    cp -a --reflink=auto "$entry" "$2/" || echo "Failed to seed $2/${entry##*/}"
+  done
+}
+
+#  vim: set expandtab fdm=marker ts=2 sw=2 tw=100 et :
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+
+######################################################################
+# @author      : Ruan E. Formigoni (ruanformigoni@gmail.com)
+# @file        : reproduce
+# @description : Rebuild layers from their recorded sources and compare checksums
+######################################################################
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+import builddb
+
+SCRIPT_DIR = Path(__file__).parent
+
+
+def job_from_record(record):
+  """
+  Builder job that rebuilds a recorded layer, see <platform>/build-arch.py --job.
+
+  Args:
+    record: Layer record of the build database
+
+  Returns:
+    Job dictionary or None if the platform has no builder
+  """
+  url = record["source_url"]
+  if record["platform"] in ["pcsx2", "rpcs3"]:
+    return {"url": url, "channel": record["channel"], "size": None}
+  if record["platform"] == "wine":
+    return {"url": url, "dist_name": record["distribution"], "owner": record["owner"], "repo": record["repo"],
+      "size": None}
+  if record["platform"] == "retroarch":
+    return {"version": record["version"], "url": url, "size": None}
+  return None
+
+
+def reproduce(image_path, record, work_dir):
+  """
+  Rebuild a layer in a scratch directory.
+
+  Args:
+    image_path: Path to the flatimage
+    record: Layer record of the build database
+    work_dir: Scratch directory, holds the build and dist directories of the rebuild
+
+  Returns:
+    Checksum of the rebuilt layer or None if it failed
+  """
+  result_dir = work_dir / "dist"
+  result = subprocess.run(
+    [str(SCRIPT_DIR / record["platform"] / "build-arch.py"), str(image_path.resolve()),
+      "--job", json.dumps(job_from_record(record))],
+    capture_output=True,
+    env={
+      **os.environ,
+      "GAMEIMAGE_BUILD_DIR": str((work_dir / "build").resolve()),
+      "GAMEIMAGE_DIST_DIR": str(result_dir.resolve()),
+    },
+  )
+
+  layer_path = result_dir / record["name"]
+  if result.returncode != 0 or not layer_path.exists():
+    print(f"Error rebuilding {record['name']}: {result.stderr.decode(errors='replace')}", file=sys.stderr)
+    return None
+
+  return builddb.sha256(layer_path)
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Rebuild layers from their recorded sources and compare checksums")
+  parser.add_argument("image", type=Path, help="Path to the flatimage the layers were built with")
+  parser.add_argument("layers", nargs="*", help="Layer names (default: all runner layers in dist/)")
+  parser.add_argument("--dist", type=Path, default=SCRIPT_DIR / "dist", help="Dist directory")
+  args = parser.parse_args()
+
+  if not args.image.is_file():
+    print(f"Error: {args.image} is not a regular file")
+    sys.exit(1)
+
+  records = [r for r in builddb.layers(args.dist) if r["source_url"] and job_from_record(r)]
+  if args.layers:
+    records = [r for r in records if r["name"] in args.layers]
+    for name in sorted(set(args.layers) - {r["name"] for r in records}):
+      print(f"No recorded source for {name}, skipping", file=sys.stderr)
+
+  # Rebuilds need the space of a regular build, not of /tmp
+  (SCRIPT_DIR / "build").mkdir(exist_ok=True)
+
+  differ = []
+  for record in records:
+    print(f"Rebuilding: {record['name']}")
+    with tempfile.TemporaryDirectory(prefix="reproduce-", dir=SCRIPT_DIR / "build") as work_dir:
+      checksum = reproduce(args.image, record, Path(work_dir))
+
+    if checksum == record["sha256"]:
+      print(f"  Identical: {checksum}")
+    else:
+      print(f"  Differs: {checksum or 'rebuild failed'}, recorded {record['sha256']}")
+      # Not verified with a real flatimage, see layer.PROFILES
+      if checksum and record.get("compression") == "default":
+        print("  Layers of the default profile are created by fim-layer create, try GAMEIMAGE_LAYER_PROFILE=fast-mount")
+      differ.append(record["name"])
+
+  print(f"\n{len(records) - len(differ)} of {len(records)} layers reproduced")
+  if differ:
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+  main()
@@ -2,8 +2,22 @@
 
 SCRIPT_DIR="$(cd -- "$(dirname -- "${BASH_SOURCE[0]}")" && pwd)"
 
+# Launch profiling, see profile.sh
+source "$SCRIPT_DIR/profile.sh"
+
+_profile_start
+
 # Libraries
 export DIR_RETROARCH="$SCRIPT_DIR/data"
 export LD_LIBRARY_PATH="$DIR_RETROARCH/lib:$LD_LIBRARY_PATH"
 
-"$DIR_RETROARCH"/bin/retroarch "$@"
+# Launch report next to the retroarch logs
+PROFILE_DIR="${GAMEIMAGE_PROFILE_DIR:-${XDG_CONFIG_HOME:-$HOME/.config}/retroarch/logs}"
+
+# Start retroarch
+_profile_mark exec
+_profile_exec "$DIR_RETROARCH"/bin/retroarch "$@"
+EXIT_CODE=$?
+_profile_mark exit
+_profile_report
+exit "$EXIT_CODE"
@@ -6,15 +6,33 @@
 # @description : Build retroarch distribution layers
 ######################################################################
 
+import argparse
+import json
+import os
 import subprocess
 import sys
 import shutil
 import re
+import time
 from pathlib import Path
 from collections import defaultdict
 
 SCRIPT_DIR = Path(__file__).parent
 
+# Build and dist directories, overridden by the workers of a job queue, see jobqueue.py
+BUILD_DIR = Path(os.environ.get("GAMEIMAGE_BUILD_DIR", SCRIPT_DIR / "build")).resolve()
+DIST_DIR = Path(os.environ.get("GAMEIMAGE_DIST_DIR", SCRIPT_DIR.parent / "dist")).resolve()
+
+# Shared modules live in the repository root
+sys.path.insert(0, str(SCRIPT_DIR.resolve().parent))
+import builddb  # noqa: E402
+import buildbot  # noqa: E402
+import disk  # noqa: E402
+import journal  # noqa: E402
+import layer  # noqa: E402
+import metadata  # noqa: E402
+import source  # noqa: E402
+
 
 def fetch_retroarch_versions():
   """
@@ -25,20 +43,13 @@ def fetch_retroarch_versions():
   """
   print("Fetching RetroArch stable versions...")
 
-  # Fetch and parse versions using grep
-  result = subprocess.run(
-    "wget -qO - https://buildbot.libretro.com/stable/ | grep -Eio '[0-9]+\\.[0-9]+\\.[0-9]+' | sort -u",
-    shell=True,
-    capture_output=True,
-    text=True
-  )
-
-  if result.returncode != 0:
+  entries = buildbot.index(f"{source.BUILDBOT_URL}/stable/")
+  if entries is None:
     print(f"Error fetching RetroArch versions", file=sys.stderr)
     return []
 
-  # Split output into version list
-  versions = [v.strip() for v in result.stdout.strip().split('\n') if v.strip()]
+  # Version directories only, other entries of the listing are ignored
+  versions = sorted(e["name"] for e in entries if e["is_dir"] and re.fullmatch(r'[0-9]+\.[0-9]+\.[0-9]+', e["name"]))
 
   return versions
 
@@ -84,31 +95,28 @@ def get_latest_per_minor_version(versions, count=10):
   return result
 
 
-def download_and_extract_retroarch(version, build_dir):
+def download_retroarch(version, url, build_dir):
   """
-  Download and extract a specific RetroArch version.
+  Download a specific RetroArch version.
 
   Args:
     version: Version string (e.g., "1.19.1")
-    build_dir: Build directory
+    url: Download URL of the archive
+    build_dir: Build directory to download in
 
   Returns:
-    Path to extracted retroarch directory or None if failed
+    Path to the downloaded archive or None if failed
   """
-  print(f"\n=== Processing RetroArch {version} ===")
-
-  url_retroarch = f"https://buildbot.libretro.com/stable/{version}/linux/x86_64/RetroArch.7z"
-
   # Create version-specific directory
   version_dir = build_dir / f"retroarch-{version}"
   version_dir.mkdir(exist_ok=True)
 
   archive_path = version_dir / "RetroArch.7z"
 
-  # Download
-  print(f"Downloading: {url_retroarch}")
+  # Download, continuing the partial download of an interrupted build
+  print(f"Downloading: {url}")
   result = subprocess.run(
-    ["wget", "--progress=dot:mega", "-O", str(archive_path), url_retroarch],
+    ["wget", "--progress=dot:mega", "-c", "-O", str(archive_path), url],
     capture_output=False
   )
 
@@ -116,10 +124,29 @@ def download_and_extract_retroarch(version, build_dir):
     print(f"Error downloading RetroArch {version}", file=sys.stderr)
     return None
 
+  return archive_path
+
+
+def extract_retroarch(archive_path, version, build_dir):
+  """
+  Extract a downloaded RetroArch version, the archive is removed afterwards.
+
+  Args:
+    archive_path: Path to the downloaded archive
+    version: Version string (e.g., "1.19.1")
+    build_dir: Build or staging directory to extract in
+
+  Returns:
+    Path to extracted retroarch directory or None if failed
+  """
+  # Create version-specific directory
+  version_dir = build_dir / f"retroarch-{version}"
+  version_dir.mkdir(exist_ok=True)
+
   # Extract 7z
   print(f"Extracting RetroArch.7z...")
   result = subprocess.run(
-    ["7z", "x", str(archive_path)],
+    ["7z", "x", str(archive_path.resolve())],
     cwd=version_dir,
     capture_output=True
   )
@@ -191,7 +218,7 @@ def download_and_extract_retroarch(version, build_dir):
   return retroarch_dir
 
 
-def build_layer(image_path, retroarch_dir, version):
+def build_layer(image_path, retroarch_dir, version, stage_dir):
   """
   Build a RetroArch layer.
 
@@ -199,9 +226,11 @@ def build_layer(image_path, retroarch_dir, version):
     image_path: Path to the flatimage
     retroarch_dir: Path to the retroarch directory
     version: Version string
+    stage_dir: Directory to assemble the layer tree in
 
   Returns:
-    Path to created layer file or None if failed
+    Tuple of (path to created layer file, runner metadata, see metadata.extract) or None if
+    failed
   """
   print(f"Building layer for version: {version}")
 
@@ -209,10 +238,11 @@ def build_layer(image_path, retroarch_dir, version):
   boot_script = SCRIPT_DIR / "boot.sh"
   boot_dest = retroarch_dir / "boot"
   shutil.copy(boot_script, boot_dest)
+  shutil.copy(SCRIPT_DIR.resolve().parent / "profile.sh", retroarch_dir / "profile.sh")
 
   # Create layer directories
   # Structure: /opt/gameimage/runners/retroarch/libretro/stable/main/stable/{version}/
-  root_dir = Path("root")
+  root_dir = stage_dir / "root"
   layer_version_dir = root_dir / "opt" / "gameimage" / "runners" / "retroarch" / "libretro" / "stable" / "main" / "stable" / version
   home_dir = root_dir / "home" / "gameimage"
 
@@ -229,69 +259,175 @@ def build_layer(image_path, retroarch_dir, version):
   # Move retroarch_dir (which contains boot) to version directory
   shutil.move(str(retroarch_dir), str(layer_version_dir))
 
+  # Static metadata of the staged runner, published with the layer
+  runner = metadata.extract("retroarch", layer_version_dir)
+
   # Create layer with distribution=main and channel=stable
   layer_name = f"retroarch--libretro--stable--main--stable--{version}.layer"
   print(f"Creating layer: {layer_name}")
 
-  result = subprocess.run(
-    [str(image_path), "fim-layer", "create", str(root_dir), layer_name],
-    capture_output=True,
-    env={**subprocess.os.environ, "FIM_DEBUG": "1"}
-  )
+  # A partial layer of an interrupted build
+  disk.remove(layer_name)
 
-  if result.returncode != 0:
-    print(f"Error creating layer: {result.stderr.decode()}", file=sys.stderr)
+  # Identical metadata across builds, the layer is byte-identical for the same sources
+  layer.normalize(root_dir)
+  if not layer.create_layer(image_path, root_dir, layer_name):
+    disk.remove(layer_name)
     return None
 
   # Remove temporary directory
   shutil.rmtree(root_dir)
 
-  return Path(layer_name)
+  return Path(layer_name), runner
 
 
-def package_retroarch(image_path, count=10):
+def build_release(image_path, version, url, size, budget, build_journal):
   """
-  Package RetroArch distributions.
+  Download, extract and package a RetroArch release, reusing the stages an interrupted build
+  completed.
 
   Args:
     image_path: Path to the flatimage
+    version: Version string
+    url: Download URL of the archive
+    size: Download size in bytes, None if unknown
+    budget: disk.Budget of the build directory
+    build_journal: journal.Journal of the build directory
+
+  Returns:
+    Tuple of (layer name, build database fields) or None if failed
+  """
+  if record := build_journal.reuse(url, "layer"):
+    return record["path"].name, record["fields"]
+
+  if not budget.admit(f"RetroArch {version}", size):
+    return None
+
+  build_dir = BUILD_DIR
+  start = time.monotonic()
+
+  # The version directory holds the intermediates of all stages
+  cleanup = [build_dir / f"retroarch-{version}", Path("root")]
+  with budget.track(f"RetroArch {version}", size, cleanup), budget.stage(f"RetroArch {version}", size) as stage_dir:
+    if record := build_journal.reuse(url, "extract"):
+      retroarch_dir = record["path"]
+    else:
+      print(f"\n=== Processing RetroArch {version} ===")
+
+      # Download to the build directory, never to RAM
+      archive_path = build_dir / f"retroarch-{version}" / "RetroArch.7z"
+      if not build_journal.reuse(url, "download"):
+        archive_path = download_retroarch(version, url, build_dir)
+        if not archive_path or not journal.check_size(archive_path, size):
+          return None
+        build_journal.done(url, "download", archive_path)
+
+      # Extract, over leftovers of an interrupted extraction, the download is kept
+      version_dir = stage_dir / f"retroarch-{version}"
+      if version_dir.is_dir():
+        disk.remove(*[p for p in version_dir.iterdir() if p != archive_path])
+      retroarch_dir = extract_retroarch(archive_path, version, stage_dir)
+      if not retroarch_dir:
+        return None
+      build_journal.done(url, "extract", retroarch_dir)
+
+    # Build layer, over leftovers of an interrupted layer creation
+    disk.remove(stage_dir / "root")
+    result = build_layer(image_path, retroarch_dir, version, stage_dir)
+    if not result:
+      print(f"Failed to build layer for {version}", file=sys.stderr)
+      return None
+    layer_path, runner = result
+
+  fields = {
+    "source_url": url,
+    "build_seconds": time.monotonic() - start,
+    "compression": layer.PROFILE,
+    "meta": {"runner": runner},
+  }
+  build_journal.done(url, "layer", layer_path, fields=fields)
+
+  return layer_path.name, fields
+
+
+def select_jobs(build_journal, count=10, versions=None):
+  """
+  Select the RetroArch releases to build.
+
+  Args:
+    build_journal: journal.Journal of the build directory
     count: Number of minor versions to build (default: 10)
+    versions: Build these versions instead of the latest of each minor version
+
+  Returns:
+    List of jobs, dictionaries with the keys version, url and size, see build_release
   """
   print("\n=== Fetching RetroArch versions ===")
 
-  # Fetch all available versions
-  all_versions = fetch_retroarch_versions()
+  # Fetch all available versions, a resumed build reuses the versions of the interrupted one
+  all_versions = build_journal.memo("fetch", [source.SOURCE], fetch_retroarch_versions)
   if not all_versions:
     print("No versions found for RetroArch, exiting...")
-    return
+    return []
 
-  # Get latest from each minor version (1.19.max, 1.18.max, 1.17.max, etc.)
-  selected_versions = get_latest_per_minor_version(all_versions, count=count)
+  if versions:
+    for version in sorted(set(versions) - set(all_versions)):
+      print(f"Version not found for RetroArch: {version}", file=sys.stderr)
+    selected_versions = [v for v in all_versions if v in versions]
+  else:
+    # Get latest from each minor version (1.19.max, 1.18.max, 1.17.max, etc.)
+    selected_versions = get_latest_per_minor_version(all_versions, count=count)
   print(f"Found {len(selected_versions)} versions to build")
   print(f"Selected versions: {', '.join(selected_versions)}")
 
-  build_dir = SCRIPT_DIR / "build"
+  urls = {version: f"{source.BUILDBOT_URL}/stable/{version}/linux/x86_64/RetroArch.7z" for version in selected_versions}
+  sizes = source.sizes(list(urls.values()))
 
-  # Process each version
-  for version in selected_versions:
-    # Download and extract
-    retroarch_dir = download_and_extract_retroarch(version, build_dir)
-    if not retroarch_dir:
-      continue
+  return [{"version": version, "url": url, "size": sizes[url]} for version, url in urls.items()]
 
-    # Build layer
-    layer_path = build_layer(image_path, retroarch_dir, version)
-    if not layer_path:
-      print(f"Failed to build layer for {version}", file=sys.stderr)
+
+def package_retroarch(image_path, jobs, budget, build_journal):
+  """
+  Package RetroArch distributions.
+
+  Args:
+    image_path: Path to the flatimage
+    jobs: List of jobs, see select_jobs
+    budget: disk.Budget of the build directory
+    build_journal: journal.Journal of the build directory
+
+  Returns:
+    Dictionary of built layer names to their build database fields
+  """
+  builds = {}
+
+  for job in jobs:
+    # Already moved to dist/ by an interrupted build
+    if build_journal.reuse(job["url"], "dist"):
       continue
 
+    result = build_release(image_path, **job, budget=budget, build_journal=build_journal)
+    if result:
+      layer_name, fields = result
+      builds[layer_name] = fields
 
-def main():
-  if len(sys.argv) != 2:
-    print("Usage: build-arch.py <image_path>")
-    sys.exit(1)
+  return builds
 
-  image_path = Path(sys.argv[1])
+def main():
+  parser = argparse.ArgumentParser(description="Build retroarch distribution layers")
+  parser.add_argument("image", type=Path, help="Path to the flatimage")
+  parser.add_argument("--count", type=int, default=10, help="Minor versions to build (default: 10)")
+  parser.add_argument("--versions", nargs="+",
+    help="Build these versions instead of the latest of each minor version")
+  parser.add_argument("--resume", action="store_true", default=journal.RESUME,
+    help="Resume an interrupted build, reusing its completed stages")
+  parser.add_argument("--plan", type=Path,
+    help="Write the selected jobs to this JSON file instead of building them")
+  parser.add_argument("--job", type=json.loads,
+    help="Build a single job of a plan, given as JSON, instead of selecting releases")
+  args = parser.parse_args()
+
+  image_path = args.image
 
   if not image_path.is_file():
     print(f"Error: {image_path} is not a regular file")
@@ -301,22 +437,37 @@ def main():
   subprocess.os.chdir(SCRIPT_DIR)
 
   # Create dist directory
-  dist_dir = SCRIPT_DIR.parent / "dist"
-  dist_dir.mkdir(exist_ok=True)
+  dist_dir = DIST_DIR
+  dist_dir.mkdir(parents=True, exist_ok=True)
 
-  # Re-create build directory
-  build_dir = SCRIPT_DIR / "build"
-  if build_dir.exists():
+  # Re-create build directory, unless resuming an interrupted build
+  build_dir = BUILD_DIR
+  if build_dir.exists() and not args.resume:
     shutil.rmtree(build_dir)
-  build_dir.mkdir()
+  build_dir.mkdir(parents=True, exist_ok=True)
   subprocess.os.chdir(build_dir)
+  build_journal = journal.Journal(build_dir)
+
+  # Select the releases
+  if args.job:
+    jobs = [args.job]
+  else:
+    jobs = select_jobs(build_journal, count=args.count, versions=args.versions)
+
+  if args.plan:
+    args.plan.write_text(json.dumps(jobs, indent=2))
+    print(f"Planned {len(jobs)} jobs in {args.plan}")
+    return
 
   # Build RetroArch distributions
-  package_retroarch(image_path, count=10)
+  budget = disk.Budget(BUILD_DIR)
+  builds = package_retroarch(image_path, jobs, budget, build_journal)
 
   # Create SHA256 checksums and move to dist
   print("\n=== Creating SHA256 checksums ===")
-  for layer_file in Path.cwd().glob("**/*.layer"):
+  # Only the layers of this run, leftovers of other runs stay out of dist/
+  for layer_name, fields in builds.items():
+    layer_file = build_dir / layer_name
     # Create checksum
     checksum_file = dist_dir / f"{layer_file.name}.sha256sum"
     result = subprocess.run(
@@ -327,9 +478,20 @@ def main():
     if result.returncode == 0:
       checksum_file.write_text(result.stdout)
 
-    # Move layer to dist
-    shutil.copy(layer_file, dist_dir)
-    print(f"Copied {layer_file.name} to dist/")
+    # Move layer to dist, a rename on the same filesystem
+    shutil.move(layer_file, dist_dir / layer_file.name)
+    print(f"Moved {layer_file.name} to dist/")
+
+    # Record in the build database
+    builddb.record_layer(dist_dir / layer_file.name, **fields)
+
+    # Completed, a resumed build skips it
+    build_journal.done(fields["source_url"], "dist", dist_dir / layer_file.name)
+
+  # Releases skipped for lack of disk space are missing from dist/
+  if budget.skipped:
+    print(f"\nNot enough disk space for {len(budget.skipped)} releases: {', '.join(budget.skipped)}", file=sys.stderr)
+    sys.exit(1)
 
 
 if __name__ == "__main__":
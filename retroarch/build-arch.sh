@@ -70,6 +70,7 @@ function compress_retroarch()
 
   # Include startup hook
   cp "$SCRIPT_DIR/boot.sh" "$RETROARCH_DIR"/boot
+  cp "$SCRIPT_DIR/../profile.sh" "$RETROARCH_DIR"/profile.sh
   # Create layer dir
   mkdir -p ./root/opt
   # Move retroarch assets to gameimage home
@@ -2,11 +2,31 @@
 
 SCRIPT_DIR="$(cd -- "$(dirname -- "${BASH_SOURCE[0]}")" && pwd)"
 
+# Launch profiling and seeding, see profile.sh
+source "$SCRIPT_DIR/profile.sh"
+
+_profile_start
+
 # Main directory
 export DIR_RPCS3="$SCRIPT_DIR"
 
 # Use included libs
 export LD_LIBRARY_PATH="$DIR_RPCS3/lib:$LD_LIBRARY_PATH"
 
+# Seed a new configuration with the one prewarmed at build time, see prewarm.py
+# Set GAMEIMAGE_PREWARM_SEED=0 to let RPCS3 create it instead
+if [[ "${GAMEIMAGE_PREWARM_SEED:-1}" = 1 ]]; then
+  _seed /home/rpcs3/.config "${XDG_CONFIG_HOME:-$HOME/.config}"
+  _seed /home/rpcs3/.cache "${XDG_CACHE_HOME:-$HOME/.cache}"
+fi
+
+# Launch report next to the rpcs3 logs
+PROFILE_DIR="${GAMEIMAGE_PROFILE_DIR:-${XDG_CACHE_HOME:-$HOME/.cache}/rpcs3}"
+
 # Start
-"$DIR_RPCS3"/bin/rpcs3 "$@"
+_profile_mark exec
+_profile_exec "$DIR_RPCS3"/bin/rpcs3 "$@"
+EXIT_CODE=$?
+_profile_mark exit
+_profile_report
+exit "$EXIT_CODE"
@@ -55,6 +55,7 @@ function compress_rpcs3()
   msg "${RPCS3_DIR:?RPCS3_DIR is undefined}"
   # Copy rpcs3 runner
   cp "$SCRIPT_DIR"/boot.sh "$RPCS3_DIR"/boot
+  cp "$SCRIPT_DIR"/../profile.sh "$RPCS3_DIR"/profile.sh
   # Create layer dirs
   mkdir -p ./root/opt
   mkdir -p ./root/home/rpcs3/.config
@@ -0,0 +1,235 @@
+######################################################################
+# @author      : Ruan E. Formigoni (ruanformigoni@gmail.com)
+# @file        : source
+# @description : Remote sources of the builders (GitHub and buildbot)
+######################################################################
+
+import asyncio
+import json
+import os
+import re
+import sys
+
+import httpclient
+
+# Source backend
+# "github": query api.github.com and buildbot.libretro.com
+# URL (e.g., http://127.0.0.1:8000): query a fixture server, see fixtures/server.py
+SOURCE = os.environ.get("GAMEIMAGE_SOURCE", "github")
+
+if SOURCE == "github":
+  GITHUB_API_URL = "https://api.github.com"
+  BUILDBOT_URL = "https://buildbot.libretro.com"
+else:
+  GITHUB_API_URL = f"{SOURCE.rstrip('/')}/api"
+  BUILDBOT_URL = f"{SOURCE.rstrip('/')}/buildbot"
+
+# Maximum number of requests in flight and timeout per request in seconds
+CONCURRENCY = int(os.environ.get("GAMEIMAGE_HTTP_CONCURRENCY", "8"))
+TIMEOUT = int(os.environ.get("GAMEIMAGE_HTTP_TIMEOUT", "60"))
+
+# Releases per page, the maximum allowed by GitHub
+PER_PAGE = 100
+
+
+def _github_headers():
+  headers = {"Accept": "application/vnd.github+json", "X-GitHub-Api-Version": "2022-11-28"}
+  if token := os.environ.get("GH_TOKEN") or os.environ.get("GITHUB_TOKEN"):
+    headers["Authorization"] = f"Bearer {token}"
+  return headers
+
+
+def _client():
+  return httpclient.Client(concurrency=CONCURRENCY, timeout=TIMEOUT)
+
+
+async def _get_json(client, url, headers):
+  response = await client.get(url, headers)
+  if response.status != 200:
+    raise httpclient.HTTPError(f"HTTP {response.status}: {url}: {response.text()[:200]}")
+  return response
+
+
+def _slim_release(release):
+  """
+  Keep the fields of a release the builders use, the API reports many more.
+  """
+  return {
+    "tag_name": release.get("tag_name"),
+    "draft": release.get("draft", False),
+    "prerelease": release.get("prerelease", False),
+    "assets": [
+      {k: asset.get(k) for k in ["name", "browser_download_url", "size"]}
+      for asset in release.get("assets", [])
+    ],
+  }
+
+
+def asset_sizes(releases):
+  """
+  Sizes of the release assets reported by the GitHub API.
+
+  Args:
+    releases: List of release dictionaries
+
+  Returns:
+    Dictionary of download URL to size in bytes, None for unknown sizes
+  """
+  return {
+    asset["browser_download_url"]: asset.get("size")
+    for release in releases
+    for asset in release.get("assets", [])
+    if asset.get("browser_download_url")
+  }
+
+
+async def _get_releases_page(client, url, headers):
+  response = await _get_json(client, url, headers)
+  return [_slim_release(r) for r in response.json()], response.headers.get("link", "")
+
+
+async def fetch_github_releases(client, repo, until=None):
+  """
+  Fetch the releases of a GitHub repository, newest first.
+
+  Each page is reduced to the fields in _slim_release as it arrives. Without until, the
+  first page tells the number of pages and the remaining pages are fetched concurrently.
+  With until, pages are fetched one by one and fetching stops once it returns True.
+
+  Args:
+    client: httpclient.Client
+    repo: Repository as owner/name
+    until: Called with the releases fetched so far after each page
+
+  Returns:
+    List of release dictionaries or None if failed
+  """
+  url = f"{GITHUB_API_URL}/repos/{repo}/releases?per_page={PER_PAGE}"
+  headers = _github_headers()
+
+  try:
+    releases, link = await _get_releases_page(client, url, headers)
+
+    if until is None:
+      match = re.search(r'[?&]page=(\d+)[^>]*>;\s*rel="last"', link)
+      pages = int(match.group(1)) if match else 1
+      results = await asyncio.gather(*[
+        _get_releases_page(client, f"{url}&page={page}", headers) for page in range(2, pages + 1)
+      ])
+      for page_releases, _ in results:
+        releases += page_releases
+      return releases
+
+    # Follow the next links until the caller has enough
+    while not until(releases) and (match := re.search(r'<([^>]+)>;\s*rel="next"', link)):
+      page_releases, link = await _get_releases_page(client, match.group(1), headers)
+      releases += page_releases
+  except (httpclient.HTTPError, OSError, json.JSONDecodeError) as e:
+    print(f"Error fetching {repo} releases: {e}", file=sys.stderr)
+    return None
+
+  return releases
+
+
+async def fetch_text(client, url):
+  """
+  Fetch a text document, e.g., a buildbot directory listing.
+
+  Args:
+    client: httpclient.Client
+    url: Document URL
+
+  Returns:
+    Document text or None if failed
+  """
+  try:
+    response = await client.get(url)
+  except (httpclient.HTTPError, OSError) as e:
+    print(f"Error fetching {url}: {e}", file=sys.stderr)
+    return None
+
+  if response.status != 200:
+    print(f"Error fetching {url}: HTTP {response.status}", file=sys.stderr)
+    return None
+
+  return response.text()
+
+
+async def fetch_size(client, url):
+  """
+  Fetch the size of a download without downloading it.
+
+  Args:
+    client: httpclient.Client
+    url: Download URL
+
+  Returns:
+    Size in bytes or None if unknown
+  """
+  try:
+    response = await client.head(url, {"Accept-Encoding": "identity"})
+  except (httpclient.HTTPError, OSError) as e:
+    print(f"Error fetching the size of {url}: {e}", file=sys.stderr)
+    return None
+
+  if response.status != 200 or not response.headers.get("content-length", "").isdigit():
+    return None
+
+  return int(response.headers["content-length"])
+
+
+def github_releases(repos, until=None):
+  """
+  Fetch the releases of several GitHub repositories in one concurrent round.
+
+  Args:
+    repos: List of repositories as owner/name
+    until: Called with the repository and its releases fetched so far after each page,
+      fetching of a repository stops once it returns True, see fetch_github_releases
+
+  Returns:
+    Dictionary of repository to list of release dictionaries, None for failed repositories
+  """
+  async def fetch():
+    async with _client() as client:
+      results = await asyncio.gather(*[
+        fetch_github_releases(client, repo, until and (lambda releases, repo=repo: until(repo, releases)))
+        for repo in repos
+      ])
+    return dict(zip(repos, results))
+
+  return asyncio.run(fetch())
+
+
+def text(url):
+  """
+  Fetch a text document.
+
+  Args:
+    url: Document URL
+
+  Returns:
+    Document text or None if failed
+  """
+  async def fetch():
+    async with _client() as client:
+      return await fetch_text(client, url)
+
+  return asyncio.run(fetch())
+
+
+def sizes(urls):
+  """
+  Fetch the sizes of several downloads in one concurrent round.
+
+  Args:
+    urls: List of download URLs
+
+  Returns:
+    Dictionary of URL to size in bytes, None for unknown sizes
+  """
+  async def fetch():
+    async with _client() as client:
+      return await asyncio.gather(*[fetch_size(client, url) for url in urls])
+
+  return dict(zip(urls, asyncio.run(fetch())))
@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+
+######################################################################
+# @author      : Ruan E. Formigoni (ruanformigoni@gmail.com)
+# @file        : verify
+# @description : Smoke test runner layers without a GPU
+######################################################################
+
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import elf
+import headless
+
+SCRIPT_DIR = Path(__file__).parent
+
+# Main binary and arguments probed for each platform, relative to the version directory
+PROBES = {
+  "pcsx2": ("bin/pcsx2-qt", ["--help"]),
+  "rpcs3": ("bin/rpcs3", ["--version"]),
+  "retroarch": ("data/bin/retroarch", ["--version"]),
+  "wine": ("bin/wine", ["--version"]),
+}
+
+# Bundled library directories, mirrors LD_LIBRARY_PATH of the boot scripts
+BUNDLED_LIB_DIRS = ["lib", "data/lib"]
+
+PROBE_TIMEOUT = 60
+
+LOADER_ERROR = re.compile(
+  r"error while loading shared libraries|cannot open shared object file|version `[^']+' not found"
+)
+
+
+def list_container_libs(image_path):
+  """
+  List the libraries available in the container.
+
+  Args:
+    image_path: Path to the flatimage
+
+  Returns:
+    Dictionary of ELF class (32 or 64) to the set of library file names
+  """
+  result = subprocess.run(
+    [str(image_path), "fim-exec", "sh", "-c", "ls -1 /usr/lib; echo '--'; ls -1 /usr/lib32 2>/dev/null || true"],
+    capture_output=True,
+    text=True,
+    env=headless.container_env(image_path),
+  )
+
+  if result.returncode != 0:
+    print(f"Error listing container libraries: {result.stderr}", file=sys.stderr)
+    return {64: set(), 32: set()}
+
+  libs_64, _, libs_32 = result.stdout.partition("--\n")
+  return {64: set(libs_64.split()), 32: set(libs_32.split())}
+
+
+def find_runners(root_dir):
+  """
+  Find the runner version directories in a staged tree.
+
+  Args:
+    root_dir: Root of the staged tree
+
+  Returns:
+    List of (platform, version directory) tuples
+  """
+  runners = []
+  # Structure: /opt/gameimage/runners/{platform}/{owner}/{repo}/{dist}/{channel}/{version}/
+  for version_dir in sorted(Path(root_dir).glob("opt/gameimage/runners/*/*/*/*/*/*")):
+    if version_dir.is_dir():
+      runners.append((version_dir.relative_to(root_dir).parts[3], version_dir))
+  return runners
+
+
+def find_missing_libraries(binary, version_dir, container_libs):
+  """
+  Resolve the DT_NEEDED closure of a binary against the bundled and container libraries.
+
+  Args:
+    binary: Path to the ELF binary
+    version_dir: Runner version directory, bundled libraries are searched in it
+    container_libs: Libraries available in the container, see list_container_libs
+
+  Returns:
+    List of error strings for unresolved libraries
+  """
+  errors = []
+  queue = [Path(binary)]
+  visited = set()
+
+  while queue:
+    current = queue.pop()
+    if current in visited:
+      continue
+    visited.add(current)
+
+    info = elf.read_elf(current)
+    if info is None:
+      errors.append(f"{current.relative_to(version_dir)}: not a readable ELF file")
+      continue
+
+    search_dirs = [version_dir / d for d in BUNDLED_LIB_DIRS]
+    search_dirs += [Path(p.replace("$ORIGIN", str(current.parent))) for p in info["runpath"]]
+
+    for needed in info["needed"]:
+      bundled = None
+      for search_dir in search_dirs:
+        candidate = search_dir / needed
+        if candidate.exists() and (elf.read_elf(candidate) or {}).get("bits") == info["bits"]:
+          bundled = candidate.resolve()
+          break
+      if bundled:
+        queue.append(bundled)
+      elif needed not in container_libs[info["bits"]]:
+        errors.append(f"{current.name}: unresolved {needed} ({info['bits']}-bit)")
+
+  return errors
+
+
+def probe(image_path, binary, version_dir, args):
+  """
+  Execute a binary in the container under a headless environment.
+
+  Args:
+    image_path: Path to the flatimage
+    binary: Path to the binary
+    version_dir: Runner version directory
+    args: Arguments for the binary
+
+  Returns:
+    Error string or None if successful
+  """
+  lib_path = ":".join(str((version_dir / d).resolve()) for d in BUNDLED_LIB_DIRS)
+  try:
+    result = subprocess.run(
+      [str(image_path), "fim-exec", "env", *headless.ENV, f"LD_LIBRARY_PATH={lib_path}",
+        str(binary.resolve()), *args],
+      capture_output=True,
+      text=True,
+      errors="replace",
+      timeout=PROBE_TIMEOUT,
+      env=headless.container_env(image_path),
+    )
+  except subprocess.TimeoutExpired:
+    return f"{binary.name} {' '.join(args)}: timed out after {PROBE_TIMEOUT}s"
+
+  output = result.stdout + result.stderr
+  if LOADER_ERROR.search(output) or result.returncode in (126, 127) or result.returncode < 0:
+    return f"{binary.name} {' '.join(args)}: exit code {result.returncode}: {output.strip()[-500:]}"
+
+  return None
+
+
+def verify_tree(image_path, root_dir, container_libs):
+  """
+  Verify the runners of a staged tree.
+
+  Args:
+    image_path: Path to the flatimage
+    root_dir: Root of the staged tree
+    container_libs: Libraries available in the container, see list_container_libs
+
+  Returns:
+    List of error strings, empty if the tree is valid
+  """
+  runners = find_runners(root_dir)
+  if not runners:
+    return ["no runner found in /opt/gameimage/runners"]
+
+  errors = []
+  libs_all = container_libs[64] | container_libs[32]
+  for platform, version_dir in runners:
+    name = version_dir.relative_to(root_dir)
+
+    # Boot script
+    boot = version_dir / "boot"
+    if not boot.is_file() or not os.access(boot, os.X_OK):
+      errors.append(f"{name}: boot is missing or not executable")
+
+    if platform not in PROBES:
+      continue
+
+    binary_rel, args = PROBES[platform]
+    binary = version_dir / binary_rel
+    if not binary.is_file():
+      errors.append(f"{name}: {binary_rel} is missing")
+      continue
+
+    # ELF interpreter
+    info = elf.read_elf(binary)
+    if info and info["interp"] and Path(info["interp"]).name not in libs_all:
+      errors.append(f"{name}: interpreter {info['interp']} not found in container")
+
+    # Library closure
+    errors += [f"{name}: {e}" for e in find_missing_libraries(binary, version_dir, container_libs)]
+
+    # Headless execution
+    if error := probe(image_path, binary, version_dir, args):
+      errors.append(f"{name}: {error}")
+
+  return errors
+
+
+def verify_layer(image_path, layer_path, container_libs):
+  """
+  Extract a layer and verify its runners.
+
+  Args:
+    image_path: Path to the flatimage
+    layer_path: Path to the layer file
+    container_libs: Libraries available in the container, see list_container_libs
+
+  Returns:
+    List of error strings, empty if the layer is valid
+  """
+  # Extract under the build directory, the container only sees the home directory
+  build_dir = SCRIPT_DIR / "build"
+  build_dir.mkdir(exist_ok=True)
+  root_dir = Path(tempfile.mkdtemp(prefix="verify-", dir=build_dir))
+
+  try:
+    try:
+      result = subprocess.run(
+        ["dwarfsextract", "-i", str(layer_path), "-o", str(root_dir)],
+        capture_output=True,
+      )
+    except FileNotFoundError:
+      return ["failed to extract: dwarfsextract not found"]
+    if result.returncode != 0:
+      return [f"failed to extract: {result.stderr.decode(errors='replace').strip()}"]
+
+    return verify_tree(image_path, root_dir, container_libs)
+  finally:
+    shutil.rmtree(root_dir, ignore_errors=True)
+
+
+def layer_checksum(layer_path):
+  """
+  Read the checksum of a layer from its .sha256sum file.
+
+  Args:
+    layer_path: Path to the layer file
+
+  Returns:
+    Checksum string or None if there is no checksum file
+  """
+  checksum_file = layer_path.parent / f"{layer_path.name}.sha256sum"
+  if not checksum_file.exists():
+    return None
+  return checksum_file.read_text().split()[0]
+
+
+def main():
+  if len(sys.argv) < 2:
+    print("Usage: verify.py <image_path> [layer|directory...]")
+    print("Verifies all runner layers in dist/ if no layer or staged directory is given")
+    sys.exit(1)
+
+  image_path = Path(sys.argv[1])
+
+  if not image_path.is_file():
+    print(f"Error: {image_path} is not a regular file")
+    sys.exit(1)
+
+  dist_dir = SCRIPT_DIR / "dist"
+  targets = [Path(p) for p in sys.argv[2:]]
+  if not targets:
+    # Runner layers follow platform--owner--repo--distribution--channel--version
+    targets = [l for l in sorted(dist_dir.glob("*.layer")) if len(l.stem.split("--")) == 6]
+
+  # Checksums of the layers that passed in a previous run
+  cache_file = dist_dir / ".verify.json"
+  cache = json.loads(cache_file.read_text()) if cache_file.exists() else {}
+
+  pending = []
+  for target in targets:
+    checksum = layer_checksum(target) if target.is_file() else None
+    if checksum and cache.get(target.name) == checksum:
+      print(f"Unchanged, skipping: {target.name}")
+      continue
+    pending.append((target, checksum))
+
+  if not pending:
+    return
+
+  # Layers are extracted with dwarfs, fail before testing anything without it
+  if not shutil.which("dwarfsextract") and any(target.is_file() for target, _ in pending):
+    print("Error: dwarfsextract is required to verify layers, install dwarfs or pass staged directories",
+      file=sys.stderr)
+    sys.exit(1)
+
+  container_libs = list_container_libs(image_path)
+
+  def verify(target):
+    if target.is_dir():
+      return verify_tree(image_path, target, container_libs)
+    return verify_layer(image_path, target, container_libs)
+
+  jobs = int(os.environ.get("VERIFY_JOBS", os.cpu_count() or 1))
+  with ThreadPoolExecutor(max_workers=jobs) as executor:
+    results = list(executor.map(verify, [target for target, _ in pending]))
+
+  failed = 0
+  for (target, checksum), errors in zip(pending, results):
+    if errors:
+      failed += 1
+      print(f"FAIL: {target.name}", file=sys.stderr)
+      for error in errors:
+        print(f"  {error}", file=sys.stderr)
+    else:
+      print(f"OK: {target.name}")
+      if checksum:
+        cache[target.name] = checksum
+
+  if dist_dir.exists():
+    cache_file.write_text(json.dumps(cache, indent=2))
+
+  if failed:
+    print(f"{failed} of {len(pending)} verified layers failed", file=sys.stderr)
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+  main()
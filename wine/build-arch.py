@@ -6,16 +6,42 @@
 # @description : Build wine distribution layers
 ######################################################################
 
+import argparse
+import contextlib
 import json
+import os
 import subprocess
 import sys
 import shutil
 import re
+import time
 from pathlib import Path
 from collections import defaultdict
 
 SCRIPT_DIR = Path(__file__).parent
 
+# Build and dist directories, overridden by the workers of a job queue, see jobqueue.py
+BUILD_DIR = Path(os.environ.get("GAMEIMAGE_BUILD_DIR", SCRIPT_DIR / "build")).resolve()
+DIST_DIR = Path(os.environ.get("GAMEIMAGE_DIST_DIR", SCRIPT_DIR.parent / "dist")).resolve()
+
+# Repository of each wine distribution
+WINE_REPOS = {
+  "caffe": "bottlesdevs/wine",
+  "vaniglia": "bottlesdevs/wine",
+  "soda": "bottlesdevs/wine",
+  "staging": "Kron4ek/Wine-Builds",
+  "tkg": "Kron4ek/Wine-Builds",
+}
+
+# Shared modules live in the repository root
+sys.path.insert(0, str(SCRIPT_DIR.resolve().parent))
+import builddb  # noqa: E402
+import disk  # noqa: E402
+import journal  # noqa: E402
+import layer  # noqa: E402
+import metadata  # noqa: E402
+import source  # noqa: E402
+
 
 def get_latest_per_major_version(urls, count=10):
   """
@@ -54,69 +80,119 @@ def get_latest_per_major_version(urls, count=10):
   return result
 
 
-def fetch_wine_urls(dist_name):
+def get_dist_urls(dist_name, releases):
   """
-  Fetch download URLs for a wine distribution.
+  Collect the download URLs of a wine distribution from GitHub releases.
 
   Args:
     dist_name: Name of the wine distribution (caffe, vaniglia, soda, staging, tkg)
+    releases: List of release dictionaries of its repository
 
   Returns:
     List of download URLs
   """
+  urls = []
+
   if dist_name in ["caffe", "vaniglia", "soda"]:
     # Fetch from bottlesdevs/wine
-    result = subprocess.run(
-      ["gh", "api", "--paginate", "repos/bottlesdevs/wine/releases"],
-      capture_output=True,
-      text=True
-    )
-
-    if result.returncode != 0:
-      print(f"Error fetching {dist_name} releases: {result.stderr}", file=sys.stderr)
-      return []
-
-    try:
-      releases = json.loads(result.stdout)
-      urls = []
-      for release in releases:
-        for asset in release.get("assets", []):
-          url = asset.get("browser_download_url", "")
-          # Filter out experimental and cx/vaniglia variants
-          if "experimental" not in url and "cx/vaniglia" not in url and dist_name in url:
-            urls.append(url)
-      return urls
-    except json.JSONDecodeError as e:
-      print(f"Error parsing JSON for {dist_name}: {e}", file=sys.stderr)
-      return []
+    for release in releases:
+      for asset in release.get("assets", []):
+        url = asset.get("browser_download_url", "")
+        # Filter out experimental and cx/vaniglia variants
+        if "experimental" not in url and "cx/vaniglia" not in url and dist_name in url:
+          urls.append(url)
 
   elif dist_name in ["staging", "tkg"]:
     # Fetch from Kron4ek/Wine-Builds
-    result = subprocess.run(
-      ["gh", "api", "--paginate", "repos/Kron4ek/Wine-Builds/releases"],
-      capture_output=True,
-      text=True
+    pattern = f".*{dist_name}-amd64.tar.*"
+    for release in releases:
+      for asset in release.get("assets", []):
+        url = asset.get("browser_download_url", "")
+        if re.search(pattern, url):
+          urls.append(url)
+
+  return urls
+
+
+def is_selection_complete(urls, count):
+  """
+  Check if older releases can no longer change the result of get_latest_per_major_version.
+
+  Releases are listed newest first, once more than count major versions showed up the
+  remaining releases belong to older major versions than the selected ones.
+
+  Args:
+    urls: List of download URLs, newest first
+    count: Number of major versions to keep
+
+  Returns:
+    True if the selection is complete, False otherwise
+  """
+  majors = set()
+  for url in urls:
+    match = re.search(r'[_-](\d+)\.(\d+)', Path(url).name)
+    if match:
+      majors.add(match.group(1))
+  return len(majors) > count
+
+
+def select_versions(urls, versions):
+  """
+  Select the URLs of specific wine versions.
+
+  Args:
+    urls: List of download URLs
+    versions: List of version strings, e.g., 9.0 or wine-9.0
+
+  Returns:
+    List of URLs whose version is in versions
+  """
+  versions = {v.removeprefix("wine-") for v in versions}
+  selected = []
+  for url in urls:
+    match = re.search(r'[_-](\d+\.\d+(?:\.\d+)?)', Path(url).name)
+    if match and match.group(1) in versions:
+      selected.append(url)
+  return selected
+
+
+def fetch_wine_urls(dist_names, count=None):
+  """
+  Fetch download URLs for wine distributions.
+
+  The releases of all repositories are fetched in one concurrent round, page by page.
+  Fetching of a repository stops once the selections of get_latest_per_major_version for
+  its distributions are complete, all releases are fetched without a count.
+
+  Args:
+    dist_names: Names of the wine distributions (caffe, vaniglia, soda, staging, tkg)
+    count: Number of major versions to select for each distribution
+
+  Returns:
+    Tuple of (dictionary of distribution name to list of download URLs, sizes), see
+    source.asset_sizes
+  """
+  def is_complete(repo, releases):
+    return all(
+      is_selection_complete(get_dist_urls(d, releases), count)
+      for d in dist_names if WINE_REPOS.get(d) == repo
     )
 
-    if result.returncode != 0:
-      print(f"Error fetching {dist_name} releases: {result.stderr}", file=sys.stderr)
-      return []
+  repos = sorted({WINE_REPOS[d] for d in dist_names if d in WINE_REPOS})
+  releases_by_repo = source.github_releases(repos, until=is_complete if count is not None else None)
 
-    try:
-      releases = json.loads(result.stdout)
-      urls = []
-      pattern = f".*{dist_name}-amd64.tar.*"
-      for release in releases:
-        for asset in release.get("assets", []):
-          url = asset.get("browser_download_url", "")
-          if re.search(pattern, url):
-            urls.append(url)
-      return urls
-    except json.JSONDecodeError as e:
-      print(f"Error parsing JSON for {dist_name}: {e}", file=sys.stderr)
-      return []
-
-  return []
+  urls_by_dist = {
+    dist_name: get_dist_urls(dist_name, releases_by_repo.get(WINE_REPOS.get(dist_name)) or [])
+    for dist_name in dist_names
+  }
+  # Empty when all fetches failed, the journal does not record it
+  if not any(urls_by_dist.values()):
+    return {}, {}
+
+  sizes = {}
+  for releases in releases_by_repo.values():
+    sizes.update(source.asset_sizes(releases or []))
+  return urls_by_dist, sizes
 
 
 def download(url, dest_dir):
@@ -135,20 +211,92 @@ def download(url, dest_dir):
   print(f"link_wine: {url}")
   print(f"file_name: {filename}")
 
-  # Download if not already present
-  if not Path(filename).exists():
-    result = subprocess.run(
-      ["wget", "--progress=dot:mega", url],
-      capture_output=False
-    )
-    if result.returncode != 0:
-      print(f"Error downloading {url}", file=sys.stderr)
-      return None
+  # Download, continuing the partial download of an interrupted build
+  result = subprocess.run(
+    ["wget", "--progress=dot:mega", "-c", url],
+    capture_output=False
+  )
+  if result.returncode != 0:
+    print(f"Error downloading {url}", file=sys.stderr)
+    return None
 
   return Path(filename)
 
 
-def build_layer(image_path, dist_name, tarball_path, owner, repo):
+def build_prefix_template(image_path, wine_dir):
+  """
+  Create a pre-initialized wine prefix inside the wine directory.
+
+  The prefix is initialized inside the container with the freshly extracted wine, so the boot
+  script can clone it into an empty $WINEPREFIX instead of running wineboot on first launch.
+
+  Args:
+    image_path: Path to the flatimage
+    wine_dir: Path to the extracted wine directory
+
+  Returns:
+    True if successful, False otherwise
+  """
+  prefix_dir = (wine_dir / "prefix").resolve()
+  bin_dir = (wine_dir / "bin").resolve()
+
+  print(f"Creating prefix template: {prefix_dir}")
+
+  # Mount the 32-bit and wine dependency layers released next to the core image
+  layers = [Path(image_path).parent / f"arch--{name}.layer" for name in ["lib32", "wine"]]
+  env = {**os.environ, "FIM_DIRS_LAYER": ":".join(str(l.resolve()) for l in layers if l.exists())}
+
+  # Mono and gecko installers are skipped, they would open dialogs in a headless build
+  result = subprocess.run(
+    [str(image_path), "fim-exec", "env",
+      f"WINEPREFIX={prefix_dir}",
+      f"PATH={bin_dir}:/usr/bin",
+      "WINEDEBUG=-all",
+      "WINEDLLOVERRIDES=mscoree,mshtml=",
+      "sh", "-c", "wineboot --init && wineserver --wait"],
+    capture_output=True,
+    env=env,
+  )
+
+  if result.returncode != 0 or not (prefix_dir / "system.reg").exists():
+    print(f"Error creating prefix template: {result.stderr.decode()}", file=sys.stderr)
+    shutil.rmtree(prefix_dir, ignore_errors=True)
+    return False
+
+  # Wine updates prefixes whose timestamp differs from the modification time of wine.inf,
+  # which the layer clamps, see layer.normalize
+  timestamp_file = prefix_dir / ".update-timestamp"
+  if timestamp_file.exists() and not timestamp_file.read_text().startswith("disable"):
+    timestamp_file.write_text(f"{layer.SOURCE_DATE_EPOCH}\n")
+
+  return True
+
+
+def include_shader_cache_seed(wine_dir, seed_dir):
+  """
+  Include pre-seeded shader caches for known titles in the wine directory.
+
+  Args:
+    wine_dir: Path to the extracted wine directory
+    seed_dir: Directory with one sub-directory per game executable name, e.g., game.exe/
+
+  Returns:
+    Number of titles included
+  """
+  seed_dir = Path(seed_dir)
+  if not seed_dir.is_dir():
+    print(f"Error: shader cache seed directory not found at {seed_dir}", file=sys.stderr)
+    return 0
+
+  titles = [d for d in sorted(seed_dir.iterdir()) if d.is_dir()]
+  for title in titles:
+    print(f"Including shader cache seed: {title.name}")
+    shutil.copytree(title, wine_dir / "shader-cache" / title.name, dirs_exist_ok=True)
+
+  return len(titles)
+
+
+def build_layer(image_path, dist_name, tarball_path, owner, repo, stage_dir):
   """
   Build a wine layer from an extracted tarball.
 
@@ -158,12 +306,14 @@ def build_layer(image_path, dist_name, tarball_path, owner, repo):
     tarball_path: Path to the wine tarball
     owner: Repository owner
     repo: Repository name
+    stage_dir: Directory to extract and assemble the layer tree in
 
   Returns:
-    True if successful, False otherwise
+    Tuple of (path to created layer file, runner metadata, see metadata.extract) or None if
+    failed
   """
   # First, extract wine to get the version
-  root_dir = Path("root")
+  root_dir = stage_dir / "root"
   temp_wine_dir = root_dir / "temp_wine"
   temp_wine_dir.mkdir(parents=True, exist_ok=True)
 
@@ -176,28 +326,46 @@ def build_layer(image_path, dist_name, tarball_path, owner, repo):
 
   if result.returncode != 0:
     print(f"Error extracting {tarball_path}: {result.stderr.decode()}", file=sys.stderr)
-    return False
+    return None
 
   # Remove tarball
   tarball_path.unlink()
 
-  # Get wine version
-  wine_bin = temp_wine_dir / "bin" / "wine"
-  result = subprocess.run(
-    [str(wine_bin.resolve()), "--version"],
-    capture_output=True,
-    text=True
-  )
+  # Get wine version from its libraries, running wine on the build host is slow and fails
+  # without 32-bit support, builds whose libraries have no build string are still run
+  version_wine = metadata.wine_version(temp_wine_dir)
+  if version_wine is None:
+    wine_bin = temp_wine_dir / "bin" / "wine"
+    try:
+      result = subprocess.run(
+        [str(wine_bin.resolve()), "--version"],
+        capture_output=True,
+        text=True,
+        timeout=60
+      )
+    except subprocess.TimeoutExpired:
+      print("Error getting wine version: timed out", file=sys.stderr)
+      return None
 
-  if result.returncode != 0:
-    print(f"Error getting wine version: {result.stderr}", file=sys.stderr)
-    return False
+    if result.returncode != 0:
+      print(f"Error getting wine version: {result.stderr}", file=sys.stderr)
+      return None
 
-  version_wine = result.stdout.strip().split()[0]
+    version_wine = result.stdout.strip().split()[0]
   print(f"wine version: {version_wine}")
 
+  # Optionally ship a pre-initialized prefix with the layer
+  if os.environ.get("GAMEIMAGE_WINE_PREFIX_TEMPLATE", "0") == "1":
+    if not build_prefix_template(image_path, temp_wine_dir):
+      print(f"Continuing without prefix template for {version_wine}", file=sys.stderr)
+
+  # Optionally ship pre-seeded shader caches for known titles
+  if seed_dir := os.environ.get("GAMEIMAGE_SHADER_CACHE_SEED"):
+    include_shader_cache_seed(temp_wine_dir, seed_dir)
+
   # Copy wine boot script before moving
   shutil.copy(SCRIPT_DIR / "wine.sh", temp_wine_dir / "boot")
+  shutil.copy(SCRIPT_DIR.resolve().parent / "profile.sh", temp_wine_dir / "profile.sh")
 
   # Create layer directories with version
   # Structure: /opt/gameimage/runners/wine/{owner}/{repo}/{dist_name}/stable/{version}/
@@ -207,78 +375,190 @@ def build_layer(image_path, dist_name, tarball_path, owner, repo):
   # Move temp_wine_dir (which contains bin/wine) to version directory
   shutil.move(str(temp_wine_dir), str(layer_version_dir))
 
+  # Static metadata of the staged runner, published with the layer
+  runner = metadata.extract("wine", layer_version_dir, version_wine)
+
   # Create layer with platform--owner--repo--dist--channel--version format
   # All wine releases are considered stable (they don't use GitHub prerelease/draft)
   layer_name = f"wine--{owner}--{repo}--{dist_name}--stable--{version_wine}.layer"
   print(f"Creating layer: {layer_name}")
 
-  result = subprocess.run(
-    [str(image_path), "fim-layer", "create", str(root_dir), layer_name],
-    capture_output=True,
-    env={**subprocess.os.environ, "FIM_DEBUG": "1"}
-  )
+  # A partial layer of an interrupted build
+  disk.remove(layer_name)
 
-  if result.returncode != 0:
-    print(f"Error creating layer: {result.stderr.decode()}", file=sys.stderr)
-    return False
+  # Identical metadata across builds, the layer is byte-identical for the same sources
+  layer.normalize(root_dir)
+  if not layer.create_layer(image_path, root_dir, layer_name):
+    disk.remove(layer_name)
+    return None
 
   # Remove temporary directory
   shutil.rmtree(root_dir)
 
-  return True
+  return Path(layer_name), runner
 
 
-def package_wine_dists(image_path):
+def build_release(image_path, url, dist_name, owner, repo, size, budget, build_journal):
   """
-  Package all wine distributions.
+  Download and package a wine release, reusing the stages an interrupted build completed.
 
   Args:
     image_path: Path to the flatimage
+    url: Download URL of the tarball
+    dist_name: Wine distribution name
+    owner: Repository owner
+    repo: Repository name
+    size: Download size in bytes, None if unknown
+    budget: disk.Budget of the build directory
+    build_journal: journal.Journal of the build directory
+
+  Returns:
+    Tuple of (layer name, build database fields) or None if failed
   """
-  wine_dists = ["caffe", "vaniglia", "soda", "staging", "tkg"]
+  if record := build_journal.reuse(url, "layer"):
+    return record["path"].name, record["fields"]
+
+  if not budget.admit(Path(url).name, size):
+    return None
 
+  start = time.monotonic()
+
+  # The prefix template is initialized inside the container, keep its tree where the
+  # container sees it
+  if os.environ.get("GAMEIMAGE_WINE_PREFIX_TEMPLATE", "0") == "1":
+    stage = contextlib.nullcontext(Path.cwd())
+  else:
+    stage = budget.stage(Path(url).name, size)
+
+  # Intermediates of failed stages
+  with budget.track(Path(url).name, size, [Path(Path(url).name), Path("root")]), stage as stage_dir:
+    tarball_path = Path(Path(url).name)
+    if not build_journal.reuse(url, "download"):
+      tarball_path = download(url, Path.cwd())
+      if not tarball_path or not journal.check_size(tarball_path, size):
+        return None
+      build_journal.done(url, "download", tarball_path)
+
+    # Extract and build layer, over leftovers of an interrupted layer creation
+    disk.remove(stage_dir / "root")
+    result = build_layer(image_path, dist_name, tarball_path, owner, repo, stage_dir)
+    if not result:
+      print(f"Failed to build layer for {url}", file=sys.stderr)
+      return None
+    layer_path, runner = result
+
+  fields = {
+    "source_url": url,
+    "build_seconds": time.monotonic() - start,
+    "compression": layer.PROFILE,
+    "meta": {"runner": runner},
+  }
+  build_journal.done(url, "layer", layer_path, fields=fields)
+
+  return layer_path.name, fields
+
+
+def select_jobs(build_journal, wine_dists=None, count=6, versions=None):
+  """
+  Select the wine releases to build.
+
+  Args:
+    build_journal: journal.Journal of the build directory
+    wine_dists: Names of the wine distributions to build (default: all)
+    count: Number of major versions to build per distribution (default: 6)
+    versions: Build these versions instead of the latest of each major version
+
+  Returns:
+    List of jobs, dictionaries with the keys url, dist_name, owner, repo and size, see
+    build_release
+  """
+  wine_dists = wine_dists or list(WINE_REPOS)
+
+  # Fetch the URLs needed for the selection, specific versions can be in any release, a
+  # resumed build reuses the URLs of the interrupted one
+  fetch_count = None if versions else count
+  urls_by_dist, sizes = build_journal.memo(
+    "fetch", [source.SOURCE, wine_dists, fetch_count], lambda: fetch_wine_urls(wine_dists, count=fetch_count)
+  )
+
+  jobs = []
   for dist_name in wine_dists:
-    print(f"\n=== Processing {dist_name} ===")
+    print(f"\n=== Selecting {dist_name} ===")
 
     # Determine repository based on distribution
-    if dist_name in ["caffe", "vaniglia", "soda"]:
-      owner = "bottlesdevs"
-      repo = "wine"
-    elif dist_name in ["staging", "tkg"]:
-      owner = "Kron4ek"
-      repo = "Wine-Builds"
-    else:
+    if dist_name not in WINE_REPOS:
       print(f"Unknown distribution: {dist_name}", file=sys.stderr)
       continue
+    owner, repo = WINE_REPOS[dist_name].split("/")
 
-    # Fetch all URLs
-    all_urls = fetch_wine_urls(dist_name)
+    all_urls = urls_by_dist.get(dist_name)
     if not all_urls:
       print(f"No URLs found for {dist_name}, skipping...")
       continue
 
-    # Get latest from each of the last 6 major versions
-    selected_urls = get_latest_per_major_version(all_urls, count=6)
+    if versions:
+      selected_urls = select_versions(all_urls, versions)
+    else:
+      # Get latest from each of the last count major versions
+      selected_urls = get_latest_per_major_version(all_urls, count=count)
 
     print(f"Found {len(selected_urls)} versions to build for {dist_name}")
 
-    # Process each version
-    for url in selected_urls:
-      tarball_path = download(url, Path.cwd())
-      if not tarball_path:
-        continue
+    jobs += [
+      {"url": url, "dist_name": dist_name, "owner": owner, "repo": repo, "size": sizes.get(url)}
+      for url in selected_urls
+    ]
 
-      if not build_layer(image_path, dist_name, tarball_path, owner, repo):
-        print(f"Failed to build layer for {url}", file=sys.stderr)
-        continue
+  return jobs
 
 
-def main():
-  if len(sys.argv) != 2:
-    print("Usage: build-arch.py <image_path>")
-    sys.exit(1)
+def package_wine_dists(image_path, jobs, budget, build_journal):
+  """
+  Package wine distributions.
 
-  image_path = Path(sys.argv[1])
+  Args:
+    image_path: Path to the flatimage
+    jobs: List of jobs, see select_jobs
+    budget: disk.Budget of the build directory
+    build_journal: journal.Journal of the build directory
+
+  Returns:
+    Dictionary of built layer names to their build database fields
+  """
+  builds = {}
+
+  for job in jobs:
+    print(f"\n=== Processing {Path(job['url']).name} ({job['dist_name']}) ===")
+
+    # Already moved to dist/ by an interrupted build
+    if build_journal.reuse(job["url"], "dist"):
+      continue
+
+    result = build_release(image_path, **job, budget=budget, build_journal=build_journal)
+    if result:
+      layer_name, fields = result
+      builds[layer_name] = fields
+
+  return builds
+
+def main():
+  parser = argparse.ArgumentParser(description="Build wine distribution layers")
+  parser.add_argument("image", type=Path, help="Path to the flatimage")
+  parser.add_argument("--dists", nargs="+", choices=list(WINE_REPOS), default=list(WINE_REPOS),
+    help="Distributions to build (default: all)")
+  parser.add_argument("--count", type=int, default=6,
+    help="Major versions to build per distribution (default: 6)")
+  parser.add_argument("--versions", nargs="+",
+    help="Build these versions (e.g., 9.0) instead of the latest of each major version")
+  parser.add_argument("--resume", action="store_true", default=journal.RESUME,
+    help="Resume an interrupted build, reusing its completed stages")
+  parser.add_argument("--plan", type=Path,
+    help="Write the selected jobs to this JSON file instead of building them")
+  parser.add_argument("--job", type=json.loads,
+    help="Build a single job of a plan, given as JSON, instead of selecting releases")
+  args = parser.parse_args()
+
+  image_path = args.image
 
   if not image_path.is_file():
     print(f"Error: {image_path} is not a regular file")
@@ -288,19 +568,37 @@ def main():
   subprocess.os.chdir(SCRIPT_DIR)
 
   # Create build and dist directories
-  dist_dir = SCRIPT_DIR.parent / "dist"
-  dist_dir.mkdir(exist_ok=True)
-
-  build_dir = SCRIPT_DIR / "build"
-  build_dir.mkdir(exist_ok=True)
+  dist_dir = DIST_DIR
+  dist_dir.mkdir(parents=True, exist_ok=True)
+
+  # Re-create build directory, unless resuming an interrupted build
+  build_dir = BUILD_DIR
+  if build_dir.exists() and not args.resume:
+    shutil.rmtree(build_dir)
+  build_dir.mkdir(parents=True, exist_ok=True)
   subprocess.os.chdir(build_dir)
+  build_journal = journal.Journal(build_dir)
+
+  # Select the releases
+  if args.job:
+    jobs = [args.job]
+  else:
+    jobs = select_jobs(build_journal, args.dists, count=args.count, versions=args.versions)
+
+  if args.plan:
+    args.plan.write_text(json.dumps(jobs, indent=2))
+    print(f"Planned {len(jobs)} jobs in {args.plan}")
+    return
 
   # Build wine distributions
-  package_wine_dists(image_path)
+  budget = disk.Budget(BUILD_DIR)
+  builds = package_wine_dists(image_path, jobs, budget, build_journal)
 
   # Create SHA256 checksums
   print("\n=== Creating SHA256 checksums ===")
-  for layer_file in Path.cwd().glob("*.layer"):
+  # Only the layers of this run, leftovers of other runs stay out of dist/
+  for layer_name in builds:
+    layer_file = build_dir / layer_name
     checksum_file = dist_dir / f"{layer_file.name}.sha256sum"
     result = subprocess.run(
       ["sha256sum", str(layer_file)],
@@ -312,9 +610,22 @@ def main():
 
   # Move layers to dist
   print("\n=== Moving layers to dist ===")
-  for layer_file in Path.cwd().glob("*.layer"):
-    shutil.copy(layer_file, dist_dir)
-    print(f"Copied {layer_file.name} to dist/")
+  for layer_name, fields in builds.items():
+    layer_file = build_dir / layer_name
+    # A rename on the same filesystem
+    shutil.move(layer_file, dist_dir / layer_file.name)
+    print(f"Moved {layer_file.name} to dist/")
+
+    # Record in the build database
+    builddb.record_layer(dist_dir / layer_file.name, **fields)
+
+    # Completed, a resumed build skips it
+    build_journal.done(fields["source_url"], "dist", dist_dir / layer_file.name)
+
+  # Releases skipped for lack of disk space are missing from dist/
+  if budget.skipped:
+    print(f"\nNot enough disk space for {len(budget.skipped)} releases: {', '.join(budget.skipped)}", file=sys.stderr)
+    sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -25,6 +25,7 @@ function _build_umu()
   tar xf ./"proton.tar.gz" --strip-components=1 -C ./root/opt/wine
   # Copy boot script
   cp "$SCRIPT_DIR"/wine.sh ./root/opt/wine/bin/wine.sh
+  cp "$SCRIPT_DIR"/../profile.sh ./root/opt/wine/bin/profile.sh
   # Download UMU
   wget -Oumu.zip "$2"
   # Extract deb from zip file
@@ -135,6 +136,7 @@ function _package_wine_dists()
 
     # Copy wine boot script
     cp "$SCRIPT_DIR"/wine.sh ./root/opt/wine/bin/wine.sh
+    cp "$SCRIPT_DIR"/../profile.sh ./root/opt/wine/bin/profile.sh
 
     # Compress files
     "$image" fim-layer create ./root ./wine."${dist_wine}".layer -comp zstd
@@ -9,10 +9,16 @@
 shopt -s nullglob
 
 SCRIPT_NAME="$(basename "$0")"
+SCRIPT_DIR="$(cd -- "$(dirname -- "$(readlink -f "${BASH_SOURCE[0]}")")" && pwd)"
 
 exec 1> >(sed "s/^/[$SCRIPT_NAME] /")
 exec 2> >(sed "s/^/[$SCRIPT_NAME] /" >&2)
 
+# Launch profiling, see profile.sh
+source "$SCRIPT_DIR/profile.sh"
+
+_profile_start
+
 # PATH
 export PATH="/opt/wine/bin:/usr/bin:/opt/wine/files/bin/:$PATH"
 
@@ -32,10 +38,17 @@ done
 export WINEDEBUG=${WINEDEBUG:-"-all"}
 export WINEPREFIX="${WINEPREFIX:?"Wine prefix is not defined"}"
 
+# Launch report next to the wine logs
+PROFILE_DIR="${GAMEIMAGE_PROFILE_DIR:-"$WINEPREFIX"}"
+
 # DXVK env
 export DXVK_HUD=${DXVK_HUD:-"0"}
 export DXVK_LOG_LEVEL=${DXVK_LOG_LEVEL:-"none"}
-export DXVK_STATE_CACHE=${DXVK_STATE_CACHE:-"0"}
+export DXVK_STATE_CACHE=${DXVK_STATE_CACHE:-"1"}
+
+# Shader cache env
+GAMEIMAGE_SHADER_CACHE="${GAMEIMAGE_SHADER_CACHE:-"$WINEPREFIX/shader-cache"}"
+GAMEIMAGE_SHADER_CACHE_MAX_MB="${GAMEIMAGE_SHADER_CACHE_MAX_MB:-"2048"}"
 
 # General info
 echo "Container   : $FIM_DIST"
@@ -50,12 +63,27 @@ echo "PATH        : $PATH"
 # Create WINEPREFIX
 mkdir -p "$WINEPREFIX"
 
+# Clone the pre-initialized prefix shipped with the layer, if any
+# Set GAMEIMAGE_PREFIX_TEMPLATE=0 to let wineboot create the prefix instead
+if [[ "${GAMEIMAGE_PREFIX_TEMPLATE:-1}" = 1 ]] \
+  && [[ -f "$SCRIPT_DIR/prefix/system.reg" ]] \
+  && [[ ! -f "$WINEPREFIX/system.reg" ]]; then
+  echo "Prefix template: $SCRIPT_DIR/prefix"
+  # Uses copy-on-write clones when the filesystem supports it
+  cp -a --reflink=auto "$SCRIPT_DIR/prefix/." "$WINEPREFIX/" \
+    || echo "Failed to clone prefix template, wineboot will initialize the prefix"
+fi
+
 # Create wine HOME
 mkdir -p "$HOME"
 
-# Set user
+# Set user, only written when the entry changes
 # Bubblewrap can only have one user
-echo "gameimage:x:$(id -u):$(id -g)::/home/gameimage:/usr/bin/bash" > /etc/passwd
+PASSWD_ENTRY="gameimage:x:$(id -u):$(id -g)::/home/gameimage:/usr/bin/bash"
+if [[ "$(< /etc/passwd)" != "$PASSWD_ENTRY" ]]; then
+  echo "$PASSWD_ENTRY" > /etc/passwd
+  echo "Updated     : /etc/passwd"
+fi
 
 # Check gpu vendor and device
 if command -v glxinfo &>/dev/null && command -v pcregrep &>/dev/null; then
@@ -76,6 +104,61 @@ if command -v vulkaninfo &>/dev/null; then
   echo "Vulkan log  : $WINEPREFIX/vulkan.log"
 fi
 
+# Shader cache, one directory per game and per driver
+# Layout: $GAMEIMAGE_SHADER_CACHE/<game>/<driver>
+function _shader_cache_key()
+{
+  local key="${1:-unknown}"
+  key="${key//[^A-Za-z0-9._-]/_}"
+  echo "${key:0:96}"
+}
+
+# Evict least recently used driver directories until the cache fits the size limit
+# $1 directory in use, never evicted, compared by inode since paths can hold glob characters
+function _shader_cache_evict()
+{
+  local dir_keep="$1"
+  local size_mb
+  local dir_evict
+  while size_mb="$(du -sm "$GAMEIMAGE_SHADER_CACHE" 2>/dev/null | cut -f1)" \
+    && (( size_mb > GAMEIMAGE_SHADER_CACHE_MAX_MB )); do
+    read -r _ dir_evict < <(find "$GAMEIMAGE_SHADER_CACHE" -mindepth 2 -maxdepth 2 -type d \
+      ! -samefile "$dir_keep" -printf '%T@ %p\n' | sort -n)
+    [[ -n "$dir_evict" ]] || break
+    echo "Shader cache: evict $dir_evict"
+    rm -rf "$dir_evict"
+    rmdir --ignore-fail-on-non-empty "$(dirname "$dir_evict")"
+  done
+}
+
+if [[ "$GAMEIMAGE_SHADER_CACHE" != 0 ]]; then
+  SHADER_CACHE_GAME="$(_shader_cache_key "$([[ -f "${BASH_ARGV[0]}" ]] && basename -- "${BASH_ARGV[0]}")")"
+  SHADER_CACHE_DRIVER="$(_shader_cache_key "${INFO_VENDOR:+$INFO_VENDOR-}${INFO_DEVICE}")"
+  SHADER_CACHE_DIR="$GAMEIMAGE_SHADER_CACHE/$SHADER_CACHE_GAME/$SHADER_CACHE_DRIVER"
+  mkdir -p "$SHADER_CACHE_DIR"
+  # Pre-seeded caches shipped with the layer, only used for an empty cache
+  if [[ -d "$SCRIPT_DIR/shader-cache/$SHADER_CACHE_GAME" ]] && [[ -z "$(ls -A "$SHADER_CACHE_DIR")" ]]; then
+    echo "Shader cache: seed from $SCRIPT_DIR/shader-cache/$SHADER_CACHE_GAME"
+    cp -r "$SCRIPT_DIR/shader-cache/$SHADER_CACHE_GAME/." "$SHADER_CACHE_DIR/"
+  fi
+  # Mark as recently used
+  touch "$SHADER_CACHE_DIR"
+  _shader_cache_evict "$SHADER_CACHE_DIR"
+  # DXVK / VKD3D-Proton
+  export DXVK_STATE_CACHE_PATH="${DXVK_STATE_CACHE_PATH:-"$SHADER_CACHE_DIR"}"
+  export VKD3D_SHADER_CACHE_PATH="${VKD3D_SHADER_CACHE_PATH:-"$SHADER_CACHE_DIR"}"
+  # Mesa
+  export MESA_SHADER_CACHE_DIR="${MESA_SHADER_CACHE_DIR:-"$SHADER_CACHE_DIR"}"
+  export MESA_SHADER_CACHE_MAX_SIZE="${MESA_SHADER_CACHE_MAX_SIZE:-"${GAMEIMAGE_SHADER_CACHE_MAX_MB}M"}"
+  # Nvidia
+  export __GL_SHADER_DISK_CACHE_PATH="${__GL_SHADER_DISK_CACHE_PATH:-"$SHADER_CACHE_DIR"}"
+  export __GL_SHADER_DISK_CACHE_SIZE="${__GL_SHADER_DISK_CACHE_SIZE:-"$(( GAMEIMAGE_SHADER_CACHE_MAX_MB * 1024 * 1024 ))"}"
+  export __GL_SHADER_DISK_CACHE_SKIP_CLEANUP="${__GL_SHADER_DISK_CACHE_SKIP_CLEANUP:-"1"}"
+  echo "Shader cache: $SHADER_CACHE_DIR"
+fi
+
+_profile_mark probes
+
 # Check for wine binary
 if ! command -v wine; then
   echo "Binary 'wine' not found or is not a regular file"
@@ -90,10 +173,29 @@ echo "Wine version: $(wine --version)"
 # # Leave the root drive binding
 # ln -sfT / "$WINEPREFIX/dosdevices/z:" || true
 
-# Replace symlinks with directories
-for i in "$WINEPREFIX/drive_c/users/$USER"/*; do
-  if [[ -h "$i" ]]; then rm -fv "$i" && mkdir -v "$i"; fi
-done
+# Launch state of the prefix, fixups only run when it changes
+# The user directory mtime changes whenever wine (re)creates its entries
+function _launch_state()
+{
+  echo "$(id -u):$(id -g):$USER:$WINEPREFIX:$(stat -c %y "$WINEPREFIX/drive_c/users/$USER" 2>/dev/null)"
+}
+
+FILE_LAUNCH_STATE="$WINEPREFIX/.gameimage-launch-state"
+TIME_FIXUP_START="${EPOCHREALTIME/[.,]/}"
+
+if [[ "$(_launch_state)" != "$(cat "$FILE_LAUNCH_STATE" 2>/dev/null)" ]]; then
+  # Replace symlinks with directories
+  for i in "$WINEPREFIX/drive_c/users/$USER"/*; do
+    if [[ -h "$i" ]]; then rm -fv "$i" && mkdir -v "$i"; fi
+  done
+  # Record the state after the fixups, they modify the user directory
+  _launch_state > "$FILE_LAUNCH_STATE"
+  echo "Fixups      : applied in $(( (${EPOCHREALTIME/[.,]/} - TIME_FIXUP_START) / 1000 ))ms"
+else
+  echo "Fixups      : skipped in $(( (${EPOCHREALTIME/[.,]/} - TIME_FIXUP_START) / 1000 ))ms"
+fi
+
+_profile_mark prefix
 
 # If the last argument is an executable path, enter the parent directory
 if [[ -f "${BASH_ARGV[0]}" ]]; then
@@ -103,18 +205,21 @@ if [[ -f "${BASH_ARGV[0]}" ]]; then
 fi
   
 # Start application
+_profile_mark exec
 if [[ "$1" = "winetricks" ]]; then
   shift
-  2>&1 winetricks -f "$@" | tee "$WINEPREFIX/winetricks.log"
+  2>&1 _profile_exec winetricks -f "$@" | tee "$WINEPREFIX/winetricks.log"
   echo "Winetricks log  : $WINEPREFIX/winetricks.log"
 else
   echo "Wine log  : $WINEPREFIX/wine.log"
   # Try to use umu if exists
   if command -v umu-run; then
     echo "Using 'umu-run'"
-    2>&1 umu-run "$@" | tee "$WINEPREFIX/wine.log"
+    2>&1 _profile_exec umu-run "$@" | tee "$WINEPREFIX/wine.log"
   else
     echo "Using 'wine'"
-    2>&1 wine "$@" | tee "$WINEPREFIX/wine.log"
+    2>&1 _profile_exec wine "$@" | tee "$WINEPREFIX/wine.log"
   fi
 fi
+_profile_mark exit
+_profile_report